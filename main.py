@@ -1,12 +1,20 @@
 import argparse
-import boto3
 import datetime
 import json
 import os
+import price.archive
+import price.backfill
+import price.budget
+import price.categories
+import price.checkpoint
 import price.helper
+import price.memory
 import price.munger
 import price.pricespy
+import price.profiler
+import price.publish
 import price.scraper
+import price.storage
 import price.userbenchmark
 import price.webdriver
 import sys
@@ -17,21 +25,36 @@ logger = price.helper.get_logger(__name__, stream=sys.stdout)
 def _add_browser_opts(parser):
 	parser.add_argument('-c', '--chrome', action='store_true', help='download with Chrome (default)')
 	parser.add_argument('-f', '--firefox', action='store_true', help='download with Firefox')
+	parser.add_argument('--flag-set', choices=list(price.webdriver.CHROME_FLAG_SETS), default=price.webdriver.DEFAULT_FLAG_SET,
+		help="Chrome's launch flags, defaults to '{}'. Compare them with 'python -m price.chromebench'".format(price.webdriver.DEFAULT_FLAG_SET))
 
 if __name__ == '__main__': # this hack prevents this code from being run during 'py -m pytest' runs
 	# Allow all arguments to be passed as arguments on the CLI
 	epilog = """possible actions are:
   d   download HTML, parse HTML, munge data, and write locally to 'web' directory
   m   parse HTML, munge data, and write locally to 'web' directory
-  u   upload latest JSON data file from local 'web' directory into S3"""
+  u   upload latest JSON data file from local 'web' directory into S3
+  b   backfill: re-parse and re-munge archived raw HTML for a date range into the local 'web' directory"""
 	parser = argparse.ArgumentParser(description='Welcome to the Price Performance Chart!', formatter_class=argparse.RawTextHelpFormatter, epilog=epilog)
 	parser.add_argument('-v', '--version', action='store_true', help="show browser versions")
+	parser.add_argument('--trace', action='store_true', help="record per-stage timings and counters to 'build/trace_<type>_<yyyyMMdd>.json'")
+	parser.add_argument('--profile', action='store_true', help="profile each stage with cProfile and tracemalloc writing reports to 'build/profile_<type>_<yyyyMMdd>'")
+	parser.add_argument('--memory', action='store_true', help="sample memory (Python and browser processes) and /tmp usage, reporting high-water marks per stage")
+	parser.add_argument('--date', help="date (yyyyMMdd) of the downloaded files to use, defaults to today. E.g. to munge archived HTML with 'm'")
+	parser.add_argument('--budget', type=float, help="seconds the download has, like a Lambda invocation's time remaining. Defaults to unlimited")
+	parser.add_argument('--full-rebuild', action='store_true', help="munge every row from scratch instead of reusing the previous run's name matches")
+	parser.add_argument('--resume', action='store_true', help="download: checkpoint pages to 'build/checkpoints' and reuse the ones an interrupted download of the same day fetched")
 	_add_browser_opts(parser) # Add options here so it shows on the main (no product 'type' subcommand) help
 	subparsers = parser.add_subparsers(title='product types to operate on', dest='type')
-	for product_type in ['cpu', 'hdd']:
+	for product_type in price.categories.load():
 		msg = 'Operate on ' + product_type.upper() + ' information'
 		subparser = subparsers.add_parser(product_type, description=msg, help=msg, formatter_class=argparse.RawTextHelpFormatter, epilog=epilog)
-		subparser.add_argument('action', choices=['d', 'm', 'u'], help='Action to take', nargs ='?')
+		subparser.add_argument('action', choices=['d', 'm', 'u', 'b'], help='Action to take', nargs ='?')
+		subparser.add_argument('--start', help='backfill: first date to process (yyyyMMdd), defaults to the earliest archived')
+		subparser.add_argument('--end', help='backfill: last date to process (yyyyMMdd), defaults to the latest archived')
+		subparser.add_argument('--mirror', help="backfill: read archived files from this local directory instead of S3's 'tmp' prefix")
+		subparser.add_argument('--archive', action='store_true', help="backfill: read from the deduplicated archive in S3's 'tmp/archive' prefix")
+		subparser.add_argument('--workers', type=int, help='backfill: number of processes to use, defaults to the number of CPUs')
 	args = parser.parse_args()
 	if not hasattr(args, 'action'):
 		setattr(args, 'action', None) # Hack args.action = None to make prompt behaviour below easier
@@ -51,55 +74,99 @@ if __name__ == '__main__': # this hack prevents this code from being run during
 		parser.print_help()
 		print()
 	while args.type is None:
-		response = input("What product type do you want operate on {cpu,hdd}? ")
-		if response.lower() == 'cpu':
-			args.type = 'cpu'
-		elif response.lower() == 'hdd':
-			args.type = 'hdd'
+		response = input("What product type do you want operate on {" + ','.join(price.categories.load()) + "}? ")
+		if response.lower() in price.categories.load():
+			args.type = response.lower()
 	while args.action is None:
-		response = input("What action to take {d,m,u}? ")
+		response = input("What action to take {d,m,u,b}? ")
 		if response.lower() == 'd':
 			args.action = 'd'
 		elif response.lower() == 'm':
 			args.action = 'm'
 		elif response.lower() == 'u':
 			args.action = 'u'
+		elif response.lower() == 'b':
+			args.action = 'b'
 	if args.chrome == False and args.firefox == False:
 		args.chrome = True # Chrome is default
 
-	webdriver = price.webdriver.ChromeWebDriver(temp_dir=os.path.abspath('build')) if args.chrome else price.webdriver.FirefoxWebDriver('Selenium')
-	today = datetime.date.today().strftime("%Y%m%d")
+	webdriver = price.webdriver.ChromeWebDriver(temp_dir=os.path.abspath('build'), flag_set=args.flag_set) if args.chrome else price.webdriver.FirefoxWebDriver('Selenium')
+	today = args.date if args.date else datetime.date.today().strftime("%Y%m%d")
 	pricespy_prefix = 'test/pricespy_' + args.type + '_' + today
-	userbenchmark_prefix = 'test/userbenchmark_' + args.type + '_' + today + ('.csv' if args.type == 'hdd' else '')
-	data_file = 'web/price_performance_' + args.type + '_' + today + '.json'
+	userbenchmark_prefix = 'test/userbenchmark_' + args.type + '_' + today + price.categories.get(args.type).perf_suffix()
 	price.helper.init_environ()
-	scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, webdriver, price.scraper.Type.CPU if args.type == 'cpu' else price.scraper.Type.HDD)
+	if args.trace:
+		price.helper.enable_tracing()
+	if args.memory:
+		price.helper.enable_tracing() # Stages are found from spans
+		memory_sampler = price.memory.MemorySampler().start()
+	if args.profile:
+		profiler = price.profiler.Profiler('build/profile_' + args.type + '_' + today).start()
+	budget = None if args.budget is None else price.budget.Budget(args.budget)
+	checkpoint = None
+	if args.resume:
+		checkpoint = price.checkpoint.Checkpoint(price.storage.LocalStorage('build'), price.checkpoint.key_prefix(today, args.type, 'checkpoints'))
+	scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, webdriver, price.scraper.Type(args.type), budget, checkpoint)
+	match_table_file = lambda market: 'test/match_table_' + scraper.category.data_key(market) + '.json'
 
 	if args.action == 'd':
 		scraper.download()
 		scraper.quit_selenium()
 		print('Downloaded: ' + str(scraper.all_files_downloaded))
+		print('Coverage: ' + str(scraper.coverage()))
 
 	if args.action == 'd' or args.action == 'm':
 		data = scraper.parse()
-		data = scraper.munge(data['pricespy_data'], data['userbenchmark_data'])
-		with open(data_file, 'w', encoding='utf-8') as f:
-			f.write(json.dumps(data['data']))
-		print(price.munger.format(data))
+		match_tables = {}
+		for market in data['market_data']:
+			match_table_json = None
+			if os.path.isfile(match_table_file(market)):
+				with open(match_table_file(market), 'r', encoding='utf-8') as f:
+					match_table_json = f.read()
+			match_tables[market] = scraper.load_match_table(match_table_json, args.full_rebuild)
+		munged = scraper.munge_markets(data['market_data'], data['userbenchmark_data'], match_tables)
+		for market, data in munged.items():
+			with open(match_table_file(market), 'w', encoding='utf-8') as f:
+				f.write(data['match_table'].to_json())
+			with price.helper.span('serialise'):
+				json_data = json.dumps(price.munger.to_data_file(data, scraper.coverage(market)))
+			print(price.munger.format(data))
 
-		with open('web/latest_' + args.type + '.js', 'w', encoding='utf-8') as f:
-			f.write('var LATEST_' + args.type.upper() +'_DATA_FILE="price_performance_' + args.type + '_' + today + '.json' + '";')
-		print('Munge complete. #Combined={0}, #OrphanPrice={1}, #OrphanPerformance={2}'.format(len(data['data']), len(data['orphan_price_data']), len(data['orphan_perf_data'])))
+			data_key = scraper.category.data_key(market)
+			manifest = price.publish.publish(price.storage.LocalStorage('web'), '', data_key, today, json_data, compress=False)
+			print('Published web/' + manifest['categories'][data_key]['file'] + ' as manifest generation ' + str(manifest['generation']))
+			print('Munge complete. #Combined={0}, #OrphanPrice={1}, #OrphanPerformance={2}, #Reused={3}, #Recomputed={4}'.format(len(data['data']), len(data['orphan_price_data']), len(data['orphan_perf_data']), data['stats']['reused'], data['stats']['recomputed']))
 
 	if args.action == 'u':
-		candidate_files = os.listdir('web')
-		candidate_files.reverse()
-		json_data = None
-		for candidate_file in candidate_files:
-			if candidate_file.startswith('price_performance_'):
-				with open('web/' + candidate_file, 'r') as f:
-					json_data = f.read()
-				print('Uploading to data file S3: web/' + candidate_file)
-				break
-		s3_details = price.helper.get_s3_details()
-		scraper.upload_data_to_s3(s3_details.client, s3_details.bucket, s3_details.key_prefix, json_data)
+		entry, json_data = price.publish.read_latest(price.storage.LocalStorage('web'), '', args.type)
+		if json_data is None:
+			print('Nothing to upload, web/' + price.publish.MANIFEST_NAME + ' has no ' + args.type + ' data')
+		else:
+			print('Uploading to data file S3: web/' + entry['file'])
+			manifest = scraper.upload_data(price.storage.get_storage(), os.environ['S3_KEY_PREFIX'], json_data, entry['date'])
+			print('Published manifest generation ' + str(manifest['generation']))
+
+	if args.action == 'b':
+		mirror = getattr(args, 'mirror', None) # Not set if the type was prompted for
+		if mirror:
+			source = price.backfill.LocalArchiveSource(mirror)
+		elif getattr(args, 'archive', False):
+			source = price.archive.ArchiveSource()
+		else:
+			source = price.backfill.S3ArchiveSource()
+		checkpoint = price.backfill.backfill(source, scraper.type, getattr(args, 'start', None), getattr(args, 'end', None), workers=getattr(args, 'workers', None))
+		print('Backfill complete. #Completed={0}, #Failed={1}'.format(len(checkpoint['completed']), len(checkpoint['failed'])))
+
+	if args.memory:
+		print(price.memory.format(memory_sampler.stop()))
+
+	if args.profile:
+		profiler.stop()
+		print(profiler.format_hotspots())
+		print('Profiling reports written to ' + profiler.output_dir)
+
+	if args.trace:
+		os.makedirs('build', exist_ok=True)
+		trace_file = 'build/trace_' + args.type + '_' + today + '.json'
+		price.helper.TRACER.emit(json_file=trace_file)
+		print('Trace written to ' + trace_file)
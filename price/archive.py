@@ -0,0 +1,202 @@
+import hashlib
+import json
+import price.backfill
+import price.helper
+import price.storage
+import zlib
+
+try:
+	import zstandard # Optional, much better ratios. Falls back to zlib (which also supports preset dictionaries) if not installed
+except ImportError:
+	zstandard = None
+
+"""
+Content-addressed archive of raw downloaded pages. Day to day pages are almost identical so rather than gzipping each page on its own:
+- identical pages are stored once, keyed by the SHA-256 of their content ('<prefix>/blobs/<sha256>')
+- pages are compressed with a preset dictionary built from past pages ('<prefix>/dicts/<codec>/<dictionary id>') so the compressor
+	only has to encode what changed
+- each run writes a small manifest mapping its page file names to blobs ('<prefix>/manifests/<run name>.json')
+Reading a page only downloads its manifest, its blob and (once, cached) its dictionary.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+ZLIB_WINDOW_SIZE = 32 * 1024 # zlib only looks back 32KB so a bigger dictionary is wasted
+ZSTD_DICTIONARY_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+"""Returns the best available codec, 'zstd' if the zstandard module is installed otherwise 'zlib'"""
+def default_codec():
+	return 'zstd' if zstandard is not None else 'zlib'
+
+"""
+Returns a compression dictionary (bytes) for the codec built from the given sample pages (list of bytes). For zstd a dictionary is trained
+from the samples. If there aren't enough samples to train with, or for zlib, the most recent content is used as-is since tomorrow's page
+mostly repeats today's.
+"""
+def train_dictionary(samples, codec):
+	if codec == 'zstd':
+		try:
+			return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples).as_bytes()
+		except zstandard.ZstdError:
+			return b''.join(samples)[-ZSTD_DICTIONARY_SIZE:]
+	return b''.join(samples)[-ZLIB_WINDOW_SIZE:]
+
+def _compress(data, codec, dictionary):
+	if codec == 'zstd':
+		return zstandard.ZstdCompressor(level=19, dict_data=zstandard.ZstdCompressionDict(dictionary)).compress(data)
+	compressor = zlib.compressobj(level=9, zdict=dictionary)
+	return compressor.compress(data) + compressor.flush()
+
+"""Returns an object with decompress(chunk) and flush() methods"""
+def _decompressor(codec, dictionary):
+	if codec == 'zstd':
+		return zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary)).decompressobj()
+	return zlib.decompressobj(zdict=dictionary)
+
+class Archive:
+
+	"""
+	Parameters:
+	- storage - the price.storage storage holding the archive
+	- key_prefix - key prefix of the archive (without trailing slash). Defaults to 'tmp/archive'
+	- codec - 'zstd' or 'zlib' for new blobs. Defaults to default_codec(). Existing blobs are read with whatever they were written with
+	"""
+	def __init__(self, storage, key_prefix='tmp/archive', codec=None):
+		self.storage = storage
+		self.key_prefix = key_prefix
+		self.codec = default_codec() if codec is None else codec
+		self.dictionaries = {} # (codec, dictionary id) -> bytes
+
+	"""
+	Archives a run's pages. Parameters:
+	- run_name - unique name of the run, e.g. 'cpu_20200314_abc123'
+	- pages - dictionary of {file name: bytes}
+	Returns the manifest dictionary which includes 'stats': {'pages', 'deduplicated', 'raw_bytes', 'stored_bytes'}
+	"""
+	def put_run(self, run_name, pages):
+		dictionary_id = self._get_current_dictionary_id()
+		if dictionary_id is None:
+			dictionary_id = self.put_dictionary(train_dictionary(list(pages.values()), self.codec))
+
+		manifest = {'run': run_name, 'pages': {}, 'stats': {'pages': len(pages), 'deduplicated': 0, 'raw_bytes': 0, 'stored_bytes': 0}}
+		for name, data in pages.items():
+			blob = hashlib.sha256(data).hexdigest()
+			key = self.key_prefix + '/blobs/' + blob
+			entry = {'blob': blob, 'size': len(data)}
+			existing = self.storage.head(key)
+			if existing is not None:
+				entry['codec'] = existing.metadata['codec']
+				entry['dictionary'] = existing.metadata['dictionary']
+				manifest['stats']['deduplicated'] += 1
+			else:
+				compressed = _compress(data, self.codec, self._get_dictionary(self.codec, dictionary_id))
+				self.storage.put(key, compressed, metadata={'codec': self.codec, 'dictionary': dictionary_id})
+				entry['codec'] = self.codec
+				entry['dictionary'] = dictionary_id
+				manifest['stats']['stored_bytes'] += len(compressed)
+			manifest['stats']['raw_bytes'] += len(data)
+			manifest['pages'][name] = entry
+
+		self.storage.put(self._manifest_key(run_name), json.dumps(manifest), content_type='application/json')
+		logger.debug('Archived run {} ({})'.format(run_name, manifest['stats']))
+		return manifest
+
+	"""Stores a dictionary (bytes) and makes it the one new blobs are compressed with. Returns its id."""
+	def put_dictionary(self, dictionary):
+		dictionary_id = hashlib.sha256(dictionary).hexdigest()[:16]
+		self.storage.put(self._dictionary_key(self.codec, dictionary_id), dictionary, cache_control='max-age=31536000')
+		self.storage.put(self._dictionary_key(self.codec, 'current'), dictionary_id)
+		self.dictionaries[(self.codec, dictionary_id)] = dictionary
+		return dictionary_id
+
+	"""Trains and stores a new dictionary from the pages of the most recent 'num_runs' manifests. Returns its id."""
+	def retrain(self, num_runs=7):
+		samples = []
+		for run_name in self.list_runs()[-num_runs:]:
+			manifest = self.get_manifest(run_name)
+			samples.extend(self.read_page(manifest, name) for name in sorted(manifest['pages']))
+		return self.put_dictionary(train_dictionary(samples, self.codec))
+
+	"""Returns the names of all archived runs (sorted)"""
+	def list_runs(self):
+		prefix = self.key_prefix + '/manifests/'
+		return sorted(obj.key[len(prefix):-len('.json')] for obj in self.storage.list(prefix))
+
+	"""Returns the manifest of the given run or None if it doesn't exist"""
+	def get_manifest(self, run_name):
+		obj = self.storage.get(self._manifest_key(run_name))
+		return None if obj is None else json.loads(obj.data)
+
+	"""Yields the decompressed content of the named page in the manifest in chunks, without holding the whole blob in memory"""
+	def stream_page(self, manifest, name):
+		entry = manifest['pages'][name]
+		decompressor = _decompressor(entry['codec'], self._get_dictionary(entry['codec'], entry['dictionary']))
+		for chunk in self.storage.stream(self.key_prefix + '/blobs/' + entry['blob'], STREAM_CHUNK_SIZE):
+			data = decompressor.decompress(chunk)
+			if data:
+				yield data
+		data = decompressor.flush()
+		if data:
+			yield data
+
+	"""Returns the decompressed content of the named page in the manifest"""
+	def read_page(self, manifest, name):
+		return b''.join(self.stream_page(manifest, name))
+
+	def _get_current_dictionary_id(self):
+		obj = self.storage.get(self._dictionary_key(self.codec, 'current'))
+		return None if obj is None else obj.text()
+
+	def _get_dictionary(self, codec, dictionary_id):
+		if (codec, dictionary_id) not in self.dictionaries:
+			self.dictionaries[(codec, dictionary_id)] = self.storage.get(self._dictionary_key(codec, dictionary_id)).data
+		return self.dictionaries[(codec, dictionary_id)]
+
+	def _dictionary_key(self, codec, dictionary_id):
+		return self.key_prefix + '/dicts/' + codec + '/' + dictionary_id
+
+	def _manifest_key(self, run_name):
+		return self.key_prefix + '/manifests/' + run_name + '.json'
+
+"""Returns the archive run name for a scrape, e.g. 'cpu_20200314_abc123'"""
+def run_name(type_value, date, uniqueifier):
+	return type_value + '_' + date + '_' + uniqueifier
+
+"""
+Archived files in the Archive for price.backfill. Has the same API as price.backfill.S3ArchiveSource. The storage isn't kept on the
+instance so this can be passed to other processes.
+"""
+class ArchiveSource:
+
+	def __init__(self, key_prefix='tmp/archive'):
+		self.key_prefix = key_prefix
+		self.archive = None
+
+	def list(self):
+		archive = self._get_archive()
+		names = []
+		for run in archive.list_runs():
+			names.extend(archive.get_manifest(run)['pages'].keys())
+		return names
+
+	def fetch(self, name, path):
+		match = price.backfill.ARCHIVE_FILE_PATTERN.match(name)
+		archive = self._get_archive()
+		manifest = archive.get_manifest(run_name(match.group(2), match.group(4), match.group(3)))
+		with open(path, 'wb') as f:
+			for chunk in archive.stream_page(manifest, name):
+				f.write(chunk)
+
+	def _get_archive(self):
+		if self.archive is None:
+			self.archive = Archive(price.storage.get_storage(), self.key_prefix)
+		return self.archive
+
+	def __getstate__(self):
+		return {'key_prefix': self.key_prefix, 'archive': None}
+
+if __name__ == '__main__':
+	price.helper.init_environ()
+	archive = Archive(price.storage.get_storage())
+	print('Trained new {} dictionary: {}'.format(archive.codec, archive.retrain()))
@@ -0,0 +1,170 @@
+import concurrent.futures
+import gzip
+import json
+import os
+import price.categories
+import price.helper
+import price.munger
+import price.scraper
+import price.storage
+import re
+import shutil
+
+"""
+Re-parses and re-munges raw PriceSpy/UserBenchmark downloads archived when UPLOAD_DOM is on so changes to the munging rules can be applied
+to past days. Archived files are named like the Lambda's /tmp files, i.e. 'pricespy_<type>_<run>_<yyyyMMdd>_<page>.htm',
+'userbenchmark_cpu_<run>_<yyyyMMdd>_<page>.htm' and 'userbenchmark_hdd_<run>_<yyyyMMdd>.csv' where <run> is the scrape's 6 character
+uniqueifier. Days are processed in parallel across processes and progress is checkpointed so an interrupted backfill can be resumed.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+ARCHIVE_FILE_PATTERN = re.compile('^(pricespy|userbenchmark)_([a-z]+)_([A-Za-z0-9]{6})_([0-9]{8})(?:_([0-9]+)\\.htm|\\.csv)$')
+
+"""Archived raw files for a single scrape run, i.e. one day of one type"""
+class Snapshot:
+
+	def __init__(self, date, run):
+		self.date = date # yyyyMMdd
+		self.run = run # the scrape's uniqueifier
+		self.pricespy_files = {} # page number -> archived file name
+		self.userbenchmark_files = {} # page number -> archived file name (page 1 for the HDD CSV)
+
+	"""Whether the snapshot has both price and performance data, i.e. can be munged"""
+	def is_complete(self):
+		return 1 in self.pricespy_files and 1 in self.userbenchmark_files
+
+	def num_files(self):
+		return len(self.pricespy_files) + len(self.userbenchmark_files)
+
+"""
+Returns a dictionary of {yyyyMMdd: Snapshot} for the given type from the archived file names. Only complete snapshots between start and end
+(inclusive, yyyyMMdd, None for no limit) are returned. If a day was scraped more than once, the run with the most files is used.
+"""
+def discover(names, type, start=None, end=None):
+	snapshots = {}
+	for name in names:
+		match = ARCHIVE_FILE_PATTERN.match(os.path.basename(name))
+		if match is None or match.group(2) != type.value:
+			continue
+		date = match.group(4)
+		if (start is not None and date < start) or (end is not None and date > end):
+			continue
+		run = match.group(3)
+		snapshot = snapshots.setdefault((date, run), Snapshot(date, run))
+		files = snapshot.pricespy_files if match.group(1) == 'pricespy' else snapshot.userbenchmark_files
+		files[int(match.group(5)) if match.group(5) else 1] = name
+
+	result = {}
+	for snapshot in sorted(snapshots.values(), key = lambda x: x.run): # Sort so the chosen run doesn't depend on listing order
+		if not snapshot.is_complete():
+			continue
+		if snapshot.date not in result or snapshot.num_files() > result[snapshot.date].num_files():
+			result[snapshot.date] = snapshot
+	return result
+
+"""Archived files stored in S3 (see price.storage) under the given key prefix (i.e. where the Lambda puts them). Files are gzipped."""
+class S3ArchiveSource:
+
+	"""The storage isn't kept on the instance so this can be passed to other processes"""
+	def __init__(self, key_prefix='tmp/'):
+		self.key_prefix = key_prefix
+
+	def list(self):
+		return [obj.key for obj in price.storage.get_storage().list(self.key_prefix)]
+
+	"""Downloads the archived file to the local path (decompressed)"""
+	def fetch(self, name, path):
+		body = price.storage.get_storage().get(name).data
+		with open(path, 'wb') as f:
+			f.write(_decompress(body))
+
+"""Archived files in a local directory, e.g. a mirror of the S3 'tmp' prefix. Files may or may not be gzipped."""
+class LocalArchiveSource:
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	def list(self):
+		return os.listdir(self.directory)
+
+	def fetch(self, name, path):
+		with open(os.path.join(self.directory, name), 'rb') as f:
+			body = f.read()
+		with open(path, 'wb') as f:
+			f.write(_decompress(body))
+
+def _decompress(body):
+	return gzip.decompress(body) if body[:2] == b'\x1f\x8b' else body
+
+"""
+Backfills a date range for a type writing 'price_performance_<type>_<yyyyMMdd>.json' files to output_dir. Parameters:
+- source - S3ArchiveSource or LocalArchiveSource
+- type - price.scraper.Type
+- start, end - yyyyMMdd date range (inclusive). None for no limit
+- output_dir - where data files are written. Defaults to 'web'
+- work_dir - where archived files are downloaded to for parsing. Defaults to 'build/backfill'
+- checkpoint_file - JSON file recording completed days. Days in it are skipped so an interrupted backfill can be rerun to resume.
+	Defaults to '<work_dir>/checkpoint_<type>.json'
+- workers - number of processes. Defaults to the number of CPUs
+
+Returns the checkpoint dictionary {'completed': {yyyyMMdd: {'run': <run>, 'rows': <#combined rows>}}, 'failed': {yyyyMMdd: <error>}}
+"""
+def backfill(source, type, start=None, end=None, output_dir='web', work_dir='build/backfill', checkpoint_file=None, workers=None):
+	if checkpoint_file is None:
+		checkpoint_file = os.path.join(work_dir, 'checkpoint_' + type.value + '.json')
+	os.makedirs(work_dir, exist_ok=True)
+	os.makedirs(output_dir, exist_ok=True)
+	checkpoint = {'completed': {}, 'failed': {}}
+	if os.path.isfile(checkpoint_file):
+		with open(checkpoint_file, 'r', encoding='utf-8') as f:
+			checkpoint['completed'] = json.load(f)['completed'] # Failures get retried
+
+	snapshots = discover(source.list(), type, start, end)
+	todo = [snapshot for date, snapshot in sorted(snapshots.items()) if date not in checkpoint['completed']]
+	logger.info('Backfilling {} {} days ({} already done)'.format(len(todo), type.value, len(snapshots) - len(todo)))
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = {executor.submit(backfill_day, source, type, snapshot, output_dir, work_dir): snapshot for snapshot in todo}
+		for i, future in enumerate(concurrent.futures.as_completed(futures)):
+			snapshot = futures[future]
+			try:
+				checkpoint['completed'][snapshot.date] = {'run': snapshot.run, 'rows': future.result()}
+			except Exception as e:
+				logger.error('Failed to backfill {} {}: {}'.format(type.value, snapshot.date, e))
+				checkpoint['failed'][snapshot.date] = str(e)
+			_write_checkpoint(checkpoint_file, checkpoint)
+			logger.info('Backfilled {}/{} days'.format(i + 1, len(todo)))
+	return checkpoint
+
+def _write_checkpoint(checkpoint_file, checkpoint):
+	temp_file = checkpoint_file + '.tmp'
+	with open(temp_file, 'w', encoding='utf-8') as f:
+		json.dump(checkpoint, f, indent='\t', sort_keys=True)
+	os.replace(temp_file, checkpoint_file) # Don't leave a half written checkpoint if we're killed
+
+"""Re-parses and re-munges a single Snapshot writing its data file. Returns the number of combined rows. Runs in a worker process."""
+def backfill_day(source, type, snapshot, output_dir, work_dir):
+	day_dir = os.path.join(work_dir, type.value + '_' + snapshot.date)
+	os.makedirs(day_dir, exist_ok=True)
+	try:
+		pricespy_prefix = os.path.join(day_dir, 'pricespy')
+		for page, name in snapshot.pricespy_files.items():
+			source.fetch(name, pricespy_prefix + '_' + str(page) + '.htm')
+		if price.categories.get(type.value).perf_suffix() == '.csv':
+			userbenchmark_prefix = os.path.join(day_dir, 'userbenchmark.csv')
+			source.fetch(snapshot.userbenchmark_files[1], userbenchmark_prefix)
+		else:
+			userbenchmark_prefix = os.path.join(day_dir, 'userbenchmark')
+			for page, name in snapshot.userbenchmark_files.items():
+				source.fetch(name, userbenchmark_prefix + '_' + str(page) + '.htm')
+
+		scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, None, type)
+		data = scraper.parse()
+		data = scraper.munge(data['pricespy_data'], data['userbenchmark_data'])
+		data_file = os.path.join(output_dir, 'price_performance_' + type.value + '_' + snapshot.date + '.json')
+		with open(data_file, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(price.munger.to_data_file(data)))
+		return len(data['data'])
+	finally:
+		shutil.rmtree(day_dir, ignore_errors=True)
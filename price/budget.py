@@ -0,0 +1,69 @@
+import time
+
+"""
+Time budget of a run. Lambda kills an invocation at its timeout (see template.yaml) leaving no output, so the scrape is planned against the
+time remaining: fetching stops early enough to leave a reserve for parsing, munging and uploading whatever was fetched, and each step's
+timeout (e.g. waiting for a page's products to appear) is its usual timeout clipped to the time left for fetching. Page 1 of each source
+is the most valuable and is always attempted (see price.pagination.Coverage), later pages and categories are dropped first.
+"""
+
+RESERVE_SECONDS = 20 # Kept back for parsing, munging and uploading
+MIN_TIMEOUT_SECONDS = 1 # Shortest timeout a step gets, so a step that's run anyway still has a chance
+# Usual timeout in seconds of each step
+STEP_TIMEOUTS = {
+	'navigate': 30, # Loading a page
+	'wait': 10, # Waiting for a page's content to appear
+	'control': 2, # Waiting for a drop down or dialog to appear
+	'progress': 5, # Waiting for a single page app's progress bar to go
+	'upload': 10 # An S3 request
+}
+MAX_ATTEMPTS = 2 # Attempts at a timed out page load (if the budget allows)
+
+class Budget:
+
+	"""
+	Parameters:
+	- seconds - time available from now. Defaults to None (unlimited, every step gets its usual timeout)
+	- reserve - seconds kept back at the end for parsing, munging and uploading. Defaults to RESERVE_SECONDS
+	"""
+	def __init__(self, seconds=None, reserve=RESERVE_SECONDS):
+		self.seconds = seconds
+		self.deadline = None if seconds is None else time.monotonic() + seconds
+		self.reserve = reserve
+
+	"""Returns the seconds left of the whole budget, or None if unlimited"""
+	def remaining(self):
+		return None if self.deadline is None else max(0, self.deadline - time.monotonic())
+
+	"""Returns the time.monotonic() after which no more fetching should start, or None if unlimited"""
+	def fetch_deadline(self):
+		return None if self.deadline is None else self.deadline - self.reserve
+
+	"""Returns the seconds left for fetching, or None if unlimited"""
+	def fetch_remaining(self):
+		return None if self.deadline is None else max(0, self.fetch_deadline() - time.monotonic())
+
+	"""Returns whether the time for fetching has run out"""
+	def expired(self):
+		return self.fetch_remaining() == 0
+
+	"""Returns the timeout in seconds of the step (see STEP_TIMEOUTS). 'upload' steps can use the reserve, other steps can't."""
+	def timeout(self, step):
+		remaining = self.remaining() if step == 'upload' else self.fetch_remaining()
+		if remaining is None:
+			return STEP_TIMEOUTS[step]
+		return max(MIN_TIMEOUT_SECONDS, min(STEP_TIMEOUTS[step], remaining))
+
+	"""Returns whether there's time for another attempt at the given steps after 'attempt' attempts"""
+	def can_retry(self, attempt, *steps):
+		remaining = self.fetch_remaining()
+		return attempt < MAX_ATTEMPTS and (remaining is None or remaining >= sum(STEP_TIMEOUTS[step] for step in steps))
+
+	def __str__(self):
+		if self.deadline is None:
+			return 'unlimited'
+		return '{:.1f}s remaining, {:.1f}s for fetching'.format(self.remaining(), self.fetch_remaining())
+
+"""Returns the Budget for a Lambda invocation from its context (i.e. context.get_remaining_time_in_millis())"""
+def from_context(context, reserve=RESERVE_SECONDS):
+	return Budget(context.get_remaining_time_in_millis() / 1000, reserve)
@@ -0,0 +1,170 @@
+import concurrent.futures
+import configparser
+import os
+import price.helper
+import price.munger
+import price.pricespy
+import price.userbenchmark
+
+"""
+Registry of the product categories to scrape, read from 'categories.ini' (next to this file so it's shipped with the Lambda code). Each
+category names its price source, performance source and munger and configures them, so a category like GPU or SSD can be added without
+new classes. Options (see categories.ini for the defaults):
+- enabled - whether the Lambda scrapes this category
+- description - what's being compared
+- price_source - 'pricespy'
+- price_url, price_title - PriceSpy category page (without the offset) and its expected page title
+- markets - the markets prices are scraped from, e.g. 'nz uk'. The first uses price_url and price_title, each other market has its own
+	'price_url.<market>' and 'price_title.<market>' (e.g. PriceSpy UK's category page). Every market is matched against the same
+	performance data, which is only downloaded and indexed once, and published as its own data file, see data_key()
+- price_card_selector - CSS selector of a product card
+- price_page_size - number of products per page
+- price_max_pages - maximum number of pages to download. Pages are downloaded until they stop adding new products, see price.pagination
+- price_window - number of pages downloaded at once, each in its own browser
+- price_target_products - stop downloading pages once this many products have been found, 0 for no target
+- perf_source - 'userbenchmark' (HTML table, scraped with Selenium) or 'userbenchmark_csv' (UserBenchmark's CSV download)
+- perf_url, perf_title - performance page (or CSV) URL and the expected page title (ignored for CSVs)
+- perf_sort_option - 1-based index of the sort drop down option to choose (HTML table only)
+- perf_extra_column - name of a column to add to the table, blank for none (HTML table only)
+- perf_max_pages - maximum number of pages to download (HTML table only)
+- perf_min_benchmark, perf_min_samples - rows with a lower average benchmark or fewer samples are skipped (CSV only)
+- perf_cache_days - how long the downloaded CSV is cached in S3 for (CSV only)
+- munger - name of the munging rules in MUNGERS
+"""
+
+logger = price.helper.get_logger(__name__)
+
+CATEGORIES_FILE = os.path.join(os.path.dirname(__file__), 'categories.ini')
+DEFAULT_CONCURRENCY = 2 # Categories scraped at once. Each runs its own browser so this is limited by memory
+MUNGERS = {'cpu': price.munger.CpuMunger, 'hdd': price.munger.HddMunger}
+
+"""A market a category's prices are scraped from, e.g. PriceSpy NZ"""
+class Market:
+
+	"""
+	Parameters:
+	- value - the market's name, e.g. 'nz'
+	- price_url, price_title - the category's page in this market (without the offset) and its expected page title
+	"""
+	def __init__(self, value, price_url, price_title):
+		self.value = value
+		self.price_url = price_url
+		self.price_title = price_title
+
+"""A product category from the registry"""
+class Category:
+
+	"""
+	Parameters:
+	- value - the type, i.e. name of the section in categories.ini, e.g. 'cpu'
+	- section - the configparser section
+	"""
+	def __init__(self, value, section):
+		self.value = value
+		self.enabled = section.getboolean('enabled')
+		self.description = section.get('description', '')
+		self.price_source = section['price_source']
+		self.price_url = section['price_url']
+		self.price_title = section['price_title']
+		self.price_card_selector = section['price_card_selector']
+		self.price_page_size = section.getint('price_page_size')
+		self.price_max_pages = section.getint('price_max_pages')
+		self.price_window = section.getint('price_window')
+		self.price_target_products = section.getint('price_target_products')
+		self.perf_source = section['perf_source']
+		self.perf_url = section['perf_url']
+		self.perf_title = section.get('perf_title', '')
+		self.perf_sort_option = section.getint('perf_sort_option')
+		self.perf_extra_column = section['perf_extra_column']
+		self.perf_max_pages = section.getint('perf_max_pages')
+		self.perf_min_benchmark = section.getfloat('perf_min_benchmark')
+		self.perf_min_samples = section.getint('perf_min_samples')
+		self.perf_cache_days = section.getint('perf_cache_days')
+		self.munger = section['munger']
+		self.markets = section['markets'].split() # Names, the first's page is price_url
+		self.market_pages = {} # Other markets' name -> (price_url, price_title)
+		for market in self.markets[1:]:
+			if 'price_url.' + market not in section:
+				raise Exception('Market "{}" of category {} has no price_url.{}'.format(market, value, market))
+			self.market_pages[market] = (section['price_url.' + market], section.get('price_title.' + market, ''))
+		if len(self.markets) == 0:
+			raise Exception('No markets for category {}'.format(value))
+		if self.price_source != 'pricespy':
+			raise Exception('Unknown price_source "{}" for category {}'.format(self.price_source, value))
+		if self.perf_source not in ['userbenchmark', 'userbenchmark_csv']:
+			raise Exception('Unknown perf_source "{}" for category {}'.format(self.perf_source, value))
+		if self.munger not in MUNGERS:
+			raise Exception('Unknown munger "{}" for category {}'.format(self.munger, value))
+
+	"""Suffix of the performance data file. CSV sources download a single file so the prefix gets '.csv' rather than '_<page>.htm'"""
+	def perf_suffix(self):
+		return '.csv' if self.perf_source == 'userbenchmark_csv' else ''
+
+	"""Returns the Market with the name, or the first (default) market if None"""
+	def market(self, value=None):
+		if value is None or value == self.markets[0]:
+			return Market(self.markets[0], self.price_url, self.price_title)
+		if value not in self.market_pages:
+			raise Exception('Unknown market "{}" for category {}'.format(value, self.value))
+		return Market(value, *self.market_pages[value])
+
+	"""
+	Returns the name the market's data is published under (see price.publish): the type (e.g. 'cpu') for the default market so existing
+	charts keep working, otherwise '<type>_<market>' (e.g. 'cpu_uk')
+	"""
+	def data_key(self, market=None):
+		if market is None or market == self.markets[0]:
+			return self.value
+		return self.value + '_' + market
+
+	"""Returns the price price.webdatasource.WebDataSource for this category in the market (defaults to the first)"""
+	def create_price_source(self, webdriver, market=None):
+		market = self.market(market)
+		return price.pricespy.PriceSpy(webdriver, market.price_url, market.price_title, self.price_card_selector, self.price_page_size)
+
+	"""Returns the performance price.webdatasource.WebDataSource for this category"""
+	def create_perf_source(self, webdriver):
+		if self.perf_source == 'userbenchmark_csv':
+			return price.userbenchmark.UserBenchmarkCsv(self.perf_url, self.perf_cache_days, self.perf_min_benchmark, self.perf_min_samples)
+		return price.userbenchmark.UserBenchmark(webdriver, self.perf_url, self.perf_title, self.perf_sort_option, self.perf_extra_column)
+
+	"""Returns the munger (e.g. price.munger.CpuMunger) for this category"""
+	def create_munger(self):
+		return MUNGERS[self.munger]()
+
+_CATEGORIES = {}
+
+"""Returns the categories in the file (defaults to CATEGORIES_FILE) as a dictionary of {type value: Category} in file order. Cached."""
+def load(file=CATEGORIES_FILE):
+	if file not in _CATEGORIES:
+		config = configparser.ConfigParser(interpolation=None)
+		if len(config.read(file, encoding='utf-8')) == 0:
+			raise Exception('Could not read categories file ' + file)
+		_CATEGORIES[file] = {value: Category(value, config[value]) for value in config.sections()}
+	return _CATEGORIES[file]
+
+"""Returns the Category for the type value (e.g. 'cpu')"""
+def get(value, file=CATEGORIES_FILE):
+	return load(file)[value]
+
+"""
+Calls function(item) for each item (e.g. price.scraper.Type or Category, anything with a 'value'), running at most 'concurrency' at once
+in threads. Each call is run in a span named after the item's value, under the caller's current span. Waits for every call to finish, then
+raises the first error if any failed otherwise returns the results in order.
+"""
+def run_all(items, function, concurrency=DEFAULT_CONCURRENCY):
+	parent_path = price.helper.TRACER.current_path() # Spans are per thread so nest under the caller's explicitly
+	def run(item):
+		with price.helper.span(item.value if parent_path is None else parent_path + '/' + item.value):
+			return function(item)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+		futures = [executor.submit(run, item) for item in items]
+	errors = []
+	for item, future in zip(items, futures):
+		if future.exception() is not None:
+			logger.error('Failed to process {}: {}'.format(item.value, future.exception()))
+			errors.append(future.exception())
+	if len(errors) > 0:
+		raise errors[0]
+	return [future.result() for future in futures]
@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import json
+import os
+import price.helper
+import threading
+
+"""
+Page-level checkpoints of a run's downloads so a retried run (e.g. after Chrome crashed or a wait timed out) only downloads the pages which
+are missing or failed and reuses the ones already fetched. A checkpoint is keyed by the run's date and category (see key_prefix()) and
+stored with price.storage:
+- '<key prefix>/checkpoint.json' - {'pages': {'<source>/<page>': {'url', 'state': 'done'/'failed', 'file', 'sha256', 'error'}},
+	'finished': {'<source>': <coverage stop reason>}}
+- '<key prefix>/pages/<sha256>' - the gzipped content of each page downloaded, since file names differ between attempts and retries may
+	run somewhere the files aren't
+Clear the checkpoint once the run's data has been published in full so the next run downloads everything again.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+DEFAULT_KEY_PREFIX = 'tmp/checkpoints'
+
+"""Returns the key prefix of the checkpoint of the run, e.g. 'tmp/checkpoints/20200314_cpu'"""
+def key_prefix(date, type_value, prefix=DEFAULT_KEY_PREFIX):
+	return prefix + '/' + date + '_' + type_value
+
+class Checkpoint:
+
+	"""
+	Parameters:
+	- storage - the price.storage storage to keep the checkpoint in, e.g. the S3 bucket or a LocalStorage under /tmp
+	- key_prefix - key prefix of the checkpoint, see key_prefix()
+	"""
+	def __init__(self, storage, key_prefix):
+		self.storage = storage
+		self.key_prefix = key_prefix
+		self.lock = threading.Lock() # Pages may be downloaded concurrently
+		obj = storage.get(self._key('checkpoint.json'))
+		saved = {} if obj is None else json.loads(obj.text())
+		self.pages = saved.get('pages', {})
+		self.finished = saved.get('finished', {})
+		if len(self.pages) > 0:
+			logger.info('Resuming from checkpoint {} with {} pages downloaded'.format(key_prefix, len(self.done_pages())))
+
+	"""Returns a SourceCheckpoint recording the pages of the named source, e.g. 'pricespy'"""
+	def source(self, name):
+		return SourceCheckpoint(self, name)
+
+	"""Returns the '<source>/<page>' names of the pages downloaded"""
+	def done_pages(self):
+		with self.lock:
+			return sorted(name for name, record in self.pages.items() if record['state'] == 'done')
+
+	"""
+	Writes the page downloaded by a previous attempt to file_name. The file the attempt wrote is reused if it's still there, otherwise the
+	content is read from storage. Returns True if the page was restored, False if it needs downloading.
+	"""
+	def restore(self, source, page, file_name):
+		with self.lock:
+			record = self.pages.get(source + '/' + str(page))
+		if record is None or record['state'] != 'done':
+			return False
+		data = None
+		if os.path.isfile(record['file']):
+			with open(record['file'], 'rb') as f:
+				data = f.read()
+		if data is None or hashlib.sha256(data).hexdigest() != record['sha256']:
+			obj = self.storage.get(self._key('pages/' + record['sha256']))
+			data = None if obj is None else gzip.decompress(obj.data)
+		if data is None or hashlib.sha256(data).hexdigest() != record['sha256']:
+			logger.warning('Checkpointed {} page {} is missing or corrupt, downloading it again'.format(source, page))
+			return False
+		if os.path.abspath(file_name) != os.path.abspath(record['file']) or not os.path.isfile(file_name):
+			with open(file_name, 'wb') as f:
+				f.write(data)
+		price.helper.count('restored_pages')
+		return True
+
+	"""Records the page as downloaded to file_name, keeping a copy of its content"""
+	def done(self, source, page, url, file_name):
+		with open(file_name, 'rb') as f:
+			data = f.read()
+		sha256 = hashlib.sha256(data).hexdigest()
+		self.storage.put(self._key('pages/' + sha256), gzip.compress(data), content_type='text/html', content_encoding='gzip')
+		self._record(source, page, {'url': url, 'state': 'done', 'file': file_name, 'sha256': sha256})
+
+	"""Records that downloading the page failed"""
+	def failed(self, source, page, url, error):
+		self._record(source, page, {'url': url, 'state': 'failed', 'error': str(error)})
+
+	"""Records that every page the source wanted was downloaded, fetching stopped for the reason (see price.pagination.Coverage)"""
+	def finish(self, source, reason):
+		with self.lock:
+			self.finished[source] = reason
+			self._save()
+
+	"""Deletes the checkpoint and its pages"""
+	def clear(self):
+		for obj in self.storage.list(self.key_prefix + '/'):
+			self.storage.delete(obj.key)
+		with self.lock:
+			self.pages = {}
+			self.finished = {}
+
+	def _record(self, source, page, record):
+		with self.lock:
+			self.pages[source + '/' + str(page)] = record
+			self._save()
+
+	def _save(self):
+		self.storage.put(self._key('checkpoint.json'), json.dumps({'pages': self.pages, 'finished': self.finished}, sort_keys=True), content_type='application/json')
+
+	def _key(self, name):
+		return self.key_prefix + '/' + name
+
+"""A Checkpoint's view of one source's pages, see Checkpoint.source()"""
+class SourceCheckpoint:
+
+	def __init__(self, checkpoint, name):
+		self.checkpoint = checkpoint
+		self.name = name
+
+	def restore(self, page, file_name):
+		return self.checkpoint.restore(self.name, page, file_name)
+
+	def done(self, page, url, file_name):
+		self.checkpoint.done(self.name, page, url, file_name)
+
+	def failed(self, page, url, error):
+		self.checkpoint.failed(self.name, page, url, error)
+
+	def finish(self, reason):
+		self.checkpoint.finish(self.name, reason)
+
+	"""Returns the reason fetching stopped if a previous attempt downloaded every page the source wanted, otherwise None"""
+	def finished(self):
+		with self.checkpoint.lock:
+			return self.checkpoint.finished.get(self.name)
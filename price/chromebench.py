@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import price.categories
+import price.helper
+import price.memory
+import price.replay
+import price.webdriver
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import selenium.webdriver.support.wait
+from selenium.webdriver.common.by import By
+
+"""
+Benchmarks Chrome's launch flags. Launches Chrome with each of the named flag sets (see price.webdriver.CHROME_FLAG_SETS) and loads a
+category's recorded pages from a local price.replay.FixtureServer, measuring per launch:
+- launch_ms - starting ChromeDriver and Chrome (from a fresh temp directory, like a cold Lambda)
+- selector_ms - loading the pages until the element the scraper waits for (e.g. the product cards) is there
+- peak_rss_mb - peak total RSS of the ChromeDriver/Chrome process tree
+- cpu_ms - CPU time used by the ChromeDriver/Chrome process tree
+Runs of the flag sets are interleaved so drift (e.g. other load on the machine) affects them alike, then the flag sets are ranked by their
+median launch_ms + selector_ms. Process information is read from /proc so memory and CPU are only measured on Linux. Run with, e.g.:
+
+	python -m price.chromebench --chrome lambda_layer/chromium/chromium --runs 5 cpu
+"""
+
+logger = price.helper.get_logger(__name__)
+
+METRICS = ['launch_ms', 'selector_ms', 'total_ms', 'peak_rss_mb', 'cpu_ms']
+SAMPLE_INTERVAL = 0.05 # Seconds between samples of the process tree
+SELECTOR_TIMEOUT = 30 # Seconds to wait for a page's element
+PERF_SELECTOR = 'tr[class="hovertarget "]' # UserBenchmark table row, see price.userbenchmark
+
+"""Samples the RSS and CPU time of this process's descendants (i.e. ChromeDriver and Chrome) in a background thread"""
+class ProcessSampler:
+
+	def __init__(self, interval=SAMPLE_INTERVAL):
+		self.interval = interval
+		self.peak_rss = 0
+		self.cpu_ticks = {} # pid -> latest utime + stime seen, processes which exited keep their last sample
+		self.stopping = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self._run, name='ProcessSampler', daemon=True)
+		self.thread.start()
+		return self
+
+	"""Stops sampling. Returns {'peak_rss_mb', 'cpu_ms'}"""
+	def stop(self):
+		self.stopping.set()
+		self.thread.join()
+		return {'peak_rss_mb': self.peak_rss / 1024 / 1024, 'cpu_ms': sum(self.cpu_ticks.values()) * 1000 / _CLOCK_TICKS}
+
+	def _run(self):
+		while not self.stopping.is_set():
+			self.sample()
+			self.stopping.wait(self.interval)
+		self.sample()
+
+	def sample(self):
+		rss = 0
+		for pid in price.memory.descendant_pids():
+			rss += price.memory.read_rss(pid)
+			ticks = _read_cpu_ticks(pid)
+			if ticks is not None:
+				self.cpu_ticks[pid] = max(ticks, self.cpu_ticks.get(pid, 0))
+		self.peak_rss = max(self.peak_rss, rss)
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+"""Returns the user + system CPU time of the process in clock ticks, or None if it can't be read"""
+def _read_cpu_ticks(pid):
+	try:
+		with open('/proc/' + str(pid) + '/stat', 'r') as f:
+			fields = f.read().rsplit(')', 1)[1].split() # Process name is in brackets and may contain spaces
+		return int(fields[11]) + int(fields[12])
+	except (OSError, ValueError, IndexError):
+		return None
+
+"""Returns the recorded pages of the type to load as a list of (name, URL, CSS selector to wait for)"""
+def fixture_pages(server, type_value):
+	category = server.category(type_value)
+	pages = [('pricespy', category.price_url, category.price_card_selector)]
+	if category.perf_source == 'userbenchmark':
+		pages.append(('userbenchmark', category.perf_url, PERF_SELECTOR))
+	return pages
+
+"""
+Launches a browser with the webdriver.WebDriver and loads the pages (see fixture_pages()). Returns {'launch_ms', 'selector_ms', 'total_ms',
+'peak_rss_mb', 'cpu_ms', 'pages': {name: ms}}
+"""
+def measure(webdriver, pages):
+	sampler = ProcessSampler().start()
+	driver = None
+	try:
+		start = time.perf_counter()
+		driver = webdriver.getWebDriver()
+		launch_ms = (time.perf_counter() - start) * 1000
+		page_ms = {}
+		for name, url, selector in pages:
+			start = time.perf_counter()
+			driver.get(url)
+			selenium.webdriver.support.wait.WebDriverWait(driver, SELECTOR_TIMEOUT).until(lambda x: x.find_element(By.CSS_SELECTOR, selector))
+			page_ms[name] = (time.perf_counter() - start) * 1000
+	finally:
+		if driver is not None:
+			driver.quit()
+		processes = sampler.stop()
+	selector_ms = sum(page_ms.values())
+	return {'launch_ms': launch_ms, 'selector_ms': selector_ms, 'total_ms': launch_ms + selector_ms, 'peak_rss_mb': processes['peak_rss_mb'],
+		'cpu_ms': processes['cpu_ms'], 'pages': page_ms}
+
+"""
+Runs every flag set warmup + runs times, interleaved, discarding the warmup runs. Parameters:
+- create_webdriver - function create_webdriver(flag_set, temp_dir) returning the webdriver.WebDriver to launch with
+- flag_sets - names of the flag sets
+- pages - see fixture_pages()
+Returns {flag set: [measure() result or {'error': <message>} if it failed]}
+"""
+def run(create_webdriver, flag_sets, pages, runs=5, warmup=1):
+	results = {flag_set: [] for flag_set in flag_sets}
+	for i in range(warmup + runs):
+		for flag_set in flag_sets:
+			temp_dir = tempfile.mkdtemp(prefix='chromebench_')
+			try:
+				result = measure(create_webdriver(flag_set, temp_dir), pages)
+				logger.info('{} run {}/{}{}: launch {:.0f}ms, selector {:.0f}ms, peak RSS {:.0f}MiB, CPU {:.0f}ms'.format(flag_set, i + 1,
+					warmup + runs, ' (warmup)' if i < warmup else '', result['launch_ms'], result['selector_ms'], result['peak_rss_mb'], result['cpu_ms']))
+			except Exception as e:
+				logger.warning('{} run {}/{} failed: {}'.format(flag_set, i + 1, warmup + runs, e))
+				result = {'error': str(e)}
+			finally:
+				shutil.rmtree(temp_dir, ignore_errors=True)
+			if i >= warmup:
+				results[flag_set].append(result)
+	return results
+
+"""
+Returns the flag sets ranked fastest first by median total_ms, as a list of {'rank', 'flag_set', 'runs', 'failures', <metric>: median}.
+Flag sets which failed every run come last.
+"""
+def rank(results):
+	rows = []
+	for flag_set, runs in results.items():
+		succeeded = [run for run in runs if 'error' not in run]
+		row = {'flag_set': flag_set, 'runs': len(runs), 'failures': len(runs) - len(succeeded)}
+		for metric in METRICS:
+			row[metric] = statistics.median([run[metric] for run in succeeded]) if len(succeeded) > 0 else None
+		rows.append(row)
+	rows.sort(key = lambda x: (x['total_ms'] is None, x['total_ms'] or 0, x['peak_rss_mb'] or 0))
+	for i, row in enumerate(rows):
+		row['rank'] = i + 1
+	return rows
+
+"""Formats the ranking for printing"""
+def format(ranking):
+	number = lambda x: '-' if x is None else '{:.0f}'.format(x)
+	result = 'Chrome flag sets (median, fastest first):\n {:>4} {:14} {:>10} {:>12} {:>10} {:>12} {:>10} {:>9}\n'.format('rank', 'flag set',
+		'launch ms', 'selector ms', 'total ms', 'peak RSS MiB', 'CPU ms', 'failures')
+	for row in ranking:
+		result += ' {:>4} {:14} {:>10} {:>12} {:>10} {:>12} {:>10} {:>9}\n'.format(row['rank'], row['flag_set'], number(row['launch_ms']),
+			number(row['selector_ms']), number(row['total_ms']), number(row['peak_rss_mb']), number(row['cpu_ms']),
+			'{}/{}'.format(row['failures'], row['runs']))
+	return result
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks Chrome's launch flag sets on recorded pages")
+	parser.add_argument('type', choices=list(price.categories.load()), help='product type whose recorded pages are loaded')
+	parser.add_argument('--chrome', help='Chrome/Chromium binary, defaults to the installed one')
+	parser.add_argument('--chromedriver', default='chromedriver', help="ChromeDriver binary, defaults to 'chromedriver' on the path")
+	parser.add_argument('--flag-sets', nargs='+', choices=list(price.webdriver.CHROME_FLAG_SETS), default=list(price.webdriver.CHROME_FLAG_SETS),
+		help='flag sets to compare, defaults to all of them')
+	parser.add_argument('--runs', type=int, default=5, help='number of measured runs of each flag set, defaults to 5')
+	parser.add_argument('--warmup', type=int, default=1, help='number of unmeasured runs of each flag set first, defaults to 1')
+	parser.add_argument('--fixtures', default='test', help="directory of the recorded pages, defaults to 'test'")
+	parser.add_argument('--date', default='20200314', help='date (yyyyMMdd) of the recorded pages, defaults to 20200314')
+	parser.add_argument('--output', help='also write the results and ranking to this JSON file')
+	args = parser.parse_args(argv)
+
+	create_webdriver = lambda flag_set, temp_dir: price.webdriver.ChromeWebDriver(args.chrome, args.chromedriver, os.path.join(temp_dir, 'chromedriver.log'),
+		temp_dir, flag_set=flag_set)
+	server = price.replay.FixtureServer(args.fixtures, args.date).start()
+	try:
+		results = run(create_webdriver, args.flag_sets, fixture_pages(server, args.type), args.runs, args.warmup)
+	finally:
+		server.stop()
+	ranking = rank(results)
+	print(format(ranking))
+	if args.output:
+		os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+		with open(args.output, 'w', encoding='utf-8') as f:
+			json.dump({'type': args.type, 'results': results, 'ranking': ranking}, f, indent='\t')
+		print('Results written to ' + args.output)
+
+if __name__ == '__main__':
+	price.helper.get_logger(__name__, stream=sys.stdout)
+	main()
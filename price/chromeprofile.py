@@ -0,0 +1,158 @@
+import argparse
+import os
+import price.helper
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+"""
+Pre-warmed Chrome profiles. Starting Chrome with an empty --user-data-dir makes it create and initialise a whole profile (preferences,
+local state, databases, ...) on every launch. Instead a trimmed profile is built once (see build(), e.g. into the Lambda layer as
+'aws/chrome_profile.tar') and ChromeProfile.prepare() restores it into the temp directory before Chrome starts. The restored profile and
+the HTTP disk cache are kept between launches (and warm Lambda invocations) so static assets PriceSpy and UserBenchmark serve on every page
+come from the cache. The disk cache is trimmed to a size cap before each launch, evicting the least recently used entries first.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024 # Bytes of disk cache to keep between launches
+USER_DATA_DIR = 'user-data'
+CACHE_DIR = 'cache-dir'
+RESTORED_MARKER = '.restored' # In the user data directory, records which archive was restored
+BUILD_TIMEOUT = 60 # Seconds to let Chrome initialise the profile
+# Parts of a profile which are caches, crash reports or per-session state and aren't worth shipping
+TRIMMED_PATHS = [
+	'BrowserMetrics',
+	'Crash Reports',
+	'Crashpad',
+	'Default/Cache',
+	'Default/Code Cache',
+	'Default/GPUCache',
+	'Default/Service Worker',
+	'Default/Session Storage',
+	'Default/Sessions',
+	'GrShaderCache',
+	'Safe Browsing',
+	'ShaderCache',
+	'SingletonCookie',
+	'SingletonLock',
+	'SingletonSocket'
+]
+
+class ChromeProfile:
+
+	"""
+	Parameters:
+	- archive - the profile built by build(). If None or missing Chrome creates a new profile as usual
+	- cache_size - bytes of disk cache to keep between launches. This is also passed to Chrome as --disk-cache-size
+	"""
+	def __init__(self, archive=None, cache_size=DEFAULT_CACHE_SIZE):
+		self.archive = archive
+		self.cache_size = cache_size
+
+	"""
+	Gets '<temp_dir>/user-data' and '<temp_dir>/cache-dir' ready for Chrome to be launched with. The profile is only restored if it isn't
+	already there from a previous launch. Returns the tuple (user data directory, disk cache directory).
+	"""
+	def prepare(self, temp_dir):
+		user_data_dir = os.path.join(temp_dir, USER_DATA_DIR)
+		cache_dir = os.path.join(temp_dir, CACHE_DIR)
+		self.restore(user_data_dir)
+		os.makedirs(cache_dir, exist_ok=True)
+		evict(cache_dir, self.cache_size)
+		return user_data_dir, cache_dir
+
+	"""Extracts the archive into the user data directory unless it was already restored from the same archive. Returns True if extracted."""
+	def restore(self, user_data_dir):
+		if self.archive is None or not os.path.isfile(self.archive):
+			return False
+		stat = os.stat(self.archive)
+		signature = '{} {} {}'.format(os.path.abspath(self.archive), stat.st_size, stat.st_mtime_ns)
+		marker = os.path.join(user_data_dir, RESTORED_MARKER)
+		if os.path.isfile(marker):
+			with open(marker, 'r', encoding='utf-8') as f:
+				if f.read() == signature:
+					return False
+		if os.path.isdir(user_data_dir):
+			shutil.rmtree(user_data_dir)
+		with tarfile.open(self.archive, 'r') as tar:
+			tar.extractall(user_data_dir, filter='data')
+		with open(marker, 'w', encoding='utf-8') as f:
+			f.write(signature)
+		logger.debug('Restored Chrome profile {} into {}'.format(self.archive, user_data_dir))
+		return True
+
+"""
+Deletes the least recently used files in the directory (recursively) until it holds at most max_bytes. Files are ordered by their access
+time, or modified time if that's later (e.g. /tmp mounted noatime). Returns the number of bytes deleted.
+"""
+def evict(directory, max_bytes):
+	files = []
+	total = 0
+	for root, dirs, names in os.walk(directory):
+		for name in names:
+			path = os.path.join(root, name)
+			try:
+				stat = os.stat(path)
+			except FileNotFoundError:
+				continue
+			files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+			total += stat.st_size
+	deleted = 0
+	files.sort()
+	for used, size, path in files:
+		if total - deleted <= max_bytes:
+			break
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+		deleted += size
+	if deleted > 0:
+		logger.debug('Evicted {} bytes from the disk cache {}'.format(deleted, directory))
+	return deleted
+
+"""Removes the TRIMMED_PATHS from the user data directory"""
+def trim(user_data_dir):
+	for path in TRIMMED_PATHS:
+		path = os.path.join(user_data_dir, path)
+		if os.path.isdir(path) and not os.path.islink(path):
+			shutil.rmtree(path)
+		elif os.path.lexists(path):
+			os.remove(path)
+
+"""Trims the user data directory and writes it to the (uncompressed so it restores quickly) tar archive"""
+def archive(user_data_dir, output):
+	trim(user_data_dir)
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+	with tarfile.open(output, 'w') as tar:
+		for name in sorted(os.listdir(user_data_dir)):
+			tar.add(os.path.join(user_data_dir, name), arcname=name)
+
+"""
+Builds a pre-initialised profile by letting Chrome create one (with the same kind of headless launch the scraper does) then trimming and
+archiving it. Parameters:
+- chrome_binary - path to Chrome/Chromium, e.g. 'lambda_layer/chromium/chromium'
+- output - the archive to write, e.g. 'lambda_layer/aws/chrome_profile.tar'
+"""
+def build(chrome_binary, output):
+	with tempfile.TemporaryDirectory() as temp_dir:
+		user_data_dir = os.path.join(temp_dir, USER_DATA_DIR)
+		subprocess.run([chrome_binary, '--headless', '--disable-gpu', '--no-sandbox', '--single-process', '--no-zygote', '--no-first-run',
+			'--no-default-browser-check', '--homedir=' + temp_dir, '--user-data-dir=' + user_data_dir, '--disk-cache-dir=' + os.path.join(temp_dir, CACHE_DIR),
+			'--dump-dom', 'about:blank'], stdout=subprocess.DEVNULL, timeout=BUILD_TIMEOUT, check=True)
+		archive(user_data_dir, output)
+	logger.info('Built Chrome profile {} ({} bytes)'.format(output, os.path.getsize(output)))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Builds the pre-initialised Chrome profile shipped in the Lambda layer')
+	parser.add_argument('--chrome', default='lambda_layer/chromium/chromium', help='Chrome/Chromium binary to initialise the profile with')
+	parser.add_argument('--output', default='lambda_layer/aws/chrome_profile.tar', help='The archive to write')
+	args = parser.parse_args(argv)
+	build(args.chrome, args.output)
+
+if __name__ == '__main__':
+	price.helper.get_logger(__name__, stream=sys.stdout)
+	main()
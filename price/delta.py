@@ -0,0 +1,67 @@
+import json
+
+"""
+Deltas between two data files (see price.munger.to_data_file()) so returning visitors only download what changed since the data they
+already have. Rows are matched by name. A delta is:
+
+	{"rows": [...], "fields": {...}, "deleted_fields": [...], "stats": {"unchanged", "changed", "added", "removed"}}
+
+where each element of "rows" gives the target's row at that position as either:
+- 3 - the base's row 3, unchanged
+- [3, {"price": "$199.00", "avg/$": 0.4}] - the base's row 3 with only the changed fields
+- {"name": ..., ...} - a new row
+Base rows not referenced were removed. "fields" are the other top level values (e.g. ranks, pareto, coverage) which changed, and
+"deleted_fields" the ones which went away. The chart applies deltas the same way as apply().
+"""
+
+"""Returns the delta turning the base data file (dictionary) into the target one, or None if either is an older list-only data file"""
+def make(base, target):
+	if not isinstance(base, dict) or not isinstance(target, dict):
+		return None
+	unused = {} # name -> base indexes not yet matched, in order
+	for i, row in enumerate(base['data']):
+		unused.setdefault(row['name'], []).append(i)
+
+	rows = []
+	stats = {'unchanged': 0, 'changed': 0, 'added': 0, 'removed': 0}
+	for row in target['data']:
+		indexes = unused.get(row['name'])
+		if not indexes:
+			rows.append(row)
+			stats['added'] += 1
+			continue
+		i = indexes.pop(0)
+		base_row = base['data'][i]
+		if base_row == row:
+			rows.append(i)
+			stats['unchanged'] += 1
+		elif base_row.keys() == row.keys():
+			rows.append([i, {key: value for key, value in row.items() if base_row[key] != value}])
+			stats['changed'] += 1
+		else: # Fields went away, send the whole row
+			rows.append(row)
+			stats['added'] += 1
+	stats['removed'] = sum(len(indexes) for indexes in unused.values())
+
+	fields = {key: value for key, value in target.items() if key != 'data' and base.get(key) != value}
+	deleted_fields = sorted(key for key in base if key not in target)
+	return {'rows': rows, 'fields': fields, 'deleted_fields': deleted_fields, 'stats': stats}
+
+"""Returns the target data file (dictionary) from the base one and the delta"""
+def apply(base, delta):
+	rows = []
+	for op in delta['rows']:
+		if isinstance(op, int):
+			rows.append(base['data'][op])
+		elif isinstance(op, list):
+			rows.append(dict(base['data'][op[0]], **op[1]))
+		else:
+			rows.append(op)
+	result = {key: value for key, value in base.items() if key not in delta['deleted_fields']}
+	result.update(delta['fields'])
+	result['data'] = rows
+	return result
+
+"""Returns the delta's JSON text"""
+def to_json(delta):
+	return json.dumps(delta, separators=(',', ':'))
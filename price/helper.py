@@ -1,7 +1,14 @@
-import boto3
 import configparser
+import functools
+import importlib
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+import threading
+import time
 
 """Utility functions"""
 
@@ -9,10 +16,10 @@ DEFAULT_LOG_LEVEL = None
 LOGGERS = []
 
 """
-Returns a new logger for the given name. Parameters:
-- name - the name of the logger
+Returns the logger for the given name. Parameters:
+- name - the name of the logger, i.e. the module's __name__
 - steram - where to stream output, e.g. sys.stdout. Defaults to None. Setting this will call logging.basicConfig(...) affecting all subsequent loggers.
-Returns: A new logger, default level is INFO
+Returns: The logger, default level is INFO
 """
 def get_logger(name, stream=None):
 	global DEFAULT_LOG_LEVEL
@@ -21,9 +28,10 @@ def get_logger(name, stream=None):
 		DEFAULT_LOG_LEVEL = logging.INFO
 	if stream is not None:
 		logging.basicConfig(stream=stream)
-	logger = logging.getLogger(__name__)
+	logger = logging.getLogger(name)
 	logger.setLevel(DEFAULT_LOG_LEVEL)
-	LOGGERS.append(logger)
+	if logger not in LOGGERS:
+		LOGGERS.append(logger)
 	return logger
 
 """Changes the log level for all future and previously created loggers"""
@@ -34,23 +42,88 @@ def set_log_level(level):
 	for logger in LOGGERS:
 		logger.setLevel(DEFAULT_LOG_LEVEL)
 
-"""Encapsulate S3 client and details"""
-class S3:
+"""
+A log message which is only built when a handler writes it, e.g. a report over every munged row. The record also gets the report's name
+and fields as the 'report' and 'fields' attributes so handlers and formatters can use them as structured data. See log_report().
+"""
+class Report:
+
+	def __init__(self, name, build, fields):
+		self.name = name
+		self.build = build
+		self.fields = fields
+		self.text = None
+
+	def __str__(self):
+		if self.text is None:
+			self.text = self.build()
+		return self.text
+
+"""
+Logs a report if the logger is enabled for the level, otherwise build is never called. Parameters:
+- logger - e.g. from get_logger()
+- level - e.g. logging.DEBUG
+- name - the report's name, e.g. 'munge'
+- build - function returning the report's text
+- fields - small values summarising the report (e.g. counts), these are logged with the record as its 'fields' attribute
+Returns: True if the report was logged
+"""
+def log_report(logger, level, name, build, **fields):
+	if not logger.isEnabledFor(level):
+		return False
+	logger.log(level, Report(name, build, fields), extra={'report': name, 'fields': fields})
+	return True
+
+"""Queues records for _LOG_LISTENER. Reports are passed as is so they're built in the listener's thread rather than the logging one."""
+class _QueueHandler(logging.handlers.QueueHandler):
+
+	def prepare(self, record):
+		if isinstance(record.msg, Report):
+			return record
+		return super().prepare(record)
 
-	"""This is not intended to be invoked directly, use the 'get__S3_DETAILS' function instead"""
-	def __init__(self, region, bucket, key_prefix):
-		self.client = boto3.client('s3', region_name=region) # bot3 s3 client
-		self.bucket = bucket # the bucket we should be using
-		self.key_prefix = key_prefix # key prefix to use when uploading files
+_LOG_LISTENER = None
+
+"""
+Moves the root logger's handlers (e.g. Lambda's stdout/CloudWatch one) behind a queue so logging only queues the record and a background
+thread does the writing. A slow or blocked stdout can't stall the scraping threads. Call flush_logs() before the process may be frozen,
+e.g. at the end of each Lambda invocation. Does nothing if already enabled.
+"""
+def enable_log_queue():
+	global _LOG_LISTENER
+	if _LOG_LISTENER is not None:
+		return
+	root = logging.getLogger()
+	handlers = list(root.handlers)
+	if len(handlers) == 0:
+		handlers = [logging.lastResort]
+	log_queue = queue.SimpleQueue()
+	for handler in list(root.handlers):
+		root.removeHandler(handler)
+	root.addHandler(_QueueHandler(log_queue))
+	_LOG_LISTENER = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+	_LOG_LISTENER.start()
 
-_S3_DETAILS = None
+"""Waits for queued records to be written, see enable_log_queue()"""
+def flush_logs():
+	if _LOG_LISTENER is not None:
+		_LOG_LISTENER.stop()
+		_LOG_LISTENER.start()
 
-"""Lazily retrieve S3 client and details from environment variables"""
-def get_s3_details():
-	global _S3_DETAILS
-	if _S3_DETAILS is None:
-		_S3_DETAILS = S3(os.environ['S3_REGION'], os.environ['S3_BUCKET'], os.environ['S3_KEY_PREFIX'])
-	return _S3_DETAILS
+"""Writes any queued records and puts the root logger's handlers back, see enable_log_queue()"""
+def disable_log_queue():
+	global _LOG_LISTENER
+	if _LOG_LISTENER is None:
+		return
+	_LOG_LISTENER.stop()
+	root = logging.getLogger()
+	for handler in list(root.handlers):
+		if isinstance(handler, _QueueHandler):
+			root.removeHandler(handler)
+	for handler in _LOG_LISTENER.handlers:
+		if handler is not logging.lastResort:
+			root.addHandler(handler)
+	_LOG_LISTENER = None
 
 _CONFIG_READ = False
 
@@ -64,3 +137,180 @@ def init_environ(file='priceperformancechart.ini'):
 		os.environ['S3_BUCKET'] = config['S3']['bucket']
 		os.environ['S3_KEY_PREFIX'] = config['S3']['key_prefix']
 		_CONFIG_READ = True
+
+IMPORT_TIMES = {} # module name -> seconds taken by timed_import() to import it
+
+"""
+Imports and returns the named module, recording how long the first import took in IMPORT_TIMES. Use this to defer loading heavy modules
+until they're needed (e.g. in the Lambda cold start path).
+"""
+def timed_import(name):
+	if name in sys.modules:
+		return sys.modules[name]
+	start = time.perf_counter()
+	module = importlib.import_module(name)
+	IMPORT_TIMES[name] = time.perf_counter() - start
+	return module
+
+"""
+Writes the metrics as a CloudWatch Embedded Metric Format log line (to stdout) so CloudWatch extracts them as metrics. Parameters:
+- namespace - CloudWatch namespace suffix, metrics go into 'PricePerformanceChart/<namespace>'
+- metrics - dictionary of {metric name: value}
+- unit - CloudWatch unit of the values, e.g. 'Milliseconds'. Can also be a dictionary of {metric name: unit}
+"""
+def log_metrics(namespace, metrics, unit='None'):
+	if len(metrics) == 0:
+		return
+	record = {'_aws': {'Timestamp': int(time.time() * 1000), 'CloudWatchMetrics': [{
+		'Namespace': 'PricePerformanceChart/' + namespace,
+		'Dimensions': [[]],
+		'Metrics': [{'Name': name, 'Unit': unit[name] if isinstance(unit, dict) else unit} for name in metrics]
+	}]}}
+	record.update(metrics)
+	print(json.dumps(record), flush=True)
+
+"""
+Timing spans and counters for a run. Spans nest (per thread) so a 'parse' span inside a 'cpu' span is recorded as 'cpu/parse'. Counters
+are recorded against the current span, e.g. count('rows', 24) inside 'cpu/parse' is 'cpu/parse.rows'. Spans with the same path are
+aggregated. When disabled (the default) span() returns a shared no-op context manager and count() returns straight away so instrumented
+code costs next to nothing. Use the module level span(), traced(), count() functions rather than this directly.
+"""
+class Tracer:
+
+	def __init__(self):
+		self.enabled = False
+		self.listeners = [] # Objects with span_started(path) and span_ended(path, duration_ms) methods, see add_listener()
+		self.reset()
+
+	"""
+	Registers a listener notified when spans start and end (in the thread running the span), e.g. to profile each stage. The listener must
+	have span_started(path) and span_ended(path, duration_ms) methods. Listeners only hear about spans while tracing is enabled.
+	"""
+	def add_listener(self, listener):
+		self.listeners.append(listener)
+
+	def remove_listener(self, listener):
+		self.listeners.remove(listener)
+
+	"""Forgets recorded spans and counters"""
+	def reset(self):
+		self.spans = {} # path -> {'count', 'total_ms', 'max_ms', 'errors'}
+		self.counters = {} # path.name -> value
+		self.local = threading.local()
+		self.lock = threading.Lock()
+
+	def span(self, name):
+		return _Span(self, name) if self.enabled else _NULL_SPAN
+
+	def count(self, name, value=1):
+		if not self.enabled:
+			return
+		path = self.current_path()
+		key = name if path is None else path + '.' + name
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	"""Returns the path of the current thread's innermost span or None if not in a span"""
+	def current_path(self):
+		stack = self._get_stack()
+		return stack[-1].path if len(stack) > 0 else None
+
+	"""Returns a dictionary {'spans': {path: {'count', 'total_ms', 'max_ms', 'errors'}}, 'counters': {name: value}}"""
+	def summary(self):
+		with self.lock:
+			return {'spans': {path: dict(stats) for path, stats in self.spans.items()}, 'counters': dict(self.counters)}
+
+	"""
+	Emits the summary. Parameters:
+	- json_file - if given, the summary is written to this file as JSON (e.g. for CLI runs)
+	- metrics - if True, the summary is logged as CloudWatch embedded metrics (span durations in milliseconds and counters)
+	"""
+	def emit(self, json_file=None, metrics=False):
+		summary = self.summary()
+		if json_file is not None:
+			with open(json_file, 'w', encoding='utf-8') as f:
+				json.dump(summary, f, indent='\t', sort_keys=True)
+		if metrics:
+			values = {path: stats['total_ms'] for path, stats in summary['spans'].items()}
+			units = {path: 'Milliseconds' for path in values}
+			values.update(summary['counters'])
+			units.update({name: 'Count' for name in summary['counters']})
+			log_metrics('Trace', values, units)
+		return summary
+
+	def _get_stack(self):
+		if not hasattr(self.local, 'stack'):
+			self.local.stack = []
+		return self.local.stack
+
+	def _record(self, path, duration_ms, error):
+		with self.lock:
+			stats = self.spans.get(path)
+			if stats is None:
+				stats = self.spans[path] = {'count': 0, 'total_ms': 0, 'max_ms': 0, 'errors': 0}
+			stats['count'] += 1
+			stats['total_ms'] += duration_ms
+			stats['max_ms'] = max(stats['max_ms'], duration_ms)
+			if error:
+				stats['errors'] += 1
+
+class _Span:
+
+	def __init__(self, tracer, name):
+		self.tracer = tracer
+		self.name = name
+
+	def __enter__(self):
+		parent_path = self.tracer.current_path()
+		self.path = self.name if parent_path is None else parent_path + '/' + self.name
+		self.tracer._get_stack().append(self)
+		for listener in self.tracer.listeners:
+			listener.span_started(self.path)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		duration_ms = (time.perf_counter() - self.start) * 1000
+		for listener in reversed(self.tracer.listeners):
+			listener.span_ended(self.path, duration_ms)
+		self.tracer._get_stack().pop()
+		self.tracer._record(self.path, duration_ms, exc_type is not None)
+		return False
+
+class _NullSpan:
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+_NULL_SPAN = _NullSpan()
+
+TRACER = Tracer()
+
+"""Turns on recording of spans and counters, forgetting anything previously recorded"""
+def enable_tracing():
+	TRACER.reset()
+	TRACER.enabled = True
+
+"""Returns a context manager timing the enclosed block as a span with the given name, e.g. 'with price.helper.span('parse'):'"""
+def span(name):
+	return TRACER.span(name)
+
+"""Decorator timing each call of the function as a span. The span name defaults to the function name."""
+def traced(name=None):
+	def decorator(func):
+		span_name = func.__name__ if name is None else name
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not TRACER.enabled:
+				return func(*args, **kwargs)
+			with TRACER.span(span_name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+
+"""Adds the value to the named counter of the current span, e.g. count('rows', len(data))"""
+def count(name, value=1):
+	TRACER.count(name, value)
@@ -1,101 +1,373 @@
-import boto3
+import time
+_MODULE_LOAD_START = time.time() # Before anything else so the cold start metric includes our imports
+
 import datetime
-import gzip
 import json
 import logging
 import price.helper
-import price.munger
-import price.scraper
-import price.webdriver
 import os
 import random
-import shutil
 import string
 
+"""
+Lambda entry point. Heavy modules (Selenium, Beautiful Soup, Boto3 and the price.* modules depending on them) and the S3 client are only
+loaded the first time they're needed rather than at import time. Import timings are recorded by price.helper.timed_import() and logged on
+cold starts. See price/startup.py for a full import profile.
+"""
+
 logger = price.helper.get_logger(__name__)
 
+PROFILING_KEY_PREFIX = 'tmp/profiling' # Where profiling reports are uploaded to in the S3 bucket
+TASKS_KEY_PREFIX = 'tmp/tasks' # Where fanned out runs keep their tasks and downloaded files in the S3 bucket
+AWS_LAYER_DIR = '/opt/aws' # Fonts and libraries from the Lambda layer (read only)
+AWS_TMP_DIR = '/tmp/aws' # Writable mirror of AWS_LAYER_DIR made of symlinks
+# Library symlinks the layer's zip can't hold: soname -> versioned file in the layer
+LIBRARY_LINKS = {
+	'libX11-xcb.so.1': 'libX11-xcb.so.1.0.0',
+	'libX11.so.6': 'libX11.so.6.3.0',
+	'libXau.so.6': 'libXau.so.6.0.0',
+	'libglib-2.0.so.0': 'libglib-2.0.so.0.5600.1',
+	'libxcb.so.1': 'libxcb.so.1.1.0'
+}
+
 def get_environ(key):
 	if key in os.environ:
 		return os.environ[key]
 	return '<not set>'
 
 def create_sym_link(source, target):
-	if not os.path.isfile(target):
+	if not os.path.lexists(target):
 		os.symlink(source, target)
 
+"""
+Mirrors the layer directory into the temp directory using symlinks rather than copying the files (fonts.conf references the temp
+directory). The library sonames are linked straight to the versioned files in the layer.
+"""
+def link_layer(layer_dir=AWS_LAYER_DIR, tmp_dir=AWS_TMP_DIR):
+	os.makedirs(tmp_dir + '/lib', exist_ok=True)
+	for entry in os.listdir(layer_dir):
+		if entry != 'lib':
+			create_sym_link(layer_dir + '/' + entry, tmp_dir + '/' + entry)
+	for entry in os.listdir(layer_dir + '/lib'):
+		create_sym_link(layer_dir + '/lib/' + entry, tmp_dir + '/lib/' + entry)
+	for soname, file_name in LIBRARY_LINKS.items():
+		create_sym_link(layer_dir + '/lib/' + file_name, tmp_dir + '/lib/' + soname)
+
+def new_uniqueifier():
+	return ''.join(random.choice(string.ascii_letters + string.digits) for x in range(6))
+
+"""Lazily creates the price.storage storage (the S3 bucket, one pooled client shared by every category and task)"""
+def get_storage():
+	return price.helper.timed_import('price.storage').get_storage()
+
+_TASK_QUEUE = None
+
+"""Lazily creates the price.tasks.SqsQueue for the queue at TASK_QUEUE_URL"""
+def get_task_queue():
+	global _TASK_QUEUE
+	if _TASK_QUEUE is None:
+		boto3 = price.helper.timed_import('boto3')
+		_TASK_QUEUE = price.helper.timed_import('price.tasks').SqsQueue(boto3.client('sqs'), os.environ['TASK_QUEUE_URL'])
+	return _TASK_QUEUE
+
+"""Returns the price.tasks.StorageStore of the fanned out run"""
+def get_task_store(run_name):
+	return price.helper.timed_import('price.tasks').StorageStore(get_storage(), TASKS_KEY_PREFIX + '/' + run_name)
+
+"""Splits the scrape into tasks (see price.tasks) and sends them to the task queue, each is run by its own Lambda invocation"""
+def fan_out(event):
+	price.helper.timed_import('price.scraper') # Also imports price.categories
+	price.helper.timed_import('price.tasks')
+	run_name = datetime.date.today().strftime("%Y%m%d") + '_' + new_uniqueifier()
+	tasks = price.tasks.plan([price.categories.get(type.value) for type in get_types(event)])
+	get_task_queue().submit(run_name, get_task_store(run_name), tasks)
+	logger.info('Fanned out run {} as {} tasks'.format(run_name, len(tasks)))
+
 class LambdaHandler:
 
 	def __init__(self):
 		logger.debug('Initialising handler...')
+		self.match_tables = {} # S3 key -> (ETag, JSON text) of match tables read or written by this (warm) Lambda
 		if 'DEBUG_ENABLED' in os.environ and os.environ['DEBUG_ENABLED'].lower() == 'true':
 			price.helper.set_log_level(logging.DEBUG)
+		price.helper.enable_log_queue() # So writing logs to CloudWatch never holds up scraping
 
-		if not os.path.isdir('/tmp/aws'):
-			# Setup fonts into /tmp. Note this is shared between initialisations and invocations
-			# TODO perhaps we setup fonts.conf to point to /opt where the Lambda layer is instead of /tmp and separate libs???
-			shutil.copytree('/opt/aws', '/tmp/aws')
-
-		# Setup libX11, glib2-2.56.1-4.amzn2.x86_64, libxcb, libXau libraries.
-		# For some reason symlinks aren't setup between invocations even after deploying a new version of the Lambda code
-		create_sym_link('/tmp/aws/lib/libX11-xcb.so.1.0.0', '/tmp/aws/lib/libX11-xcb.so.1')
-		create_sym_link('/tmp/aws/lib/libX11.so.6.3.0', '/tmp/aws/lib/libX11.so.6')
-		create_sym_link('/tmp/aws/lib/libXau.so.6.0.0', '/tmp/aws/lib/libXau.so.6')
-		create_sym_link('/tmp/aws/lib/libglib-2.0.so.0.5600.1', '/tmp/aws/lib/libglib-2.0.so.0')
-		create_sym_link('/tmp/aws/lib/libxcb.so.1.1.0', '/tmp/aws/lib/libxcb.so.1')
+		# Setup fonts and the libX11, glib2-2.56.1-4.amzn2.x86_64, libxcb, libXau libraries. Note /tmp is shared between initialisations and
+		# invocations but for some reason symlinks aren't setup between invocations even after deploying a new version of the Lambda code
+		link_layer()
 
 		# Setup environment variables for each initialisation
-		os.environ['FONTCONFIG_PATH'] = '/tmp/aws'
+		os.environ['FONTCONFIG_PATH'] = AWS_TMP_DIR
 		if 'LD_LIBRARY_PATH' in os.environ:
-			if os.environ['LD_LIBRARY_PATH'].find('/tmp/aws/lib') < 0:
-				os.environ['LD_LIBRARY_PATH'] = '/tmp/aws/lib:' + os.environ['LD_LIBRARY_PATH']
+			if os.environ['LD_LIBRARY_PATH'].find(AWS_TMP_DIR + '/lib') < 0:
+				os.environ['LD_LIBRARY_PATH'] = AWS_TMP_DIR + '/lib:' + os.environ['LD_LIBRARY_PATH']
 		else:
-			os.environ['LD_LIBRARY_PATH'] = '/tmp/aws/lib'
+			os.environ['LD_LIBRARY_PATH'] = AWS_TMP_DIR + '/lib'
 
 		logger.debug('Initialising handler complete (FONTCONFIG_PATH=' + get_environ('FONTCONFIG_PATH') + ', LD_LIBRARY_PATH=' + get_environ('LD_LIBRARY_PATH') + ')')
 
-	def scrape(self, event, context, type):
+	"""
+	Scrapes and publishes the type within the price.budget.Budget. Categories (in categories.ini order) are skipped once the budget's time for
+	fetching has run out, otherwise whatever was fetched in time is published with its coverage. Pages downloaded are checkpointed in the S3
+	bucket (see price.checkpoint) so if the invocation fails or runs out of time a retry the same day only downloads the rest. The checkpoint
+	is cleared once everything was fetched and published.
+	"""
+	def scrape(self, event, context, type, budget):
 		logger.debug('Handling scrape request for ' + type.name + ' type...')
-
-		uniqueifier = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(6))
+		if budget.expired():
+			logger.warning('Skipping {} as there is no time left to fetch it ({})'.format(type.value, budget))
+			price.helper.count('skipped')
+			return
+		self._import_scraper()
+		uniqueifier = new_uniqueifier()
 		today = datetime.date.today().strftime("%Y%m%d")
-		pricespy_prefix = '/tmp/pricespy_' + type.value + '_' + uniqueifier + '_' + today
-		userbenchmark_prefix = '/tmp/userbenchmark_' + type.value + '_' + uniqueifier + '_' + today + ('.csv' if type.name == 'HDD' else '')
-		chromedriver_log = '/tmp/chromedriver_' + type.value + '_' + uniqueifier + '.log'
-		driver = price.webdriver.ChromeWebDriver('/opt/chromium/chromium', '/opt/chromedriver/chromedriver', chromedriver_log)
+		pricespy_prefix, userbenchmark_prefix = self._get_prefixes(type.value, today, uniqueifier)
+		driver, chromedriver_log = self._create_driver(type.value, uniqueifier)
+
+		checkpoint = price.checkpoint.Checkpoint(get_storage(), price.checkpoint.key_prefix(today, type.value))
 
 		try:
-			scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, driver, type)
+			scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, driver, type, budget, checkpoint)
 			scraper.download()
 			scraper.quit_selenium()
 		except:
-			logger.error('Failed to scrape, collecting logs...')
-			if os.path.isfile(chromedriver_log):
-				with open(chromedriver_log, 'r') as f:
-					logger.error('Output from ' + chromedriver_log + ' is:\n' + f.read())
+			self._log_chromedriver(chromedriver_log)
+			raise
+
+		coverages = {market: scraper.coverage(market) for market in scraper.markets()}
+		for market, coverage in coverages.items():
+			if not coverage['complete']:
+				logger.warning('Publishing partial {} data: {}'.format(scraper.category.data_key(market), coverage))
+		self._publish(scraper, type, today, uniqueifier, bool(event.get('full_rebuild', False)), coverages)
+		if all(coverage['complete'] for coverage in coverages.values()):
+			try:
+				checkpoint.clear()
+			except Exception as e: # Already published so don't fail (and retry) the scrape, the bucket's lifecycle rule expires it
+				logger.warning('Could not clear the {} checkpoint: {}'.format(type.value, e))
+
+	"""
+	Runs a price.tasks.Task of the run named '<yyyyMMdd>_<uniqueifier>' (see fan_out()). Fetch tasks save the downloaded files to the store
+	and return {'kind': <task kind>, 'files': [names], 'coverage': <price.pagination.Coverage.stats() or None>}, the munge task loads its
+	dependencies' files from the store (see _collect_fetches()) then parses, munges and uploads them with their coverage, like scrape(). Step
+	timeouts come from the invocation's price.budget.Budget.
+	"""
+	def run_task(self, task, store, run_name, budget):
+		logger.debug('Running task ' + task.id + ' of run ' + run_name + '...')
+		self._import_scraper()
+		today, uniqueifier = run_name.split('_')
+		category = price.categories.get(task.type_value)
+		pricespy_prefix, userbenchmark_prefix = self._get_prefixes(task.type_value, today, uniqueifier)
+
+		if task.kind == 'munge':
+			scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, None, price.scraper.Type(task.type_value))
+			scraper.all_files_downloaded, coverages = self._collect_fetches(task, store, scraper)
+			for market, coverage in coverages.items():
+				if not coverage['complete']:
+					logger.warning('Publishing partial {} data: {}'.format(category.data_key(market), coverage))
+			self._publish(scraper, scraper.type, today, uniqueifier, False, coverages)
+			return None
+
+		end_name = price.tasks.END_PREFIX + category.data_key(task.market)
+		if task.kind == 'fetch_price' and store.exists(end_name) and task.page > int(store.get(end_name)):
+			return {'kind': task.kind, 'market': task.market, 'files': [], 'coverage': None} # Past the last page
+		coverage = None
+		driver, chromedriver_log = self._create_driver(task.type_value, uniqueifier)
+		scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, driver, price.scraper.Type(task.type_value), budget)
+		try:
+			if task.kind == 'fetch_price':
+				source = scraper.price_source(task.market)
+				files = [source.download_page(scraper.price_prefix(task.market), task.page)]
+				num_products = len(source.product_names(files[0]))
+				if num_products < category.price_page_size: # Last page, later pages can skip themselves
+					store.put(end_name, str(task.page).encode('utf-8'))
+				if num_products == 0:
+					files = []
 			else:
-				logger.error('No output from ' + chromedriver_log + '.')
+				files = scraper.ub.download(userbenchmark_prefix, category.perf_max_pages, deadline=budget.fetch_deadline())
+				coverage = None if getattr(scraper.ub, 'coverage', None) is None else scraper.ub.coverage.stats()
+			scraper.quit_selenium()
+		except:
+			self._log_chromedriver(chromedriver_log)
 			raise
+		for file in files:
+			with open(file, 'rb') as f:
+				store.put(os.path.basename(file), f.read())
+		return {'kind': task.kind, 'market': task.market, 'files': [os.path.basename(file) for file in files], 'coverage': coverage}
+
+	"""
+	Fetches the munge task's dependencies' files from the store into /tmp. Each market's PriceSpy pages are kept in page order until one
+	failed (see price.tasks.get_error()) or adds no new products, like price.pagination.fetch_pages() does for scrape(). Returns (files,
+	coverages) where coverages is {market: coverage like price.scraper.Scraper.coverage()'s}.
+	"""
+	def _collect_fetches(self, task, store, scraper):
+		plan = price.tasks.load_plan(store)
+		files = []
+		price_coverages = {market: price.pagination.Coverage(scraper.category.price_max_pages, page_size=scraper.category.price_page_size) for market in scraper.markets()}
+		perf_coverage = None
+		for dep in task.deps: # Each market's pages in page order, see price.tasks.plan()
+			price_coverage = price_coverages.get(plan[dep].market)
+			error = price.tasks.get_error(store, dep)
+			if error is not None:
+				logger.warning('Task {} failed, keeping the {} pages before it: {}'.format(dep, price_coverage.kept_pages, error))
+				price_coverage.fail()
+				continue
+			if price_coverage is not None and price_coverage.stop_reason() is not None:
+				continue # After a failed or last page
+			result = price.tasks.get_result(store, dep)
+			fetched = []
+			for name in result['files']:
+				fetched.append('/tmp/' + name)
+				store.fetch(name, fetched[-1])
+			if price_coverage is None: # UserBenchmark
+				files.extend(fetched)
+				perf_coverage = result['coverage']
+			elif len(fetched) == 0:
+				price_coverage.end()
+			elif price_coverage.add_page(scraper.price_source(plan[dep].market).product_names(fetched[0])):
+				files.extend(fetched)
+			else:
+				os.remove(fetched[0]) # Past the end page repeating earlier ones
+		coverages = {}
+		for market, price_coverage in price_coverages.items():
+			price_coverage.report()
+			complete = price_coverage.complete() and (perf_coverage is None or perf_coverage['complete'])
+			coverages[market] = {'complete': complete, 'pricespy': price_coverage.stats(), 'userbenchmark': perf_coverage}
+		return files, coverages
+
+	def _import_scraper(self):
+		price.helper.timed_import('price.budget')
+		price.helper.timed_import('price.checkpoint')
+		price.helper.timed_import('price.scraper')
+		price.helper.timed_import('price.pagination')
+		price.helper.timed_import('price.webdriver')
+		price.helper.timed_import('price.munger')
+
+	"""Returns the PriceSpy and UserBenchmark file prefixes in /tmp of a type's run"""
+	def _get_prefixes(self, type_value, today, uniqueifier):
+		pricespy_prefix = '/tmp/pricespy_' + type_value + '_' + uniqueifier + '_' + today
+		userbenchmark_prefix = '/tmp/userbenchmark_' + type_value + '_' + uniqueifier + '_' + today + price.categories.get(type_value).perf_suffix()
+		return pricespy_prefix, userbenchmark_prefix
+
+	"""Returns a ChromeWebDriver for the type and the path of its ChromeDriver log"""
+	def _create_driver(self, type_value, uniqueifier):
+		chromedriver_log = '/tmp/chromedriver_' + type_value + '_' + uniqueifier + '.log'
+		chrome_dir = '/tmp/chrome_' + type_value # Categories are scraped in parallel and browsers can't share a user data directory
+		os.makedirs(chrome_dir, exist_ok=True)
+		# The profile from the layer is restored once per container, the disk cache in chrome_dir is kept between warm invocations
+		profile = price.chromeprofile.ChromeProfile(AWS_LAYER_DIR + '/chrome_profile.tar')
+		# CHROME_FLAG_SET picks one of price.webdriver.CHROME_FLAG_SETS, e.g. the winner of price.chromebench, without a code change
+		flag_set = os.environ.get('CHROME_FLAG_SET', price.webdriver.DEFAULT_FLAG_SET)
+		return price.webdriver.ChromeWebDriver('/opt/chromium/chromium', '/opt/chromedriver/chromedriver', chromedriver_log, chrome_dir, profile,
+			flag_set), chromedriver_log
+
+	def _log_chromedriver(self, chromedriver_log):
+		logger.error('Failed to scrape, collecting logs...')
+		if os.path.isfile(chromedriver_log):
+			with open(chromedriver_log, 'r') as f:
+				logger.error('Output from ' + chromedriver_log + ' is:\n' + f.read())
+		else:
+			logger.error('No output from ' + chromedriver_log + '.')
 
+	"""
+	Archives (if enabled), parses, munges and uploads the scraper's downloaded files, one data file per market. The coverages ({market:
+	coverage}, if given) are published with the data.
+	"""
+	def _publish(self, scraper, type, today, uniqueifier, full_rebuild, coverages=None):
 		if os.environ['UPLOAD_DOM'] == 'true':
-			for file_downloaded in scraper.all_files_downloaded:
-				with open(file_downloaded, 'r', encoding='utf-8') as f:
-					compressed_data = gzip.compress(f.read().encode('utf-8'))
-					s3.put_object(Body=compressed_data, Bucket=os.environ['S3_BUCKET'], CacheControl='max-age=31536000', ContentEncoding='gzip', Key=file_downloaded[1:])
-			logger.debug('Uploaded raw download files to S3: ' + str(scraper.all_files_downloaded))
+			self._archive(scraper, type, today, uniqueifier)
 
 		data = scraper.parse()
-		data = scraper.munge(data['pricespy_data'], data['userbenchmark_data'])
-		logger.debug('Munge complete. #Combined={0}, #OrphanPrice={1}, #OrphanPerformance={2}'.format(len(data['data']), len(data['orphan_price_data']), len(data['orphan_perf_data'])))
-		logger.debug(price.munger.format(data))
+		for market in scraper.markets()[1:]:
+			if len(data['market_data'][market]) == 0: # E.g. its first page failed, don't replace its published data with nothing
+				logger.warning('Not publishing {} as none of its pages were fetched'.format(scraper.category.data_key(market)))
+				del data['market_data'][market]
+		match_table_etags = {} # market -> (key, ETag) of its saved MatchTable
+		match_tables = {}
+		for market in data['market_data']:
+			match_table_key = 'tmp/match_table_' + scraper.category.data_key(market) + '.json'
+			etag, text = self._get_match_table(match_table_key)
+			match_table_etags[market] = (match_table_key, etag)
+			match_tables[market] = scraper.load_match_table(text, full_rebuild)
+		munged = scraper.munge_markets(data['market_data'], data['userbenchmark_data'], match_tables)
+		for market, result in munged.items():
+			data_key = scraper.category.data_key(market)
+			match_table_key, etag = match_table_etags[market]
+			self._put_match_table(match_table_key, etag, result['match_table'].to_json())
+			price.helper.log_report(logger, logging.DEBUG, 'munge', lambda result=result: 'Munge complete. #Combined={0}, #OrphanPrice={1}, #OrphanPerformance={2}, #Reused={3}, #Recomputed={4}\n{5}'.format(len(result['data']), len(result['orphan_price_data']), len(result['orphan_perf_data']), result['stats']['reused'], result['stats']['recomputed'], price.munger.format(result)),
+				type=data_key, combined=len(result['data']), orphan_price=len(result['orphan_price_data']), orphan_perf=len(result['orphan_perf_data']), **result['stats'])
 
-		scraper.upload_data_to_s3(s3, os.environ['S3_BUCKET'], os.environ['S3_KEY_PREFIX'], json.dumps(data['data']), today)
-		logger.debug('Uploading to S3 complete')
+			with price.helper.span('serialise'):
+				json_data = json.dumps(price.munger.to_data_file(result, None if coverages is None else coverages[market]))
+			manifest = scraper.upload_data(get_storage(), os.environ['S3_KEY_PREFIX'], json_data, today, market=market)
+			logger.debug('Uploading {} to S3 complete, published manifest generation {}'.format(data_key, manifest['generation']))
 
-s3 = boto3.client('s3', region_name=os.environ['S3_REGION'])
+	"""Archives the raw downloaded files (see price.archive)"""
+	@price.helper.traced('archive')
+	def _archive(self, scraper, type, today, uniqueifier):
+		pages = {}
+		for file_downloaded in scraper.all_files_downloaded:
+			with open(file_downloaded, 'rb') as f:
+				pages[os.path.basename(file_downloaded)] = f.read()
+		price.helper.timed_import('price.archive')
+		archive = price.archive.Archive(get_storage())
+		manifest = archive.put_run(price.archive.run_name(type.value, today, uniqueifier), pages)
+		price.helper.count('bytes', manifest['stats']['stored_bytes'])
+		logger.debug('Archived raw download files to S3: {} ({})'.format(str(scraper.all_files_downloaded), manifest['stats']))
 
-lambda_handler = LambdaHandler()
+	"""
+	Returns the (ETag, JSON text) of the match table saved under the key, (None, None) if there isn't one. A warm Lambda revalidates the
+	table it last saw rather than downloading it again.
+	"""
+	def _get_match_table(self, key):
+		cached = self.match_tables.get(key)
+		try:
+			obj = get_storage().get(key, if_none_match=None if cached is None else cached[0])
+		except price.storage.NotModified:
+			return cached
+		if obj is None:
+			return None, None
+		self.match_tables[key] = (obj.etag, obj.text())
+		return self.match_tables[key]
+
+	"""
+	Saves the match table's JSON text under the key if it hasn't changed since it was read (with the given ETag, None if there wasn't one).
+	If another run saved one in the meantime, that one is kept since it's just as good.
+	"""
+	def _put_match_table(self, key, etag, text):
+		try:
+			new_etag = get_storage().put(key, text, content_type='application/json', if_match=etag, if_none_match='*' if etag is None else None)
+		except price.storage.PreconditionFailed:
+			logger.warning('Match table ' + key + ' was saved by another run, keeping that one')
+			self.match_tables.pop(key, None)
+			return
+		self.match_tables[key] = (new_etag, text)
+
+"""Returns the price.scraper.Types to scrape: those listed in the event's 'categories' (e.g. ["cpu"]) or else every enabled category"""
+def get_types(event):
+	if 'categories' in event:
+		return [price.scraper.Type(value) for value in event['categories']]
+	return [type for type in price.scraper.Type if price.categories.get(type.value).enabled]
+
+_LAMBDA_HANDLER = None
+
+"""Lazily creates the LambdaHandler. Logs the cold start metric the first time."""
+def get_lambda_handler():
+	global _LAMBDA_HANDLER
+	if _LAMBDA_HANDLER is None:
+		init_start = time.time()
+		_LAMBDA_HANDLER = LambdaHandler()
+		now = time.time()
+		price.helper.log_metrics('ColdStart', {'ColdStartDuration': (now - _MODULE_LOAD_START) * 1000, 'ColdStartInitDuration': (now - init_start) * 1000}, 'Milliseconds')
+	return _LAMBDA_HANDLER
 
 def handler(event, context):
+	try:
+		_handle(event, context)
+	finally:
+		price.helper.flush_logs() # Before Lambda freezes the process
+
+def _handle(event, context):
+	lambda_handler = get_lambda_handler()
 	if 'driver' in event:
 		# Print temp directory
 		#for root, dirs, files in os.walk('/tmp/aws/'):
@@ -105,8 +377,40 @@ def handler(event, context):
 		#print(str(os.system('/opt/chromedriver/chromedriver')))
 
 		# Print Chrome browser verison
-		driver = price.webdriver.ChromeWebDriver('/opt/chromium/chromium', '/opt/chromedriver/chromedriver', '/tmp/chromedriver.log').getWebDriver()
+		webdriver = price.helper.timed_import('price.webdriver')
+		driver = webdriver.ChromeWebDriver('/opt/chromium/chromium', '/opt/chromedriver/chromedriver', '/tmp/chromedriver.log').getWebDriver()
 		print(f'Chrome browser version: {driver.capabilities["browserVersion"]}')
+	elif 'scrape' in event and event.get('fan_out'):
+		fan_out(event)
 	elif 'scrape' in event:
-		lambda_handler.scrape(event, context, price.scraper.Type.CPU)
-		lambda_handler.scrape(event, context, price.scraper.Type.HDD)
\ No newline at end of file
+		price.helper.timed_import('price.scraper') # Also imports price.categories
+		budget = price.helper.timed_import('price.budget').from_context(context)
+		price.helper.enable_tracing()
+		memory_sampler = price.helper.timed_import('price.memory').MemorySampler().start()
+		profiler = None
+		if event.get('profile'):
+			profiler = price.helper.timed_import('price.profiler').Profiler('/tmp/profile').start()
+		try:
+			with price.helper.span('scrape'):
+				concurrency = int(os.environ.get('CATEGORY_CONCURRENCY', price.categories.DEFAULT_CONCURRENCY))
+				price.categories.run_all(get_types(event), lambda type: lambda_handler.scrape(event, context, type, budget), concurrency)
+		finally:
+			price.helper.TRACER.emit(metrics=True) # Even on failure so we can see how far it got
+			logger.info(price.memory.format(memory_sampler.stop()))
+			memory_sampler.emit_metrics()
+			if profiler is not None:
+				key_prefix = PROFILING_KEY_PREFIX + '/' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+				price.profiler.upload_reports(get_storage(), key_prefix, profiler.stop())
+				logger.info('Profiling reports uploaded to S3 under {}:\n{}'.format(key_prefix, profiler.format_hotspots()))
+	elif 'Records' in event: # Fanned out tasks from the task queue
+		budget = price.helper.timed_import('price.budget').from_context(context)
+		price.helper.enable_tracing()
+		try:
+			for record in event['Records']:
+				message = json.loads(record['body'])
+				with price.helper.span('task'):
+					get_task_queue().handle(message, get_task_store(message['run']), lambda task, store: lambda_handler.run_task(task, store, message['run'], budget),
+						receive_count=record.get('attributes', {}).get('ApproximateReceiveCount'))
+		finally:
+			price.helper.TRACER.emit(metrics=True)
+	logger.debug('Lazy import timings (seconds): ' + str(price.helper.IMPORT_TIMES))
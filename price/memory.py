@@ -0,0 +1,147 @@
+import os
+import price.helper
+import shutil
+import tempfile
+import threading
+
+"""
+Samples memory and disk usage in a background thread throughout a run to find out how big the Lambda really needs to be. Tracked:
+- RSS of this (Python) process
+- total RSS of its descendant processes, i.e. the ChromeDriver/GeckoDriver and browser process tree
+- used space of the temp directory's file system (i.e. Lambda's /tmp)
+
+High-water marks are kept for the whole run and for each stage span (see price.helper.span()) while it's running. Process information is
+read from /proc so only Linux (e.g. Lambda) is supported. Elsewhere memory is reported as 0.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+STAGES = ['download', 'parse', 'munge', 'upload']
+MEASURES = ['python_rss', 'browser_rss', 'total_rss', 'tmp_used']
+
+"""Returns the resident set size in bytes of the process or 0 if it can't be read (e.g. the process has exited, not Linux)"""
+def read_rss(pid='self'):
+	try:
+		with open('/proc/' + str(pid) + '/status', 'r') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024 # kB
+	except (OSError, ValueError):
+		pass
+	return 0
+
+"""Returns the process ids of all descendants of the process (children, grandchildren...)"""
+def descendant_pids(pid=None):
+	pid = os.getpid() if pid is None else pid
+	children = {}
+	try:
+		entries = os.listdir('/proc')
+	except OSError:
+		return []
+	for entry in entries:
+		if not entry.isdigit():
+			continue
+		try:
+			with open('/proc/' + entry + '/stat', 'r') as f:
+				stat = f.read()
+		except OSError:
+			continue
+		parent = int(stat.rsplit(')', 1)[1].split()[1]) # Process name is in brackets and may contain spaces, parent pid is after the state
+		children.setdefault(parent, []).append(int(entry))
+	result = []
+	todo = list(children.get(pid, []))
+	while len(todo) > 0:
+		child = todo.pop()
+		result.append(child)
+		todo.extend(children.get(child, []))
+	return result
+
+class MemorySampler:
+
+	"""
+	Parameters:
+	- interval - seconds between samples. Defaults to 0.25
+	- tmp_dir - directory whose file system usage is tracked. Defaults to the system temp directory (i.e. /tmp)
+	- stages - span names (last part of the span path) to keep high-water marks for. Defaults to STAGES
+	"""
+	def __init__(self, interval=0.25, tmp_dir=None, stages=STAGES):
+		self.interval = interval
+		self.tmp_dir = tempfile.gettempdir() if tmp_dir is None else tmp_dir
+		self.stages = stages
+		self.lock = threading.Lock()
+		self.running_stages = []
+		self.peaks = {'run': dict.fromkeys(MEASURES, 0)} # stage path or 'run' -> {measure: bytes}
+		self.stopped = threading.Event()
+		self.thread = None
+
+	"""Starts sampling in a background thread and listening to stage spans (tracing must be enabled for stages to be seen)"""
+	def start(self):
+		price.helper.TRACER.add_listener(self)
+		self.thread = threading.Thread(target=self._run, name='MemorySampler', daemon=True)
+		self.thread.start()
+		return self
+
+	"""Stops sampling and returns the report, see report()"""
+	def stop(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+		price.helper.TRACER.remove_listener(self)
+		self.sample()
+		return self.report()
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			self.sample()
+
+	"""Takes a sample now, updating the high-water marks of the run and running stages"""
+	def sample(self):
+		python_rss = read_rss()
+		browser_rss = sum(read_rss(pid) for pid in descendant_pids())
+		values = {'python_rss': python_rss, 'browser_rss': browser_rss, 'total_rss': python_rss + browser_rss, 'tmp_used': self._tmp_used()}
+		with self.lock:
+			for key in ['run'] + self.running_stages:
+				peaks = self.peaks[key]
+				for measure, value in values.items():
+					peaks[measure] = max(peaks[measure], value)
+
+	def _tmp_used(self):
+		try:
+			return shutil.disk_usage(self.tmp_dir).used
+		except OSError:
+			return 0
+
+	def span_started(self, path):
+		if path.split('/')[-1] not in self.stages:
+			return
+		with self.lock:
+			self.running_stages.append(path)
+			self.peaks.setdefault(path, dict.fromkeys(MEASURES, 0))
+		self.sample()
+
+	def span_ended(self, path, duration_ms):
+		if path not in self.running_stages:
+			return
+		self.sample() # Catch anything since the last sample
+		with self.lock:
+			self.running_stages.remove(path)
+
+	"""Returns the high-water marks in MiB, i.e. {'run' or stage path: {'python_rss', 'browser_rss', 'total_rss', 'tmp_used'}}"""
+	def report(self):
+		with self.lock:
+			return {key: {measure: round(value / 1048576, 1) for measure, value in peaks.items()} for key, peaks in self.peaks.items()}
+
+	"""Logs the report as CloudWatch embedded metrics, e.g. 'cpu/download.total_rss' in megabytes"""
+	def emit_metrics(self):
+		metrics = {}
+		for key, peaks in self.report().items():
+			for measure, value in peaks.items():
+				metrics[key + '.' + measure] = value
+		price.helper.log_metrics('Memory', metrics, 'Megabytes')
+
+"""Formats the report for printing or logging"""
+def format(report):
+	result = 'Memory high-water marks (MiB):\n {:30} {:>10} {:>10} {:>10} {:>10}\n'.format('stage', 'python', 'browser', 'total', '/tmp used')
+	for key, peaks in report.items():
+		result += ' {:30} {:10.1f} {:10.1f} {:10.1f} {:10.1f}\n'.format(key, peaks['python_rss'], peaks['browser_rss'], peaks['total_rss'], peaks['tmp_used'])
+	return result
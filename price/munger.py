@@ -1,8 +1,87 @@
 import copy
+import json
 import re
 
+"""
+Remembers what each raw PriceSpy name resolved to (i.e. the result of canonicalising or parsing it) so the next run only has to do that
+work for names it hasn't seen before. Most names are the same day to day. The table is tied to the munger's RULES_VERSION so a change to
+the rules throws the old table away. Use one table per munge and save it with to_json() afterwards.
+"""
+class MatchTable:
+
+	"""
+	Parameters:
+	- version - the munger's RULES_VERSION the matches were resolved with
+	- matches - dictionary of {raw PriceSpy name: resolved value} from a previous run. Defaults to None (i.e. nothing to reuse)
+	"""
+	def __init__(self, version, matches=None):
+		self.version = version
+		self.matches = {} if matches is None else matches
+		self.seen = {} # Names resolved in this run. Only these are saved so products no longer listed drop out of the table
+		self.reused = 0
+		self.recomputed = 0
+
+	"""
+	Returns a copy of the resolved value for the name, reusing the previous run's value if there is one otherwise calling derive(name)
+	"""
+	def resolve(self, name, derive):
+		if name in self.matches:
+			value = self.matches[name]
+			self.reused += 1
+		else:
+			value = derive(name)
+			self.recomputed += 1
+		self.seen[name] = value
+		return copy.deepcopy(value) # Callers add to dictionaries, don't let that leak into the table
+
+	"""
+	Returns a copy of the resolved value for each name like resolve(), but calls derive_all(names) once with the names not in the previous
+	run's table. Values must be flat (e.g. a dictionary of strings and numbers) as only a shallow copy is made.
+	"""
+	def resolve_all(self, names, derive_all):
+		missing = [name for name in dict.fromkeys(names) if name not in self.matches]
+		derived = dict(zip(missing, derive_all(missing))) if len(missing) > 0 else {}
+		values = []
+		for name in names:
+			if name in self.matches:
+				value = self.matches[name]
+				self.reused += 1
+			else:
+				value = derived[name]
+				self.recomputed += 1
+			self.seen[name] = value
+			values.append(copy.copy(value))
+		return values
+
+	"""Returns the statistics dictionary {'reused': <count>, 'recomputed': <count>}"""
+	def stats(self):
+		return {'reused': self.reused, 'recomputed': self.recomputed}
+
+	"""Serialises the names resolved in this run to JSON"""
+	def to_json(self):
+		return json.dumps({'version': self.version, 'matches': self.seen})
+
+	"""
+	Returns a MatchTable from the JSON written by to_json(). If the JSON is None/empty or was written with a different rules version, an
+	empty table is returned so everything is recomputed.
+	"""
+	@staticmethod
+	def from_json(text, version):
+		if text:
+			saved = json.loads(text)
+			if saved.get('version') == version:
+				return MatchTable(version, saved['matches'])
+		return MatchTable(version)
+
 class CpuMunger:
 
+	# Bump this whenever _canonicalise_pricespy_name() changes so saved MatchTables are discarded
+	RULES_VERSION = 'cpu-1'
+	# Attributes to precompute rank orders for, mapped to whether lower values are better
+	RANK_ATTRIBUTES = {'price': True, '1-core/$': False, '2-core/$': False, '8-core/$': False, 'avg/$': False, 'user-rating/$': False}
+	# Performance attributes to compute the price-performance (Pareto) frontier for
+	PARETO_ATTRIBUTES = ['avg', '1-core', '2-core', '8-core', 'user-rating']
+
 	"""
 	Munges together price and performance data together by matching on names (with some reformatting)
 
@@ -10,28 +89,60 @@ class CpuMunger:
 	- price_data - list of dictionaries (name, price)
 	- perf_data - list of dictionaries (name, performance attribute 1, performance attribute 2...)
 
-	Output is a dictionary of { 'data': [ combined dictionary  ], 'orphan_price_data': [ price_data ], 'orphan_perf_data': [ perf_data] }
+	- match_table - MatchTable from the previous run to reuse canonicalised names from. Defaults to None (i.e. a full rebuild)
+
+	Output is a dictionary of { 'data': [ combined dictionary  ], 'orphan_price_data': [ price_data ], 'orphan_perf_data': [ perf_data],
+	'ranks': { attribute: [ index into data ] }, 'pareto': { attribute: [ index into data ] }, 'match_table': MatchTable to save for
+	the next run, 'stats': {'reused': <count>, 'recomputed': <count>} }. See rank_indexes() and pareto_frontier().
+	"""
+	def munge(self, price_data, perf_data, match_table=None):
+		return self.match(price_data, self.build_perf_index(perf_data), match_table)
+
+	"""
+	Builds the index of the performance data which match() looks names up in. It's only read by match() so one index can be shared by
+	the munges of several markets at once.
 	"""
-	def munge(self, price_data, perf_data):
-		orphan_price_data = copy.deepcopy(price_data)
-		orphan_price_data.sort(key = lambda x: x['name'])
-		orphan_perf_data = copy.deepcopy(perf_data)
-		orphan_perf_data.sort(key = lambda x: x['name'])
+	def build_perf_index(self, perf_data):
+		rows = copy.deepcopy(perf_data)
+		rows.sort(key = lambda x: x['name'])
+		names = {} # name -> indexes of the rows with the name
+		for i, row in enumerate(rows):
+			names.setdefault(row['name'], []).append(i)
+		return {'rows': rows, 'names': names}
+
+	"""Matches the price data against the performance index (see build_perf_index()). Returns the same as munge()."""
+	def match(self, price_data, perf_index, match_table=None):
+		match_table = _check_match_table(match_table, self.RULES_VERSION)
+		rows = perf_index['rows']
+		taken = {} # name -> number of rows with the name matched so far
+		matched = set()
 		data = []
+		orphan_price_data = []
 
-		for price_data_row in reversed(orphan_price_data): # Reverse order because looping and deleting will skip items
-			name = self._canonicalise_pricespy_name(price_data_row['name'])
-			index = self._find_name(orphan_perf_data, name)
-			if index >= 0:
-				perf_item = orphan_perf_data[index]
+		for price_data_row in reversed(sorted(price_data, key = lambda x: x['name'])): # Reversed so repeated names match the same rows as before
+			name = match_table.resolve(price_data_row['name'], self._canonicalise_pricespy_name)
+			indexes = perf_index['names'].get(name, [])
+			count = taken.get(name, 0)
+			if count < len(indexes):
+				taken[name] = count + 1
+				matched.add(indexes[count])
+				perf_item = copy.deepcopy(rows[indexes[count]])
 				perf_item.update(price_data_row) # Update dict with pricespy name and price
-				del orphan_perf_data[index]
-				orphan_price_data.remove(price_data_row)
-				data.insert(0, perf_item)
+				data.append(perf_item)
+			else:
+				orphan_price_data.append(copy.deepcopy(price_data_row))
+		data.reverse()
+		orphan_price_data.reverse()
+		orphan_perf_data = [copy.deepcopy(row) for i, row in enumerate(rows) if i not in matched]
+		data = self.enrich_price_performance(data)
 		return {
-			'data': self.enrich_price_performance(data),
+			'data': data,
 			'orphan_price_data': orphan_price_data,
-			'orphan_perf_data': orphan_perf_data
+			'orphan_perf_data': orphan_perf_data,
+			'ranks': rank_all(data, self.RANK_ATTRIBUTES),
+			'pareto': pareto_all(data, self.PARETO_ATTRIBUTES),
+			'match_table': match_table,
+			'stats': match_table.stats()
 		}
 
 	"""
@@ -41,7 +152,7 @@ class CpuMunger:
 		for row in data:
 			if 'price' not in row:
 				return
-			price = float(row['price'].replace('$', '').replace(',', ''))
+			price = _to_number(row['price'])
 			_calc_price_performance(row, '1-core', price)
 			_calc_price_performance(row, '2-core', price)
 			_calc_price_performance(row, '8-core', price)
@@ -66,56 +177,74 @@ class CpuMunger:
 	p_intel_special_ed = re.compile('KS Special Edition')
 	p_amd_threadripper = re.compile('AMD Ryzen Threadripper ')
 
-	"""
-	Finds the index of the dictionary item with the given name in the 'name' attribute. Returns -1 if not found.
-	"""
-	def _find_name(self, list, name):
-		for i, item in enumerate(list):
-			if 'name' in item and item['name'] == name:
-				return i
-		return -1
-
 class HddMunger:
 
+	# Bump this whenever _parse_pricespy_name() changes so saved MatchTables are discarded
+	RULES_VERSION = 'hdd-1'
+	# Attributes to precompute rank orders for, mapped to whether lower values are better
+	RANK_ATTRIBUTES = {'price': True, 'avg/$': False, 'capacity/$': False, '$/capacity': True}
+	# Performance attributes to compute the price-performance (Pareto) frontier for
+	PARETO_ATTRIBUTES = ['avg', 'capacity']
+
 	"""
 	Munges together price and performance data together. Note this will produce an empty list for 'orphan_perf_data' because it's huge.
 
 	Input is:
 	- price_data - list of dictionaries (name, price)
 	- perf_data - list of dictionaries (brand, mfg_code, model, avg)
+	- match_table - MatchTable from the previous run to reuse parsed names from. Defaults to None (i.e. a full rebuild)
 
-	Output is a dictionary of { 'data': [ combined dictionary  ], 'orphan_price_data': [ price_data ], 'orphan_perf_data': [<empty list>] }
+	Output is a dictionary of { 'data': [ combined dictionary  ], 'orphan_price_data': [ price_data ], 'orphan_perf_data': [<empty list>],
+	'ranks': { attribute: [ index into data ] }, 'pareto': { attribute: [ index into data ] }, 'match_table': MatchTable,
+	'stats': {'reused': <count>, 'recomputed': <count>} }
 	"""
-	def munge(self, price_data, perf_data):
-		orphan_price_data = copy.deepcopy(price_data)
-		orphan_price_data.sort(key = lambda x: x['name'])
-		perf_index = self._build_perf_index(perf_data)
+	def munge(self, price_data, perf_data, match_table=None):
+		return self.match(price_data, self.build_perf_index(perf_data), match_table)
+
+	"""Matches the price data against the performance index (see build_perf_index()). Returns the same as munge()."""
+	def match(self, price_data, perf_index, match_table=None):
+		match_table = _check_match_table(match_table, self.RULES_VERSION)
+		price_data = sorted(price_data, key = lambda x: x['name'])
 		data = []
+		orphan_price_data = []
 
-		for price_data_row in reversed(orphan_price_data): # Reverse order because looping and deleting will skip items
-			product_parts = self._parse_pricespy_name(price_data_row['name'])
+		# Resolve in reverse order so the saved MatchTable is written in the same order as before
+		all_product_parts = match_table.resolve_all([row['name'] for row in reversed(price_data)], self.parse_pricespy_names)
+		all_product_parts.reverse()
+		for price_data_row, product_parts in zip(price_data, all_product_parts):
 			mfg_code = product_parts['mfg_code']
 			if mfg_code is not None and mfg_code.lower() in perf_index['mfg_codes']:
 				perf_item = perf_index['mfg_codes'][mfg_code.lower()]
 				product_parts['model'] = perf_item['model'] # Copy some attributes from the perf data
 				product_parts['avg'] = perf_item['avg']
 				product_parts['price'] = price_data_row['price']
-				orphan_price_data.remove(price_data_row)
-				data.insert(0, product_parts)
+				data.append(product_parts)
+			else:
+				orphan_price_data.append(dict(price_data_row))
 
+		data = self.enrich_price_performance(data)
 		return {
-			'data': self.enrich_price_performance(data),
+			'data': data,
 			'orphan_price_data': orphan_price_data,
-			'orphan_perf_data': []
+			'orphan_perf_data': [],
+			'ranks': rank_all(data, self.RANK_ATTRIBUTES),
+			'pareto': pareto_all(data, self.PARETO_ATTRIBUTES),
+			'match_table': match_table,
+			'stats': match_table.stats()
 		}
 
-	"""Builds a index of the performance data so it's can be searched quickly."""
-	def _build_perf_index(self, perf_data):
+	"""
+	Builds a index of the performance data so it's can be searched quickly. It's only read by match() so one index can be shared by the
+	munges of several markets at once.
+	"""
+	def build_perf_index(self, perf_data):
 		index = {'uniq_brands': [], 'mfg_codes':{}}
+		uniq_brands = set()
 		missing_mfg_code_data = []
 		for perf in perf_data:
 			brand = perf['brand']
-			if brand is not None and len(brand) != 0 and brand.lower() not in index['uniq_brands']:
+			if brand is not None and len(brand) != 0 and brand.lower() not in uniq_brands:
+				uniq_brands.add(brand.lower())
 				index['uniq_brands'].append(brand.lower())
 			mfg_code = perf['mfg_code']
 			if mfg_code is not None and len(mfg_code) != 0:
@@ -147,6 +276,8 @@ class HddMunger:
 	p_brand = re.compile('^([A-z0-9]+) ')
 	p_cache = re.compile(' ([1-9][0-9][0-9]?)MB ')
 	p_capacity = re.compile(' ([0-9.]+)TB$')
+	# Words we know aren't an mfg_code
+	MFG_CODE_BLACKLIST = frozenset(['Surveillance', 'Technology', 'VelociRaptor'])
 
 	"""
 	Attempts to parse the name into a dictionary of format: {name, brand, capacity, cache, mfg_code} where 'name' is the
@@ -178,15 +309,20 @@ class HddMunger:
 
 		return { 'name': name, 'brand': brand, 'cache': None if cache is None else int(cache), 'capacity': None if capacity is None else float(capacity), 'mfg_code': mfg_code }
 
+	"""Returns _parse_pricespy_name() for each name, in the same order. Repeated names are only parsed once and share the dictionary."""
+	def parse_pricespy_names(self, names):
+		parsed = {name: self._parse_pricespy_name(name) for name in dict.fromkeys(names)}
+		return [parsed[name] for name in names]
+
 	"""Returns the longest word from the model name (split by space). If not found, returns the empty string."""
 	def _get_longest_word_from_model(self, model):
-		mfg_code = ''
 		name_components = model.strip().split(' ')
-		for name_component in name_components:
-			if name_component in ['Surveillance', 'Technology', 'VelociRaptor']: # blacklist words we know aren't mfg_code
-				continue
-			if len(name_component) > len(mfg_code):
-				mfg_code = name_component
+		mfg_code = max(name_components, key=len) # The first of the longest
+		if mfg_code in self.MFG_CODE_BLACKLIST:
+			mfg_code = ''
+			for name_component in name_components:
+				if len(name_component) > len(mfg_code) and name_component not in self.MFG_CODE_BLACKLIST:
+					mfg_code = name_component
 		return mfg_code
 
 	"""
@@ -196,7 +332,7 @@ class HddMunger:
 		for row in data:
 			if 'price' not in row:
 				return
-			price = float(row['price'].replace('$', '').replace(',', ''))
+			price = _to_number(row['price'])
 			_calc_price_performance(row, 'avg', price)
 			_calc_price_performance(row, 'capacity', price)
 			_calc_price_performance(row, 'capacity', price, True)
@@ -207,17 +343,120 @@ class HddMunger:
 Formats the munged data for printing or logging
 """
 def format(data):
-	result = 'Combined Data:\n'
-	for row in data['data']:
-		result += ' {} ({}): avg={}\n'.format(row['name'], row['price'], row['avg'])
-	result += 'Orphan Price Data:\n'
-	for row in data['orphan_price_data']:
-		result += ' ' + row['name'] + '\n'
-	result += 'Orphan Performance Data:\n'
-	for row in data['orphan_perf_data']:
-		result += ' ' + row['name'] + '\n'
+	lines = ['Combined Data:']
+	lines.extend(' {} ({}): avg={}'.format(row['name'], row['price'], row['avg']) for row in data['data'])
+	lines.append('Orphan Price Data:')
+	lines.extend(' ' + row['name'] for row in data['orphan_price_data'])
+	lines.append('Orphan Performance Data:')
+	lines.extend(' ' + row['name'] for row in data['orphan_perf_data'])
+	lines.append('')
+	return '\n'.join(lines)
+
+"""Returns the given MatchTable if it was built with the rules version, otherwise an empty one"""
+def _check_match_table(match_table, version):
+	if match_table is None or match_table.version != version:
+		return MatchTable(version)
+	return match_table
+
+"""
+Returns the content of the published data file for the munged data, i.e. a dictionary of {'data': [ combined dictionary ],
+'ranks': {...}, 'pareto': {...}} which should be serialised as JSON. Orphans aren't published. If the scrape's coverage (see
+price.scraper.Scraper.coverage()) is given it's published as 'coverage' so the chart can flag partial data.
+"""
+def to_data_file(data, coverage=None):
+	result = {'data': data['data'], 'ranks': data['ranks'], 'pareto': data['pareto']}
+	if coverage is not None:
+		result['coverage'] = coverage
 	return result
 
+"""
+Returns the indexes of the rows in data ordered best first by the given attribute. Rows without a value for the attribute are
+placed last. Equal values keep their original order. Parameters:
+- data - list of munged dictionaries
+- attribute - name of the attribute to order by, e.g. 'avg/$'
+- ascending - default is False (higher is better). Use True for attributes where lower is better, e.g. 'price'
+"""
+def rank_indexes(data, attribute, ascending=False):
+	valued = []
+	missing = []
+	for i, row in enumerate(data):
+		value = _to_number(row.get(attribute))
+		if value is None:
+			missing.append(i)
+		else:
+			valued.append((value, i))
+	valued.sort(key = lambda x: x[0], reverse=not ascending) # Python's sort is stable even when reversed
+	return [i for value, i in valued] + missing
+
+"""Returns a dictionary of {attribute: rank_indexes(...)} for each attribute in the given {attribute: ascending} dictionary"""
+def rank_all(data, rank_attributes):
+	return {attribute: rank_indexes(data, attribute, ascending) for attribute, ascending in rank_attributes.items()}
+
+"""
+Returns the indexes of the rows in data which are on the price-performance frontier for the given attribute, ordered by ascending
+price. A row is on the frontier when no other row is both at least as cheap and at least as fast (and better in one of them), i.e. it's
+worth buying. Rows without a price or attribute value are never on the frontier.
+
+This sorts once by price then sweeps keeping the best value seen so far so is O(n log n) rather than comparing every pair of rows.
+"""
+def pareto_frontier(data, attribute):
+	points = []
+	for i, row in enumerate(data):
+		price = _to_number(row.get('price'))
+		value = _to_number(row.get(attribute))
+		if price is not None and value is not None:
+			points.append((price, -value, i))
+	points.sort() # Cheapest first and for the same price, fastest first
+	frontier = []
+	best_price = None
+	best_value = None
+	for price, negative_value, i in points:
+		value = -negative_value
+		if best_value is None or value > best_value:
+			frontier.append(i)
+			best_price = price
+			best_value = value
+		elif value == best_value and price == best_price:
+			frontier.append(i) # Identical to a frontier row so isn't dominated by it either
+	return frontier
+
+"""Returns a dictionary of {attribute: pareto_frontier(...)} for each attribute in the given list"""
+def pareto_all(data, pareto_attributes):
+	return {attribute: pareto_frontier(data, attribute) for attribute in pareto_attributes}
+
+_p_not_number = re.compile('[^0-9.,-]') # Currency symbols, spaces (including non-breaking ones separating thousands)
+
+"""
+Converts the value to a float. Prices like '$1,099.00', '£1,099.00', '1 999,00 kr' (a comma for the decimals, e.g. PriceSpy SE) or
+'1.299 €' (a dot separating thousands) are handled. Returns None if there is no value.
+"""
+def _to_number(value):
+	if value is None:
+		return None
+	if isinstance(value, str):
+		value = _p_not_number.sub('', value)
+		if value.find(',') >= 0 or value.find('.') >= 0:
+			if _decimal_separator(value) == ',':
+				value = value.replace('.', '').replace(',', '.')
+			else:
+				value = value.replace(',', '')
+		if len(value) == 0:
+			return None
+	return float(value)
+
+"""
+Returns the decimal separator, '.' or ',', of a number with separators. The last separator is the decimal one unless it occurs more than
+once (e.g. '1,099,000') or it's the only separator and followed by 3 digits (e.g. '1,099' or '1.099'), in which case it separates
+thousands as prices don't have 3 decimal places.
+"""
+def _decimal_separator(value):
+	last = max(value.rfind('.'), value.rfind(','))
+	separator = value[last]
+	other = ',' if separator == '.' else '.'
+	if value.count(separator) > 1 or (value.find(other) < 0 and len(value) - last - 1 == 3):
+		return other
+	return separator
+
 """
 Adds an attribute whose name is '<attribute>/$' and value is divided by the price. Parameters:
 - row - the dictionary to manipulate
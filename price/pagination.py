@@ -0,0 +1,145 @@
+import concurrent.futures
+import os
+import price.helper
+import time
+
+"""
+Adaptive pagination. Rather than downloading a fixed number of pages, sources keep fetching pages until a page adds no new products (the
+source has run out, e.g. an empty page or the last page repeated past the end) or is short of a full page (the last page), a target number
+of products is reached, the time budget
+runs out (see price.budget) or a maximum number of pages is hit. Pages which add no new products are discarded. Page 1 is always fetched and
+a failed page after it stops fetching rather than failing the source, so whatever was fetched can still be published.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+"""Tracks the distinct products seen across the pages of a source and when to stop fetching more"""
+class Coverage:
+
+	"""
+	Parameters:
+	- max_pages - stop after this many pages
+	- target_products - stop once this many distinct products have been seen. Defaults to None (no target)
+	- deadline - stop once time.monotonic() passes this, after the first page. Defaults to None (no deadline)
+	- page_size - products on a full page, a page with fewer is the last. Defaults to None (only stop when a page adds no new products)
+	"""
+	def __init__(self, max_pages, target_products=None, deadline=None, page_size=None):
+		self.max_pages = max_pages
+		self.target_products = target_products
+		self.deadline = deadline
+		self.page_size = page_size
+		self.products = set()
+		self.pages = 0 # Pages fetched, including discarded ones
+		self.kept_pages = 0
+		self.stopped = None # Why fetching stopped, see stop_reason()
+
+	"""
+	Records a fetched page's product keys (e.g. names). Returns True if it had new products so should be kept. A page short of page_size
+	products is kept but ends the source.
+	"""
+	def add_page(self, keys):
+		self.pages += 1
+		short = self.page_size is not None and len(keys) < self.page_size
+		keys = set(keys)
+		if len(keys - self.products) == 0:
+			self.stopped = 'exhausted'
+			return False
+		self.products.update(keys)
+		self.kept_pages += 1
+		if short:
+			self.end()
+		return True
+
+	"""Records that the source has no more pages"""
+	def end(self):
+		if self.stopped is None:
+			self.stopped = 'exhausted'
+
+	"""Records that fetching a page failed so the pages after it can't be fetched"""
+	def fail(self):
+		if self.stopped is None:
+			self.stopped = 'error'
+
+	"""
+	Returns why no more pages should be fetched ('exhausted', 'target', 'deadline', 'max_pages' or 'error') or None to keep going. Only
+	'deadline' and 'error' mean pages were missed, see complete().
+	"""
+	def stop_reason(self):
+		if self.stopped is None:
+			if self.target_products and len(self.products) >= self.target_products:
+				self.stopped = 'target'
+			elif self.deadline is not None and self.kept_pages > 0 and time.monotonic() >= self.deadline:
+				self.stopped = 'deadline'
+			elif self.kept_pages >= self.max_pages:
+				self.stopped = 'max_pages'
+		return self.stopped
+
+	"""Returns whether every page wanted was fetched, i.e. fetching didn't stop because of the deadline or an error"""
+	def complete(self):
+		return self.stop_reason() not in ['deadline', 'error']
+
+	"""Returns {'pages': <#fetched>, 'kept_pages', 'products': <#distinct>, 'stopped': <reason>, 'complete'}, see also report()"""
+	def stats(self):
+		return {'pages': self.pages, 'kept_pages': self.kept_pages, 'products': len(self.products), 'stopped': self.stop_reason(), 'complete': self.complete()}
+
+	"""Records the stats as trace counters of the current span and logs them"""
+	def report(self):
+		price.helper.count('products', len(self.products))
+		price.helper.count('discarded_pages', self.pages - self.kept_pages)
+		logger.info('Fetched {pages} pages, kept {kept_pages} with {products} products, stopped: {stopped}'.format(**self.stats()))
+
+"""
+Fetches pages 1, 2, ... in windows of 'window' pages at once until the coverage says to stop. Parameters:
+- fetch_page - function fetch_page(page, slot) downloading the 1-based page to a file and returning its path. 'slot' (0 to window - 1) is
+	unique among the pages being fetched at once, e.g. to give each its own browser
+- products_of - function products_of(path) returning the product keys on the page
+- coverage - Coverage
+- window - number of pages fetched at once. Defaults to 1
+Returns the paths of the pages kept in page order. Pages after the first page without new products (or short page) are discarded (and
+deleted) and their errors ignored, e.g. a page past the end which never shows any products. If a page fails the pages after it are
+discarded too, unless it's page 1 in which case the error is raised.
+"""
+def fetch_pages(fetch_page, products_of, coverage, window=1):
+	kept = []
+	page = 1
+	parent_path = price.helper.TRACER.current_path() # Spans are per thread so nest under the caller's explicitly
+	def fetch(page, slot):
+		with price.helper.span('page' if parent_path is None else parent_path + '/page'):
+			return fetch_page(page, slot)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=window) as executor:
+		while coverage.stop_reason() is None:
+			size = min(window, coverage.max_pages - coverage.kept_pages)
+			futures = [executor.submit(fetch, page + i, i) for i in range(size)]
+			results = []
+			for future in futures:
+				try:
+					results.append((future.result(), None))
+				except Exception as e:
+					results.append((None, e))
+			page += size
+			for path, error in results:
+				if error is not None:
+					if coverage.stop_reason() is not None:
+						continue # Past the end or an earlier failed page
+					if coverage.kept_pages == 0:
+						raise error # Nothing to publish
+					logger.warning('Fetching a page failed, keeping the {} pages before it: {}'.format(coverage.kept_pages, error))
+					coverage.fail()
+				elif coverage.stop_reason() is None and coverage.add_page(products_of(path)):
+					kept.append(path)
+				else:
+					os.remove(path)
+	coverage.report()
+	return kept
+
+"""Returns the paths without the pages which add no new products to the pages before them (e.g. the last page repeated past the end)"""
+def drop_duplicate_pages(paths, products_of):
+	seen = set()
+	kept = []
+	for path in paths:
+		keys = set(products_of(path))
+		if len(keys - seen) > 0:
+			seen.update(keys)
+			kept.append(path)
+	return kept
@@ -1,57 +1,79 @@
-import bs4
+import price.pagination
 import price.webdatasource
 import price.webdriver
-import requests
 
-"""PriceSpy's most popular CPUs with 2GHz+ and 4+ cores <= $1000"""
+"""A PriceSpy category page, e.g. the most popular CPUs with 2GHz+ and 4+ cores <= $1000. Categories are configured in price/categories.ini"""
 class PriceSpy(price.webdatasource.WebDataSource):
 
-	def download(self, output_file_name_prefix, num_pages=1):
-		self.files_downloaded = []
-		for i in range(num_pages):
-			url_offset = '' if i == 0 else '&offset=' + str(24 * i)
-			src = self._download('https://pricespy.co.nz/category.php?k=s334663499&catId=500' + url_offset, 'Find the best deals on CPUs - Compare prices on PriceSpy NZ', 'div[data-test="ProductCard"]', 'body')
-			file_name = output_file_name_prefix + '_' + str(i + 1) + '.htm'
-			with open(file_name, 'w', encoding='utf-8') as f:
-				f.write(src)
-			self.files_downloaded.append(file_name)
-		return self.files_downloaded
-		# page 2: https://pricespy.co.nz/category.php?k=s334663499&catId=500&offset=24
+	DEFAULT_CATEGORY = 'cpu' # Category in price/categories.ini whose page is scraped when no URL is given
 
 	"""
-	Parses PriceSpy data file(s) adding  dictionary objects {'name': <name>, 'price': <e.g. $1,000>'} to result list
+	Parameters:
+	- webdriver - a webdriver.WebDriver which abstracts away the Selenium web driver
+	- url - the category page URL without the offset parameter. Defaults to DEFAULT_CATEGORY's price_url
+	- page_title - expected page title. Defaults to DEFAULT_CATEGORY's price_title
+	- card_selector - CSS selector of a product card. Defaults to 'div[data-test="ProductCard"]'
+	- page_size - number of products per page. Defaults to 24
 	"""
-	def parse_soup(self, result, soup):
-		product_eles = soup.find_all('div', attrs={'data-test': 'ProductCard'}, limit=24)
-		for product_ele in product_eles:
-			result.append(self._parse(product_ele))
+	def __init__(self, webdriver, url=None, page_title=None, card_selector='div[data-test="ProductCard"]', page_size=24):
+		super().__init__(webdriver)
+		if url is None or page_title is None:
+			import price.categories # Imports this module so can't be imported at the top
+			category = price.categories.get(self.DEFAULT_CATEGORY)
+			url = category.price_url if url is None else url
+			page_title = category.price_title if page_title is None else page_title
+		self.url = url
+		self.page_title = page_title
+		self.card_selector = card_selector
+		self.page_size = page_size
 
-	def _parse(self, product_ele):
-		name_ele = product_ele.find('a', attrs={'aria-label':True})
-		name = name_ele['aria-label']
-		price_ele = product_ele.find('span', attrs={'data-test': 'PriceLabel'})
-		price = price_ele.string
-		return {'name': str(name), 'price': str(price)}
+	"""
+	Downloads pages until they stop adding new products (see price.pagination). Parameters:
+	- output_file_name_prefix - pages are saved to '<output_file_name_prefix>_<page>.htm'
+	- num_pages - maximum number of pages. Default is 1
+	- window - number of pages downloaded at once, each in its own browser. Default is 1
+	- target_products - stop once this many distinct products have been found. Defaults to None (no target)
+	- deadline - stop once time.monotonic() passes this. Defaults to None (no deadline)
+	Returns the list of files kept. The pagination stats are available from self.coverage.stats()
+	"""
+	def download(self, output_file_name_prefix, num_pages=1, window=1, target_products=None, deadline=None):
+		self.coverage = price.pagination.Coverage(num_pages, target_products, deadline, self.page_size)
+		fetch_page = lambda page, slot: self.download_page(output_file_name_prefix, page, self.webdriver.for_slot(slot))
+		self.files_downloaded = price.pagination.fetch_pages(fetch_page, self.product_names, self.coverage, window)
+		return self.files_downloaded
 
-"""PriceSpy's most popular internal HDD with 0.9 to 5 TB capacity, 7200/10000 rpm, and less than $500"""
-class PriceSpyHdd(price.webdatasource.WebDataSource):
+	"""
+	Downloads a single (1-based) page to '<output_file_name_prefix>_<page>.htm' with the given webdriver.WebDriver (defaults to this
+	source's). If there's a checkpoint the page is restored from it when a previous attempt downloaded it, and recorded in it otherwise.
+	Returns the file name.
+	"""
+	def download_page(self, output_file_name_prefix, page, webdriver=None):
+		url_offset = '' if page == 1 else '&offset=' + str(self.page_size * (page - 1)) # e.g. page 2 is &offset=24
+		url = self.url + url_offset
+		file_name = output_file_name_prefix + '_' + str(page) + '.htm'
+		if self.checkpoint is not None and self.checkpoint.restore(page, file_name):
+			return file_name
+		try:
+			src = self._download(url, self.page_title, self.card_selector, 'body', webdriver)
+		except Exception as e:
+			if self.checkpoint is not None:
+				self.checkpoint.failed(page, url, e)
+			raise
+		with open(file_name, 'w', encoding='utf-8') as f:
+			f.write(src)
+		if self.checkpoint is not None:
+			self.checkpoint.done(page, url, file_name)
+		return file_name
 
-	def download(self, output_file_name_prefix, num_pages=1):
-		self.files_downloaded = []
-		for i in range(num_pages):
-			url_offset = '' if i == 0 else '&offset=' + str(24 * i)
-			src = self._download('https://pricespy.co.nz/category.php?k=s332338236&catId=358' + url_offset, 'Find the best deals on Internal Hard Drives - Compare prices on PriceSpy NZ', 'div[data-test="ProductCard"]', 'body')
-			file_name = output_file_name_prefix + '_' + str(i + 1) + '.htm'
-			with open(file_name, 'w', encoding='utf-8') as f:
-				f.write(src)
-			self.files_downloaded.append(file_name)
-		return self.files_downloaded
+	"""Returns the names of the products in a downloaded page"""
+	def product_names(self, file_name):
+		return [product['name'] for product in self.parse_file(file_name)]
 
 	"""
 	Parses PriceSpy data file(s) adding  dictionary objects {'name': <name>, 'price': <e.g. $1,000>'} to result list
 	"""
 	def parse_soup(self, result, soup):
-		product_eles = soup.find_all('div', attrs={'data-test': 'ProductCard'}, limit=24)
+		product_eles = soup.select(self.card_selector, limit=self.page_size)
 		for product_ele in product_eles:
 			result.append(self._parse(product_ele))
 
@@ -62,9 +84,14 @@ class PriceSpyHdd(price.webdatasource.WebDataSource):
 		price = price_ele.string
 		return {'name': str(name), 'price': str(price)}
 
+"""PriceSpy's most popular internal HDDs, i.e. the 'hdd' category"""
+class PriceSpyHdd(PriceSpy):
+
+	DEFAULT_CATEGORY = 'hdd'
+
 if __name__ == '__main__':
-	#ps = PriceSpy(price.webdriver.FirefoxWebDriver('Selenium'))
-	ps = PriceSpyHdd(price.webdriver.FirefoxWebDriver('Selenium'))
+	import price.categories # Imports this module so can't be imported at the top
+	ps = price.categories.get('hdd').create_price_source(price.webdriver.FirefoxWebDriver('Selenium'))
 	ps.download('test/wip_pricespy', 3)
 	data = ps.parse_prefixes('test/wip_pricespy')
 	#data = ps.parse('test/pricespy_cpu_pop_4c4t2g_20200123.htm', 'test/pricespy_cpu_pop_4c4t2g_20200123_2.htm')
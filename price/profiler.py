@@ -0,0 +1,114 @@
+import cProfile
+import io
+import os
+import price.helper
+import pstats
+import threading
+import tracemalloc
+
+"""
+Profiling mode. Attaches to price.helper's tracing so each pipeline stage span (download, parse, munge, upload) is run under cProfile and
+tracemalloc. For each stage '<output_dir>/<stage path>.pstats' (load with pstats or snakeviz) and '<output_dir>/<stage path>.alloc.txt'
+(top allocations still alive at the end of the stage plus the peak) are written along with a short 'hotspots.txt' summary of all stages.
+
+Only the thread which started a stage is profiled by cProfile, tracemalloc sees every thread.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+STAGES = ['download', 'parse', 'munge', 'upload']
+
+class Profiler:
+
+	"""
+	Parameters:
+	- output_dir - directory to write reports to, created if it doesn't exist
+	- stages - span names (last part of the span path) to profile. Defaults to STAGES
+	- top - number of functions/allocations to show in reports. Defaults to 25
+	"""
+	def __init__(self, output_dir, stages=STAGES, top=25):
+		self.output_dir = output_dir
+		self.stages = stages
+		self.top = top
+		self.active = None # (path, cProfile.Profile, started tracemalloc) of the stage being profiled. Nested stages aren't profiled separately
+		self.lock = threading.Lock()
+		self.hotspots = [] # (stage path, report text)
+		self.files = [] # reports written
+		os.makedirs(output_dir, exist_ok=True)
+
+	"""Starts profiling stages: enables tracing and listens to it"""
+	def start(self):
+		if not price.helper.TRACER.enabled:
+			price.helper.enable_tracing()
+		price.helper.TRACER.add_listener(self)
+		return self
+
+	"""Stops listening and writes the hotspot summary. Returns the list of report files written."""
+	def stop(self):
+		price.helper.TRACER.remove_listener(self)
+		summary_file = os.path.join(self.output_dir, 'hotspots.txt')
+		with open(summary_file, 'w', encoding='utf-8') as f:
+			f.write(self.format_hotspots())
+		self.files.append(summary_file)
+		return self.files
+
+	def span_started(self, path):
+		if path.split('/')[-1] not in self.stages:
+			return
+		with self.lock:
+			if self.active is not None:
+				return
+			started_tracemalloc = not tracemalloc.is_tracing()
+			if started_tracemalloc:
+				tracemalloc.start()
+			tracemalloc.reset_peak()
+			profile = cProfile.Profile()
+			self.active = (path, profile, started_tracemalloc)
+		profile.enable()
+
+	def span_ended(self, path, duration_ms):
+		with self.lock:
+			if self.active is None or self.active[0] != path:
+				return
+			path, profile, started_tracemalloc = self.active
+			self.active = None
+		profile.disable()
+		snapshot = tracemalloc.take_snapshot()
+		current, peak = tracemalloc.get_traced_memory()
+		if started_tracemalloc:
+			tracemalloc.stop()
+
+		name = path.replace('/', '_')
+		pstats_file = os.path.join(self.output_dir, name + '.pstats')
+		profile.dump_stats(pstats_file)
+		alloc_file = os.path.join(self.output_dir, name + '.alloc.txt')
+		with open(alloc_file, 'w', encoding='utf-8') as f:
+			f.write('Stage {} took {:.0f} ms. Traced memory: current={:.1f} MiB, peak={:.1f} MiB\n'.format(path, duration_ms, current / 1048576, peak / 1048576))
+			f.write('Top {} allocations alive at the end of the stage:\n'.format(self.top))
+			for stat in snapshot.statistics('lineno')[:self.top]:
+				f.write(' {}\n'.format(stat))
+		self.files.extend([pstats_file, alloc_file])
+
+		text = io.StringIO()
+		stats = pstats.Stats(profile, stream=text)
+		stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(10)
+		self.hotspots.append((path, 'Stage {} took {:.0f} ms, peak traced memory {:.1f} MiB\n{}'.format(path, duration_ms, peak / 1048576, _trim_stats(text.getvalue()))))
+		logger.info('Profiled stage {} ({:.0f} ms) into {}'.format(path, duration_ms, pstats_file))
+
+	"""Returns the hotspot summary of all profiled stages"""
+	def format_hotspots(self):
+		return '\n'.join(report for path, report in self.hotspots)
+
+"""Removes the pstats preamble (file name, blank lines) leaving the call counts and table"""
+def _trim_stats(text):
+	lines = [line for line in text.splitlines() if line.strip() != '']
+	for i, line in enumerate(lines):
+		if 'function calls' in line:
+			return '\n'.join(lines[i:]) + '\n'
+	return '\n'.join(lines) + '\n'
+
+"""Uploads the report files to the price.storage storage under '<key_prefix>/<file name>'"""
+def upload_reports(storage, key_prefix, files):
+	for file in files:
+		with open(file, 'rb') as f:
+			storage.put(key_prefix + '/' + os.path.basename(file), f.read())
@@ -0,0 +1,251 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import price.delta
+import price.helper
+import price.storage
+
+"""
+Publishes data files for the chart. Data files are immutable and named by a hash of their content, e.g.
+'price_performance_cpu_20200314_1a2b3c4d5e6f.json', so they can be cached forever. A single small manifest ('manifest.json') then says which
+file is the latest for every category:
+
+	{"generation": 42, "published": "2020-03-14T02:00:00+00:00", "categories": {"cpu": {"file": ..., "date": "20200314", "sha256": ...,
+		"deltas": [{"file": ..., "base": <sha256>}, ...]}}}
+
+Readers (chart.htm, main.py) resolve the latest data with one lookup of the manifest. Publishing swaps the manifest with a conditional
+write on its ETag so categories published in parallel never overwrite each other's entries, and each generation is also kept as
+'manifests/<generation>.json' so the site can be rolled back to it. After each swap chart.htm is rebuilt as 'index.html' (gzipped) with
+the manifest and the initially shown category's data inlined, so the first table renders from a single request.
+
+Each publish also uploads a delta (see price.delta) from the category's previous data file, 'delta_<type>_<base hash>_<hash>.json'. The
+manifest entry lists the chain of the last MAX_DELTA_CHAIN deltas leading to the latest data so a returning visitor with any of their bases
+cached only downloads the deltas from there. Full data files are still published every time for new visitors. When a delta wouldn't be
+much smaller than the full file, the chain starts again from that full file. Run 'python -m price.publish --help' to show or roll back the manifest.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+HISTORY_PREFIX = 'manifests/'
+HASH_LENGTH = 12 # Hex digits of the SHA-256 in data file names
+MAX_ATTEMPTS = 5 # To swap the manifest when other publishes keep getting in first
+IMMUTABLE_CACHE_CONTROL = 'max-age=31536000, immutable'
+MANIFEST_CACHE_CONTROL = 'max-age=60' # How stale the latest data can be in browsers and CloudFront
+LEGACY_CACHE_CONTROL = 'max-age=3600'
+MAX_DELTA_CHAIN = 7 # Deltas listed in the manifest, i.e. visitors who came back within a week only download what changed
+MAX_DELTA_RATIO = 0.5 # Deltas bigger than this fraction of the full data file aren't worth it and restart the chain
+CHART_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web', 'chart.htm')
+CHART_NAME = 'index.html' # chart.htm with the manifest and INLINE_CATEGORY's data inlined
+INLINE_CATEGORY = 'cpu' # The chart's initially selected type
+BOOTSTRAP_PLACEHOLDER = 'var BOOTSTRAP = null;'
+
+"""Returns the key of the name under the prefix ('' for none)"""
+def _key(prefix, name):
+	return name if prefix == '' else prefix + '/' + name
+
+def _history_name(generation):
+	return HISTORY_PREFIX + '{:08d}.json'.format(generation)
+
+"""Returns the content-hashed file name of a category's data (bytes) for the date (yyyyMMdd)"""
+def data_file_name(type_value, date, data):
+	return 'price_performance_{}_{}_{}.json'.format(type_value, date, hashlib.sha256(data).hexdigest()[:HASH_LENGTH])
+
+"""Returns the current manifest and its ETag in the price.storage storage. An empty manifest (generation 0) and None if there isn't one."""
+def get_manifest(storage, prefix):
+	obj = storage.get(_key(prefix, MANIFEST_NAME))
+	if obj is None:
+		return {'generation': 0, 'categories': {}}, None
+	return json.loads(obj.data), obj.etag
+
+"""Returns the manifest of the given generation or None if it isn't kept"""
+def get_generation(storage, prefix, generation):
+	obj = storage.get(_key(prefix, _history_name(generation)))
+	return None if obj is None else json.loads(obj.data)
+
+"""
+Makes a new generation of the manifest and atomically swaps it in. Parameters:
+- storage, prefix - where the site is
+- change - function given the current manifest's categories (a copy) returning the new categories
+- extra - dictionary of extra fields for the new manifest, e.g. {'rollback_of': 41}
+- compress - whether to gzip the built chart page. Defaults to True
+- data - dictionary of {type: JSON text} of data files already in hand, saves downloading them again to build the chart page
+Returns the new manifest. Raises an Exception if the manifest kept changing underneath it.
+"""
+def update(storage, prefix, change, extra=None, compress=True, data=None):
+	for attempt in range(1, MAX_ATTEMPTS + 1):
+		current, etag = get_manifest(storage, prefix)
+		manifest = {'generation': current['generation'] + 1, 'published': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'), 'categories': change(dict(current['categories']))}
+		if extra is not None:
+			manifest.update(extra)
+		text = json.dumps(manifest, sort_keys=True)
+		try:
+			storage.put(_key(prefix, MANIFEST_NAME), text, content_type='application/json', cache_control=MANIFEST_CACHE_CONTROL, if_match=etag, if_none_match='*' if etag is None else None)
+		except price.storage.PreconditionFailed:
+			logger.debug('Manifest changed while publishing generation {} (attempt {}/{}), retrying'.format(manifest['generation'], attempt, MAX_ATTEMPTS))
+			continue
+		# Only the publish which swapped the manifest in writes its generation so history entries are never contended
+		storage.put(_key(prefix, _history_name(manifest['generation'])), text, content_type='application/json', cache_control=IMMUTABLE_CACHE_CONTROL)
+		_put_legacy_pointers(storage, prefix, current['categories'], manifest['categories'])
+		build_chart(storage, prefix, manifest, compress, data)
+		logger.debug('Published manifest generation {}: {}'.format(manifest['generation'], manifest['categories']))
+		return manifest
+	raise Exception('Could not publish the manifest after {} attempts, it kept changing'.format(MAX_ATTEMPTS))
+
+"""
+Writes 'latest_<type>.js' for categories whose data file changed. chart.htm is cached for 30 days (see build.xml) and pages cached from
+before the manifest still load these.
+"""
+def _put_legacy_pointers(storage, prefix, old_categories, new_categories):
+	for type_value, entry in new_categories.items():
+		if old_categories.get(type_value, {}).get('file') != entry['file']:
+			text = 'var LATEST_' + type_value.upper() + '_DATA_FILE="' + entry['file'] + '";'
+			storage.put(_key(prefix, 'latest_' + type_value + '.js'), text, content_type='application/javascript', cache_control=LEGACY_CACHE_CONTROL)
+
+"""
+Publishes a category's data: uploads the content-hashed data file (unless identical data is already there) then swaps in a new manifest
+pointing at it. Parameters:
+- storage, prefix - where the site is, e.g. price.storage.get_storage() and the S3_KEY_PREFIX
+- type_value - the category, e.g. 'cpu'
+- date - date of the data (yyyyMMdd)
+- json_data - the data file's JSON text
+- compress - whether to gzip the data file (with Content-Encoding so browsers decompress it). Use False for a local directory served as-is
+Returns the new manifest.
+"""
+def publish(storage, prefix, type_value, date, json_data, compress=True):
+	data = json_data.encode('utf-8')
+	file_name = data_file_name(type_value, date, data)
+	key = _key(prefix, file_name)
+	if storage.head(key) is None:
+		body = gzip.compress(data) if compress else data
+		price.helper.count('bytes', len(body))
+		storage.put(key, body, content_type='application/json', content_encoding='gzip' if compress else None, cache_control=IMMUTABLE_CACHE_CONTROL)
+		logger.debug('Uploaded data file ' + key)
+	entry = {'file': file_name, 'date': date, 'sha256': hashlib.sha256(data).hexdigest(), 'deltas': []}
+	base = get_manifest(storage, prefix)[0]['categories'].get(type_value)
+	if base is not None and base['sha256'] == entry['sha256']:
+		entry['deltas'] = base.get('deltas', [])
+	elif base is not None:
+		entry['deltas'] = _publish_delta(storage, prefix, type_value, base, entry, json_data, compress)
+
+	def change(categories):
+		if categories.get(type_value, {}).get('sha256') != (None if base is None else base['sha256']):
+			categories[type_value] = dict(entry, deltas=[]) # Published by someone else since the delta was made so the chain is broken
+		else:
+			categories[type_value] = entry
+		return categories
+	return update(storage, prefix, change, compress=compress, data={type_value: json_data})
+
+"""Uploads the delta from the base manifest entry's data to the new entry's data (JSON text). Returns the new entry's chain of deltas."""
+def _publish_delta(storage, prefix, type_value, base, entry, json_data, compress):
+	delta = price.delta.make(json.loads(_read_data(storage, prefix, base)), json.loads(json_data))
+	if delta is None:
+		return []
+	text = price.delta.to_json(delta)
+	if len(text) > len(json_data) * MAX_DELTA_RATIO:
+		logger.debug('Not publishing a {} delta, it is {} bytes of {} ({})'.format(type_value, len(text), len(json_data), delta['stats']))
+		return []
+	file_name = 'delta_{}_{}_{}.json'.format(type_value, base['sha256'][:HASH_LENGTH], entry['sha256'][:HASH_LENGTH])
+	key = _key(prefix, file_name)
+	if storage.head(key) is None:
+		body = gzip.compress(text.encode('utf-8')) if compress else text.encode('utf-8')
+		storage.put(key, body, content_type='application/json', content_encoding='gzip' if compress else None, cache_control=IMMUTABLE_CACHE_CONTROL)
+		logger.debug('Uploaded delta {} ({})'.format(key, delta['stats']))
+	return (base.get('deltas', []) + [{'file': file_name, 'base': base['sha256']}])[-MAX_DELTA_CHAIN:]
+
+"""
+Rolls the site back to the given generation (defaults to the one before the current), or just the given category of it. This publishes a
+new generation with the old entries so generations only ever increase and caches pick it up like any other publish. Returns the new
+manifest. Raises ValueError if the generation isn't kept.
+"""
+def rollback(storage, prefix, generation=None, type_value=None, compress=True):
+	if generation is None:
+		generation = get_manifest(storage, prefix)[0]['generation'] - 1
+	target = get_generation(storage, prefix, generation)
+	if target is None:
+		raise ValueError('Manifest generation {} does not exist'.format(generation))
+	def change(categories):
+		if type_value is None:
+			return target['categories']
+		if type_value in target['categories']:
+			categories[type_value] = target['categories'][type_value]
+		else:
+			categories.pop(type_value, None)
+		return categories
+	return update(storage, prefix, change, {'rollback_of': generation}, compress)
+
+"""Returns the manifest entry ({'file', 'date', 'sha256'}) and JSON text of the category's latest data or (None, None) if it hasn't been published"""
+def read_latest(storage, prefix, type_value):
+	entry = get_manifest(storage, prefix)[0]['categories'].get(type_value)
+	if entry is None:
+		return None, None
+	return entry, _read_data(storage, prefix, entry)
+
+def _read_data(storage, prefix, entry):
+	obj = storage.get(_key(prefix, entry['file']))
+	data = obj.data
+	if obj.content_encoding == 'gzip' or data[:2] == b'\x1f\x8b':
+		data = gzip.decompress(data)
+	return data.decode('utf-8')
+
+"""Returns the chart page (template text) with the manifest and data files (dictionary of {type: JSON text}) inlined"""
+def render_chart(template, manifest, data):
+	if BOOTSTRAP_PLACEHOLDER not in template:
+		raise ValueError('Chart template has no ' + BOOTSTRAP_PLACEHOLDER)
+	inlined = ', '.join(json.dumps(type_value) + ': ' + text for type_value, text in sorted(data.items()))
+	bootstrap = '{"manifest": ' + json.dumps(manifest, sort_keys=True) + ', "data": {' + inlined + '}}'
+	return template.replace(BOOTSTRAP_PLACEHOLDER, 'var BOOTSTRAP = ' + bootstrap.replace('</', '<\\/') + ';', 1)
+
+"""
+Builds the chart page (CHART_NAME) for the manifest from CHART_TEMPLATE. Publishes race to build it, so the page records the generation it
+was built from and an older generation never replaces a newer one. Returns True if the page was written. Parameters are as for update().
+"""
+def build_chart(storage, prefix, manifest, compress=True, data=None):
+	if not os.path.isfile(CHART_TEMPLATE):
+		logger.warning('Not building ' + CHART_NAME + ', ' + CHART_TEMPLATE + ' does not exist')
+		return False
+	with open(CHART_TEMPLATE, 'r', encoding='utf-8') as f:
+		template = f.read()
+	inline = {}
+	entry = manifest['categories'].get(INLINE_CATEGORY)
+	if entry is not None:
+		inline[INLINE_CATEGORY] = data[INLINE_CATEGORY] if data is not None and INLINE_CATEGORY in data else _read_data(storage, prefix, entry)
+	page = render_chart(template, manifest, inline).encode('utf-8')
+	body = gzip.compress(page) if compress else page
+
+	key = _key(prefix, CHART_NAME)
+	for attempt in range(1, MAX_ATTEMPTS + 1):
+		existing = storage.head(key)
+		if existing is not None and int(existing.metadata.get('generation', 0)) >= manifest['generation']:
+			return False
+		try:
+			storage.put(key, body, content_type='text/html; charset=utf-8', content_encoding='gzip' if compress else None, cache_control=MANIFEST_CACHE_CONTROL,
+				metadata={'generation': str(manifest['generation'])}, if_match=None if existing is None else existing.etag, if_none_match='*' if existing is None else None)
+			return True
+		except price.storage.PreconditionFailed:
+			continue
+	return False
+
+def main():
+	parser = argparse.ArgumentParser(description='Shows or rolls back the published manifest')
+	parser.add_argument('--local', help='directory of the site, e.g. web. Defaults to S3 (see priceperformancechart.ini)')
+	parser.add_argument('--rollback', nargs='?', const=-1, type=int, metavar='GENERATION', help='roll back to the generation, defaults to the previous one')
+	parser.add_argument('--type', help='only roll back this category, e.g. cpu')
+	args = parser.parse_args()
+
+	if args.local:
+		storage, prefix = price.storage.LocalStorage(args.local), ''
+	else:
+		price.helper.init_environ()
+		storage, prefix = price.storage.get_storage(), os.environ['S3_KEY_PREFIX']
+	if args.rollback is not None:
+		manifest = rollback(storage, prefix, None if args.rollback < 0 else args.rollback, args.type, compress=not args.local)
+	else:
+		manifest = get_manifest(storage, prefix)[0]
+	print(json.dumps(manifest, indent='\t', sort_keys=True))
+
+if __name__ == '__main__':
+	main()
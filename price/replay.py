@@ -0,0 +1,439 @@
+import argparse
+import bs4
+import copy
+import http.server
+import json
+import os
+import price.budget
+import price.categories
+import price.helper
+import price.memory
+import price.munger
+import price.scraper
+import price.storage
+import price.userbenchmark
+import price.webdriver
+import selenium.common.exceptions
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from selenium.webdriver.common.by import By
+
+"""
+Offline end-to-end replay benchmark. Serves recorded pages (e.g. 'test/pricespy_cpu_20200314_1.htm') from a local HTTP server and runs the
+real price.scraper.Scraper download -> parse -> munge -> serialise -> upload path against it, with S3 replaced by a price.storage.LocalStorage. Wall
+time, CPU time and memory are recorded per stage over repeated runs and compared against a stored baseline, so performance changes can be
+measured end to end without touching the live sites. Run with, e.g.:
+
+	python -m price.replay --runs 5 --save-baseline cpu   (then after a change)   python -m price.replay --runs 5 cpu
+
+Pages are fetched over HTTP by HttpWebDriver, a minimal stand-in for a Selenium browser which doesn't run JavaScript. Recorded pages are
+served as they were saved, i.e. UserBenchmark's table is already sorted with the extra column, so RecordedUserBenchmark skips the clicks.
+Fixtures are named like the downloaded files: '<source>_<type>_<yyyyMMdd>_<page>.htm' ('<source>_<type>_<yyyyMMdd>.csv' for CSVs).
+Pages past the last recorded one repeat it, like PriceSpy does.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+STAGES = ['download', 'parse', 'munge', 'serialise', 'upload']
+METRICS = ['wall_ms', 'cpu_ms', 'peak_rss_mb']
+KEY_PREFIX = 'data'
+T_CRITICAL = 2.0 # Welch's t above which a difference is treated as real, roughly 95% confidence for a handful of runs
+DEFAULT_THRESHOLD = 0.1 # Relative change of the median below which a difference is ignored
+
+"""Serves recorded pages of the categories in price/categories.ini from a local HTTP server, in a background thread"""
+class FixtureServer:
+
+	"""
+	Parameters:
+	- fixture_dir - directory of the recorded pages. Defaults to 'test'
+	- date - date (yyyyMMdd) of the recorded pages to serve. Defaults to '20200314'
+	"""
+	def __init__(self, fixture_dir='test', date='20200314'):
+		self.fixture_dir = fixture_dir
+		self.date = date
+		self.server = None
+		self.requests = 0
+
+	def start(self):
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+		self.server.fixtures = self
+		threading.Thread(target=self.server.serve_forever, name='FixtureServer', daemon=True).start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	"""Returns the server's base URL, e.g. 'http://127.0.0.1:12345'"""
+	def base_url(self):
+		return 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+	"""Returns a copy of the type's price.categories.Category with its source URLs pointing at this server"""
+	def category(self, type_value):
+		category = copy.copy(price.categories.get(type_value))
+		category.price_url = self.base_url() + '/pricespy/' + type_value + '?k=replay' # PriceSpy adds '&offset=<n>'
+		category.perf_url = self.base_url() + '/userbenchmark/' + type_value + category.perf_suffix()
+		return category
+
+	"""Returns (HTTP status, content type, body bytes) for the request path"""
+	def respond(self, path):
+		url = urllib.parse.urlsplit(path)
+		parts = url.path.strip('/').split('/')
+		if len(parts) != 2 or parts[0] not in ['pricespy', 'userbenchmark']:
+			return 404, 'text/plain', b'Not found'
+		source = parts[0]
+		type_value = parts[1][:-len('.csv')] if parts[1].endswith('.csv') else parts[1]
+		category = price.categories.load().get(type_value)
+		if category is None:
+			return 404, 'text/plain', b'Not found'
+
+		if source == 'userbenchmark' and category.perf_source == 'userbenchmark_csv':
+			file = self._csv_file(type_value)
+			if not os.path.isfile(file):
+				return 404, 'text/plain', b'Not found'
+			with open(file, 'rb') as f:
+				return 200, 'text/csv', f.read()
+
+		page = 1
+		if source == 'pricespy':
+			offset = int(urllib.parse.parse_qs(url.query).get('offset', ['0'])[0])
+			page = offset // category.price_page_size + 1
+		file = self._page_file(source, type_value, page)
+		if file is None:
+			return 404, 'text/plain', b'Not found'
+		title = category.price_title if source == 'pricespy' else category.perf_title
+		with open(file, 'r', encoding='utf-8') as f:
+			html = '<html><head><title>{}</title></head>{}</html>'.format(title, f.read()) # Saved pages are just the body
+		return 200, 'text/html; charset=utf-8', html.encode('utf-8')
+
+	"""Returns the names of the fixtures the type needs which aren't recorded (page 1 of each source or the CSV), empty if it can be replayed"""
+	def missing(self, type_value):
+		result = []
+		if self._page_file('pricespy', type_value, 1) is None:
+			result.append('pricespy_' + type_value + '_' + self.date + '_1.htm')
+		if price.categories.get(type_value).perf_source == 'userbenchmark_csv':
+			if not os.path.isfile(self._csv_file(type_value)):
+				result.append(os.path.basename(self._csv_file(type_value)))
+		elif self._page_file('userbenchmark', type_value, 1) is None:
+			result.append('userbenchmark_' + type_value + '_' + self.date + '_1.htm')
+		return result
+
+	def _csv_file(self, type_value):
+		return os.path.join(self.fixture_dir, 'userbenchmark_' + type_value + '_' + self.date + '.csv')
+
+	"""Returns the fixture of the page, the last recorded page if it's past the end, or None if there are none"""
+	def _page_file(self, source, type_value, page):
+		prefix = os.path.join(self.fixture_dir, source + '_' + type_value + '_' + self.date + '_')
+		while page > 0:
+			if os.path.isfile(prefix + str(page) + '.htm'):
+				return prefix + str(page) + '.htm'
+			page -= 1
+		return None
+
+class _FixtureHandler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		fixtures = self.server.fixtures
+		fixtures.requests += 1
+		status, content_type, body = fixtures.respond(self.path)
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		logger.debug('Fixture server: ' + format % args)
+
+"""A price.webdriver.WebDriver whose browsers are HttpBrowsers"""
+class HttpWebDriver(price.webdriver.WebDriver):
+
+	def getWebDriver(self):
+		return HttpBrowser()
+
+"""
+The subset of a Selenium WebDriver the sources use, fetching pages over HTTP and finding elements with Beautiful Soup. JavaScript isn't run,
+clicks do nothing and XPath lookups find nothing.
+"""
+class HttpBrowser:
+
+	def __init__(self):
+		self.page_load_timeout = price.budget.STEP_TIMEOUTS['navigate']
+		self.page = None
+		self.title = ''
+		self.capabilities = {'browserName': 'http', 'browserVersion': 'replay'}
+
+	def set_page_load_timeout(self, seconds):
+		self.page_load_timeout = seconds
+
+	def get(self, url):
+		try:
+			with urllib.request.urlopen(url, timeout=self.page_load_timeout) as response:
+				html = response.read().decode('utf-8')
+		except socket.timeout as e:
+			raise selenium.common.exceptions.TimeoutException('Timed out loading ' + url) from e
+		soup = bs4.BeautifulSoup(html, 'html.parser', multi_valued_attributes=None) # Keep class attributes as written, like a browser's DOM
+		self.page = HttpElement(soup)
+		self.title = soup.title.string if soup.title is not None and soup.title.string is not None else ''
+
+	def find_element(self, by, value):
+		return self.page.find_element(by, value)
+
+	def find_elements(self, by, value):
+		return self.page.find_elements(by, value)
+
+	def execute_script(self, script, *args):
+		return None
+
+	def close(self):
+		self.page = None
+
+	def quit(self):
+		self.page = None
+
+"""An element of an HttpBrowser's page"""
+class HttpElement:
+
+	def __init__(self, tag):
+		self.tag = tag
+
+	@property
+	def text(self):
+		return self.tag.get_text()
+
+	def find_element(self, by, value):
+		elements = self.find_elements(by, value)
+		if len(elements) == 0:
+			raise selenium.common.exceptions.NoSuchElementException('No element with {} "{}"'.format(by, value))
+		return elements[0]
+
+	def find_elements(self, by, value):
+		if by == By.TAG_NAME:
+			tags = self.tag.find_all(value)
+		elif by == By.CSS_SELECTOR:
+			tags = self.tag.select(value)
+		elif by == By.ID:
+			tags = self.tag.find_all(id=value)
+		else:
+			tags = [] # XPath isn't supported
+		return [HttpElement(tag) for tag in tags]
+
+	def get_attribute(self, name):
+		if name == 'outerHTML':
+			return str(self.tag)
+		if name == 'innerHTML':
+			return self.tag.decode_contents()
+		return self.tag.get(name)
+
+	def click(self):
+		pass
+
+	def is_displayed(self):
+		return True
+
+"""A UserBenchmark table replayed from a recorded page, which is already sorted and has the extra column, so nothing needs clicking"""
+class RecordedUserBenchmark(price.userbenchmark.UserBenchmark):
+
+	def _pre_wait_navigation(self, driver):
+		pass
+
+"""Records the wall and process CPU time of stage spans, listening to price.helper's tracing"""
+class StageClock:
+
+	def __init__(self, stages=STAGES):
+		self.stages = stages
+		self.started = {} # stage path -> (perf_counter, process_time)
+		self.times = {} # stage path -> {'wall_ms', 'cpu_ms'}
+
+	def start(self):
+		price.helper.TRACER.add_listener(self)
+		return self
+
+	def stop(self):
+		price.helper.TRACER.remove_listener(self)
+		return self.times
+
+	def span_started(self, path):
+		if path.split('/')[-1] in self.stages:
+			self.started[path] = (time.perf_counter(), time.process_time())
+
+	def span_ended(self, path, duration_ms):
+		if path in self.started:
+			wall_start, cpu_start = self.started.pop(path)
+			times = self.times.setdefault(path, {'wall_ms': 0, 'cpu_ms': 0})
+			times['wall_ms'] += (time.perf_counter() - wall_start) * 1000
+			times['cpu_ms'] += (time.process_time() - cpu_start) * 1000
+
+"""Returns a price.scraper.Scraper for the category (see FixtureServer.category()) saving its files under work_dir"""
+def create_scraper(category, webdriver, work_dir, date):
+	pricespy_prefix = os.path.join(work_dir, 'pricespy_' + category.value + '_' + date)
+	userbenchmark_prefix = os.path.join(work_dir, 'userbenchmark_' + category.value + '_' + date + category.perf_suffix())
+	scraper = price.scraper.Scraper(pricespy_prefix, userbenchmark_prefix, webdriver, price.scraper.Type(category.value))
+	scraper.category = category
+	scraper.ps = category.create_price_source(webdriver)
+	if category.perf_source == 'userbenchmark':
+		scraper.ub = RecordedUserBenchmark(webdriver, category.perf_url, category.perf_title, category.perf_sort_option, category.perf_extra_column)
+	else:
+		scraper.ub = category.create_perf_source(webdriver)
+	scraper.ps.budget = scraper.budget
+	scraper.ub.budget = scraper.budget
+	return scraper
+
+"""
+Runs the whole scrape of the type once against the fixture server in a fresh temp directory and local storage. Returns {'stages': {stage:
+{'wall_ms', 'cpu_ms', 'peak_rss_mb'}}, 'rows': <#combined rows>, 'coverage': <see price.scraper.Scraper.coverage()>}
+"""
+def run_once(server, type_value):
+	work_dir = tempfile.mkdtemp(prefix='replay_')
+	storage = price.storage.LocalStorage(os.path.join(work_dir, 's3'))
+	price.storage.set_storage(storage)
+	price.helper.enable_tracing()
+	memory_sampler = price.memory.MemorySampler(interval=0.05, tmp_dir=work_dir, stages=STAGES).start()
+	clock = StageClock().start()
+	try:
+		scraper = create_scraper(server.category(type_value), HttpWebDriver(), work_dir, server.date)
+		scraper.download()
+		scraper.quit_selenium()
+		data = scraper.parse()
+		match_table_key = 'tmp/match_table_' + type_value + '.json'
+		data = scraper.munge(data['pricespy_data'], data['userbenchmark_data'], scraper.load_match_table(None))
+		storage.put(match_table_key, data['match_table'].to_json(), content_type='application/json')
+		with price.helper.span('serialise'):
+			json_data = json.dumps(price.munger.to_data_file(data, scraper.coverage()))
+		scraper.upload_data(storage, KEY_PREFIX, json_data, server.date)
+	finally:
+		memory = memory_sampler.stop()
+		times = clock.stop()
+		price.helper.TRACER.enabled = False
+		price.storage.set_storage(None)
+		shutil.rmtree(work_dir, ignore_errors=True)
+	stages = {}
+	for stage in STAGES:
+		if stage in times:
+			stages[stage] = {'wall_ms': times[stage]['wall_ms'], 'cpu_ms': times[stage]['cpu_ms'], 'peak_rss_mb': memory.get(stage, {}).get('total_rss', 0)}
+	return {'stages': stages, 'rows': len(data['data']), 'coverage': scraper.coverage()}
+
+"""Runs the replay warmup + runs times, discarding the warmup runs. Returns the list of run_once() results."""
+def run(server, type_value, runs=5, warmup=1):
+	results = []
+	for i in range(warmup + runs):
+		result = run_once(server, type_value)
+		if i >= warmup:
+			results.append(result)
+		logger.info('Replay run {}/{}{}: {} rows, {}'.format(i + 1, warmup + runs, ' (warmup)' if i < warmup else '', result['rows'],
+			', '.join('{} {:.0f}ms'.format(stage, values['wall_ms']) for stage, values in result['stages'].items())))
+	return results
+
+"""Returns the statistics of the runs: {stage: {metric: {'n', 'mean', 'median', 'stdev', 'min', 'max'}}}"""
+def summarise(results):
+	summary = {}
+	for stage in STAGES:
+		for metric in METRICS:
+			samples = [result['stages'][stage][metric] for result in results if stage in result['stages']]
+			if len(samples) == 0:
+				continue
+			summary.setdefault(stage, {})[metric] = {
+				'n': len(samples),
+				'mean': statistics.mean(samples),
+				'median': statistics.median(samples),
+				'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+				'min': min(samples),
+				'max': max(samples)
+			}
+	return summary
+
+"""Returns Welch's t statistic of the difference between two summarised samples (positive if current is bigger)"""
+def welch_t(baseline, current):
+	difference = current['mean'] - baseline['mean']
+	error = (baseline['stdev'] ** 2 / baseline['n'] + current['stdev'] ** 2 / current['n']) ** 0.5
+	if error == 0:
+		return 0.0 if difference == 0 else float('inf') if difference > 0 else float('-inf')
+	return difference / error
+
+"""
+Compares the current summary against the baseline's. Returns a list of {'stage', 'metric', 'baseline', 'current' (medians), 'change'
+(relative), 't', 'verdict'} where verdict is 'regressed' or 'improved' if the medians differ by more than the threshold and Welch's t
+says the difference is real, otherwise 'same'.
+"""
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+	result = []
+	for stage, metrics in current.items():
+		for metric, stats in metrics.items():
+			if stage not in baseline or metric not in baseline[stage]:
+				continue
+			base = baseline[stage][metric]
+			change = (stats['median'] - base['median']) / base['median'] if base['median'] != 0 else 0.0
+			t = welch_t(base, stats)
+			verdict = 'same'
+			if change > threshold and t > T_CRITICAL:
+				verdict = 'regressed'
+			elif change < -threshold and t < -T_CRITICAL:
+				verdict = 'improved'
+			result.append({'stage': stage, 'metric': metric, 'baseline': base['median'], 'current': stats['median'], 'change': change, 't': t, 'verdict': verdict})
+	return result
+
+"""Formats the summary for printing"""
+def format(summary):
+	result = 'Replay per stage (median / stdev over {} runs):\n {:10} {:>20} {:>20} {:>20}\n'.format(
+		max([stats['n'] for metrics in summary.values() for stats in metrics.values()] + [0]), 'stage', 'wall ms', 'cpu ms', 'peak rss MiB')
+	for stage, metrics in summary.items():
+		result += ' {:10}'.format(stage) + ''.join(' {:>20}'.format('{:.1f} / {:.1f}'.format(metrics[metric]['median'], metrics[metric]['stdev'])) for metric in METRICS) + '\n'
+	return result
+
+"""Formats the comparison for printing"""
+def format_comparison(comparison):
+	result = 'Compared with baseline (median):\n {:10} {:12} {:>10} {:>10} {:>8} {:>8}  verdict\n'.format('stage', 'metric', 'baseline', 'current', 'change', 't')
+	for row in comparison:
+		result += ' {stage:10} {metric:12} {baseline:10.1f} {current:10.1f} {change:+8.1%} {t:8.1f}  {verdict}\n'.format(**row)
+	return result
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Replays recorded pages through the scraper to benchmark it offline')
+	parser.add_argument('type', choices=list(price.categories.load()), help='product type to replay, it needs recorded pages of both its sources')
+	parser.add_argument('--runs', type=int, default=5, help='number of measured runs, defaults to 5')
+	parser.add_argument('--warmup', type=int, default=1, help='number of unmeasured runs first, defaults to 1')
+	parser.add_argument('--fixtures', default='test', help="directory of the recorded pages, defaults to 'test'")
+	parser.add_argument('--date', default='20200314', help='date (yyyyMMdd) of the recorded pages, defaults to 20200314')
+	parser.add_argument('--baseline', help="baseline file, defaults to 'build/replay_baseline_<type>.json'")
+	parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline instead of comparing with it')
+	parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative change of the median to report, defaults to 0.1')
+	args = parser.parse_args(argv)
+	baseline_file = args.baseline if args.baseline else 'build/replay_baseline_' + args.type + '.json'
+
+	server = FixtureServer(args.fixtures, args.date)
+	missing = server.missing(args.type)
+	if len(missing) > 0:
+		print('Cannot replay {}, there are no recorded pages for {} in {}'.format(args.type, ', '.join(missing), args.fixtures))
+		return 2
+	server.start()
+	try:
+		results = run(server, args.type, args.runs, args.warmup)
+	finally:
+		server.stop()
+	summary = summarise(results)
+	print(format(summary))
+
+	if args.save_baseline:
+		os.makedirs(os.path.dirname(os.path.abspath(baseline_file)), exist_ok=True)
+		with open(baseline_file, 'w', encoding='utf-8') as f:
+			json.dump({'type': args.type, 'date': args.date, 'results': results, 'summary': summary}, f, indent='\t')
+		print('Baseline written to ' + baseline_file)
+		return 0
+	if not os.path.isfile(baseline_file):
+		print('No baseline at {}, run with --save-baseline to create one'.format(baseline_file))
+		return 0
+	with open(baseline_file, 'r', encoding='utf-8') as f:
+		baseline = json.load(f)
+	comparison = compare(baseline['summary'], summary, args.threshold)
+	print(format_comparison(comparison))
+	return 1 if any(row['verdict'] == 'regressed' for row in comparison) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,17 +1,20 @@
 import datetime
 import enum
-import gzip
+import price.budget
+import price.categories
 import price.helper
-import price.pricespy
-import price.userbenchmark
+import price.munger
+import price.publish
+import price.throttle
 import time
 
 logger = price.helper.get_logger(__name__)
 
-"""Type of scraper. Names are upper case (i.e. price.scraper.Type.HDD.name = 'HDD') and values are lower (i.e. price.scraper.Type.CPU.value = 'cpu')"""
-class Type(enum.Enum):
-	CPU = 'cpu'
-	HDD = 'hdd'
+"""
+Type of scraper, one per category in price/categories.ini. Names are upper case (i.e. price.scraper.Type.HDD.name = 'HDD') and values are
+lower (i.e. price.scraper.Type.CPU.value = 'cpu')
+"""
+Type = enum.Enum('Type', [(value.upper(), value) for value in price.categories.load()])
 
 """
 Scraper does all the downloading (i.e. scraping), parsing, and munging.
@@ -25,67 +28,179 @@ class Scraper:
 	- pricespy_prefix - prefix of the path to write PriceSpy HTML DOM to
 	- userbenchmark_prefix - prefix of the path to write UserBenchmark HTML DOM to
 	- webdriver - a webdriver.WebDriver which abstracts away the Selenium web driver
-	- type - the Type, i.e. whether this a CPU or HDD scraper, defaults to Type.CPU
+	- type - the Type, i.e. which category to scrape, defaults to Type.CPU. Its sources are created from its price.categories.Category
+	- budget - the price.budget.Budget of the run. Defaults to unlimited
+	- checkpoint - a price.checkpoint.Checkpoint of the run so a retry only downloads the pages which are missing or failed. Defaults to
+		None (download everything)
+
+	Prices are scraped from each of the category's markets (see price.categories.Market). The first market's PriceSpy source is 'ps' and
+	its pages use pricespy_prefix, the others' use '<pricespy_prefix>_<market>' (see price_prefix()). UserBenchmark is only scraped once.
 	"""
-	def __init__(self, pricespy_prefix, userbenchmark_prefix, webdriver, type=Type.CPU):
+	def __init__(self, pricespy_prefix, userbenchmark_prefix, webdriver, type=Type.CPU, budget=None, checkpoint=None):
 		self.pricespy_prefix = pricespy_prefix
 		self.userbenchmark_prefix = userbenchmark_prefix
 		self.type = type
-		if type == Type.CPU:
-			self.ps = price.pricespy.PriceSpy(webdriver)
-			self.ub = price.userbenchmark.UserBenchmark(webdriver)
-		else:
-			self.ps = price.pricespy.PriceSpyHdd(webdriver)
-			self.ub = price.userbenchmark.UserBenchmarkHdd()
-
-	"""Download PriceSpy and UserBenchmark HTML DOM and save it to '<pricespy/userbenchmark_prefox>_<page_num>.htm"""
+		self.budget = price.budget.Budget() if budget is None else budget
+		self.category = price.categories.get(type.value)
+		self.ps = self.category.create_price_source(webdriver)
+		self.ub = self.category.create_perf_source(webdriver)
+		self.market_sources = {market: self.category.create_price_source(webdriver, market) for market in self.category.markets[1:]}
+		self.ps.budget = self.budget
+		self.ub.budget = self.budget
+		for source in self.market_sources.values():
+			source.budget = self.budget
+		self.checkpoint = checkpoint
+		if checkpoint is not None:
+			self.ps.checkpoint = checkpoint.source('pricespy')
+			self.ub.checkpoint = checkpoint.source('userbenchmark')
+			for market, source in self.market_sources.items():
+				source.checkpoint = checkpoint.source('pricespy_' + market)
+
+	"""Returns the names of the markets scraped, the default market first"""
+	def markets(self):
+		return [self.category.markets[0]] + list(self.market_sources.keys())
+
+	"""Returns the PriceSpy source of the market (defaults to the first)"""
+	def price_source(self, market=None):
+		return self.market_sources[market] if market in self.market_sources else self.ps
+
+	"""Returns the prefix of the market's (defaults to the first) PriceSpy pages"""
+	def price_prefix(self, market=None):
+		return self.pricespy_prefix + '_' + market if market in self.market_sources else self.pricespy_prefix
+
+	"""
+	Download PriceSpy and UserBenchmark HTML DOM and save it to '<pricespy/userbenchmark_prefox>_<page_num>.htm. Pages are downloaded until
+	they stop adding new products (see price.pagination) up to the category's maximums or the budget's time for fetching runs out. Whether
+	everything was fetched is available from coverage().
+	"""
+	@price.helper.traced('download')
 	def download(self):
 		self.all_files_downloaded = []
+		deadline = self.budget.fetch_deadline()
 		time_start = time.time()
-		self.all_files_downloaded.extend(self.ps.download(self.pricespy_prefix, 3))
-		logger.info('PriceSpy data downloaded in {:1.0f} seconds'.format(time.time() - time_start))
+		with price.helper.span('pricespy'):
+			self.all_files_downloaded.extend(self.ps.download(self.pricespy_prefix, self.category.price_max_pages, self.category.price_window, self.category.price_target_products or None, deadline))
+		logger.info('PriceSpy data downloaded in {:1.0f} seconds ({})'.format(time.time() - time_start, self.budget))
+
+		for market, source in self.market_sources.items():
+			time_start = time.time()
+			with price.helper.span('pricespy_' + market):
+				self.all_files_downloaded.extend(source.download(self.price_prefix(market), self.category.price_max_pages, self.category.price_window, self.category.price_target_products or None, deadline))
+			logger.info('PriceSpy {} data downloaded in {:1.0f} seconds ({})'.format(market, time.time() - time_start, self.budget))
 
 		time_start = time.time()
-		self.all_files_downloaded.extend(self.ub.download(self.userbenchmark_prefix, 2))
-		logger.info('UserBenchmark data downloaded in {:1.0f} seconds'.format(time.time() - time_start))
+		with price.helper.span('userbenchmark'):
+			self.all_files_downloaded.extend(self.ub.download(self.userbenchmark_prefix, self.category.perf_max_pages, deadline=deadline))
+		logger.info('UserBenchmark data downloaded in {:1.0f} seconds ({})'.format(time.time() - time_start, self.budget))
+		price.throttle.report()
+
+	"""
+	Returns how much of the sources download() fetched for the market (defaults to the first): {'complete': <whether every page wanted was
+	fetched>, 'pricespy': <stats>, 'userbenchmark': <stats>} where stats are price.pagination.Coverage.stats() (None for sources without
+	pages, e.g. CSVs). Returns None if nothing was downloaded.
+	"""
+	def coverage(self, market=None):
+		if not hasattr(self, 'all_files_downloaded'):
+			return None
+		result = {'complete': True}
+		for name, source in [('pricespy', self.price_source(market)), ('userbenchmark', self.ub)]:
+			coverage = getattr(source, 'coverage', None)
+			result[name] = None if coverage is None else coverage.stats()
+			if coverage is not None and not coverage.complete():
+				result['complete'] = False
+		return result
 
 	"""Frees up some processes/resources by telling Selenium to quit"""
 	def quit_selenium(self):
 		self.ps.quit_selenium()
 		self.ub.quit_selenium()
+		for source in self.market_sources.values():
+			source.quit_selenium()
 
-	"""Parses PriceSpy and UserBenchmark HTML DOM and returns a dictionary {'pricespy_data': ps_data, 'userbenchmark_data': ub_data}"""
+	"""
+	Parses PriceSpy and UserBenchmark HTML DOM and returns a dictionary {'pricespy_data': ps_data, 'userbenchmark_data': ub_data,
+	'market_data': {market: ps_data of the market}} where ps_data is the first market's
+	"""
+	@price.helper.traced('parse')
 	def parse(self):
-		ps_data = self.ps.parse_prefixes(self.pricespy_prefix)
+		with price.helper.span('pricespy'):
+			ps_data = self.ps.parse_prefixes(self.pricespy_prefix)
+			price.helper.count('rows', len(ps_data))
 		logger.info('Number of PriceSpy data rows: {}'.format(len(ps_data)))
+		market_data = {self.markets()[0]: ps_data}
+		for market, source in self.market_sources.items():
+			with price.helper.span('pricespy_' + market):
+				market_data[market] = source.parse_prefixes(self.price_prefix(market))
+				price.helper.count('rows', len(market_data[market]))
+			logger.info('Number of PriceSpy {} data rows: {}'.format(market, len(market_data[market])))
 
-		ub_data = self.ub.parse_prefixes(self.userbenchmark_prefix)
+		with price.helper.span('userbenchmark'):
+			ub_data = self.ub.parse_prefixes(self.userbenchmark_prefix)
+			price.helper.count('rows', len(ub_data))
 		logger.info('Number of UserBenchmark data rows: {}'.format(len(ub_data)))
 
-		return {'pricespy_data': ps_data, 'userbenchmark_data': ub_data}
+		return {'pricespy_data': ps_data, 'userbenchmark_data': ub_data, 'market_data': market_data}
 
-	"""Munge the data together writing output to 'web/price_performance_<yyyyMMdd>.json'"""
-	def munge(self, ps_data, ub_data):
-		m = price.munger.CpuMunger() if self.type == Type.CPU else price.munger.HddMunger()
-		data = m.munge(ps_data, ub_data)
+	"""
+	Munge the data together writing output to 'web/price_performance_<yyyyMMdd>.json'. If a match_table (see load_match_table()) is
+	given, PriceSpy names already seen in the previous run aren't canonicalised again.
+	"""
+	@price.helper.traced('munge')
+	def munge(self, ps_data, ub_data, match_table=None):
+		data = self._get_munger().munge(ps_data, ub_data, match_table)
+		price.helper.count('rows', len(data['data']))
+		price.helper.count('reused', data['stats']['reused'])
+		price.helper.count('recomputed', data['stats']['recomputed'])
+		logger.info('Munge reused {reused} and recomputed {recomputed} PriceSpy name matches'.format(**data['stats']))
 		return data
 
 	"""
-	Uploads the JSON data to S3 (will gzip too) as "<prefix>/price_performance_<data_date>.json" and also updates the latest.js file.
+	Munges each market's price data (see parse()) against the UserBenchmark data. The performance index is only built once and shared by
+	the markets' munges, which run one after another as matching is CPU bound. Parameters:
+	- market_data - {market: ps_data}
+	- ub_data - the UserBenchmark data
+	- match_tables - {market: MatchTable} (see load_match_table()). Defaults to None (every row is recomputed)
+	Returns {market: munged data} in the same order
+	"""
+	@price.helper.traced('munge')
+	def munge_markets(self, market_data, ub_data, match_tables=None):
+		munger = self._get_munger()
+		with price.helper.span('perf_index'):
+			perf_index = munger.build_perf_index(ub_data)
+		result = {}
+		for market in market_data:
+			with price.helper.span(market):
+				data = munger.match(market_data[market], perf_index, None if match_tables is None else match_tables.get(market))
+				price.helper.count('rows', len(data['data']))
+				price.helper.count('reused', data['stats']['reused'])
+				price.helper.count('recomputed', data['stats']['recomputed'])
+			logger.info('Munge of {} reused {reused} and recomputed {recomputed} PriceSpy name matches'.format(market, **data['stats']))
+			result[market] = data
+		return result
+
+	"""
+	Returns the price.munger.MatchTable saved by the previous run as JSON text (i.e. data['match_table'].to_json()). If the text is None,
+	full_rebuild is True, or the table was saved by different munging rules, an empty table is returned so every row is recomputed.
+	"""
+	def load_match_table(self, text, full_rebuild=False):
+		return price.munger.MatchTable.from_json(None if full_rebuild else text, self._get_munger().RULES_VERSION)
+
+	def _get_munger(self):
+		return self.category.create_munger()
+
+	"""
+	Publishes the JSON data as an immutable content-hashed data file and swaps in a new manifest pointing at it (see price.publish).
 	Parameters:
-	- s3_client - the Boto3 S3 client to use
-	- bucket - name of the bucket to upload to
-	- prefix - key prefix to upload the file as. Note the base file name of <data_file_path> will be used
+	- storage - the price.storage storage to upload to, e.g. the S3 bucket
+	- prefix - key prefix of the site
 	- json_data - the JSON data to upload
 	- data_date - the date of the data. If None will use today's date
+	- compress - whether to gzip the data file. Defaults to True
+	- market - the market of the data, which is published under the category's price.categories.Category.data_key() for it. Defaults to
+		None (the first market, published under the type)
+	Returns the new manifest
 	"""
-	def upload_data_to_s3(self, s3_client, bucket, prefix, json_data, data_date=None):
-		compressed_data = gzip.compress(json_data.encode('utf-8'))
-		file_name = 'price_performance_' + self.type.value + '_' + (data_date if data_date else datetime.date.today().strftime("%Y%m%d")) + '.json'
-		key = prefix + '/' + file_name
-		logger.debug('Uploading data file to S3 as ' + key)
-		s3_client.put_object(Body=compressed_data, Bucket=bucket, CacheControl='max-age=31536000', ContentEncoding='gzip', ContentType='application/javascript', Key=key)
-
-		key = prefix + '/latest_' + self.type.value + '.js'
-		s3_client.put_object(Body='var LATEST_' + self.type.name + '_DATA_FILE="' + file_name + '";', Bucket=bucket, CacheControl='max-age=3600', ContentType='application/javascript', Key=key)
-		logger.debug('Updated S3 index file ' + key)
\ No newline at end of file
+	@price.helper.traced('upload')
+	def upload_data(self, storage, prefix, json_data, data_date=None, compress=True, market=None):
+		date = data_date if data_date else datetime.date.today().strftime("%Y%m%d")
+		return price.publish.publish(storage, prefix, self.category.data_key(market), date, json_data, compress)
\ No newline at end of file
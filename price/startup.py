@@ -0,0 +1,52 @@
+import argparse
+import re
+import subprocess
+import sys
+
+"""
+Startup (cold start) import profiler. Runs a fresh interpreter with '-X importtime' importing the given modules and summarises where the
+time goes, e.g.
+
+	$ py -m price.startup lambda
+	$ py -m price.startup price.scraper --top 30
+"""
+
+IMPORT_TIME_PATTERN = re.compile('^import time:\\s+([0-9]+) \\|\\s+([0-9]+) \\| (\\s*)(\\S+)$')
+
+"""
+Returns a list of dictionaries {'module', 'self_us', 'cumulative_us', 'depth'} for every module imported (in import order) by a new
+interpreter importing the given module names.
+"""
+def profile_imports(modules, python=sys.executable):
+	statement = 'import importlib; ' + '; '.join('importlib.import_module({!r})'.format(module) for module in modules) # 'lambda' is a keyword
+	result = subprocess.run([python, '-X', 'importtime', '-c', statement], capture_output=True, text=True)
+	if result.returncode != 0:
+		raise Exception('Importing {} failed: {}'.format(modules, result.stderr[-2000:]))
+	rows = []
+	for line in result.stderr.splitlines():
+		match = IMPORT_TIME_PATTERN.match(line)
+		if match is not None:
+			rows.append({'module': match.group(4), 'self_us': int(match.group(1)), 'cumulative_us': int(match.group(2)), 'depth': len(match.group(3)) // 2})
+	return rows
+
+"""Returns a report of the slowest modules by cumulative time and the total self time per top-level package"""
+def format(rows, top=20):
+	result = 'Total import time: {:.0f} ms\n'.format(sum(row['self_us'] for row in rows) / 1000)
+	result += 'Slowest imports (cumulative ms, self ms):\n'
+	for row in sorted(rows, key = lambda x: x['cumulative_us'], reverse=True)[:top]:
+		result += ' {:8.1f} {:8.1f}  {}\n'.format(row['cumulative_us'] / 1000, row['self_us'] / 1000, row['module'])
+	packages = {}
+	for row in rows:
+		package = row['module'].split('.')[0]
+		packages[package] = packages.get(package, 0) + row['self_us']
+	result += 'By top-level package (ms):\n'
+	for package, self_us in sorted(packages.items(), key = lambda x: x[1], reverse=True)[:top]:
+		result += ' {:8.1f}  {}\n'.format(self_us / 1000, package)
+	return result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Profile module import times')
+	parser.add_argument('modules', nargs='*', default=['lambda'], help="modules to import, defaults to the Lambda entry point 'lambda'")
+	parser.add_argument('--top', type=int, default=20, help='number of rows to show')
+	args = parser.parse_args()
+	print(format(profile_imports(args.modules), args.top))
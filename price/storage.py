@@ -0,0 +1,297 @@
+import datetime
+import hashlib
+import json
+import os
+import price.helper
+import tempfile
+import threading
+
+"""
+Storage backends. Everything kept between runs (data files, caches, match tables, archives, tasks, profiling reports) is read and written
+through a Storage so the same code runs against S3 in the Lambda and against a local directory offline (tests, replays, main.py). Keys are
+'/' separated, e.g. 'tmp/match_table_cpu.json'. Both backends support:
+- conditional reads (if_none_match=<ETag>, raising NotModified) so a cached copy can be revalidated without downloading it again
+- conditional writes (if_match=<ETag> to replace only the version that was read, if_none_match='*' to only create), raising
+	PreconditionFailed
+- ranged reads (byte_range=(first, last), inclusive like HTTP) and streaming reads in chunks
+Use get_storage() for the storage configured by the environment variables rather than creating one directly.
+"""
+
+logger = price.helper.get_logger(__name__)
+
+MAX_POOL_CONNECTIONS = 16 # Categories are scraped in parallel and each fetches a window of pages, so keep enough connections to reuse
+MAX_ATTEMPTS = 2 # Attempts (including the first) botocore makes for each S3 request. Uploads happen in the budget's reserve so keep it low.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+"""The key doesn't exist"""
+class NotFound(Exception):
+	pass
+
+"""A conditional read's ETag matched, i.e. the caller's copy is current"""
+class NotModified(Exception):
+	pass
+
+"""A conditional write's ETag didn't match, i.e. the object was changed (or created) by someone else"""
+class PreconditionFailed(Exception):
+	pass
+
+"""An object's details and (for get()) content"""
+class StoredObject:
+
+	def __init__(self, key, etag, size, last_modified, content_type=None, content_encoding=None, metadata=None, data=None):
+		self.key = key
+		self.etag = etag # Quoted, like S3, e.g. '"5d41402abc4b2a76b9719d911017c592"'
+		self.size = size # Of the whole object, even for a ranged read
+		self.last_modified = last_modified # Timezone aware datetime
+		self.content_type = content_type
+		self.content_encoding = content_encoding
+		self.metadata = {} if metadata is None else metadata # User metadata, {name: value} strings
+		self.data = data # bytes, None for head() and list()
+
+	"""Returns the data decoded as UTF-8"""
+	def text(self):
+		return self.data.decode('utf-8')
+
+"""Storage in an S3 bucket. Requests go through one pooled, retrying Boto3 client which is safe to share between threads."""
+class S3Storage:
+
+	"""
+	Parameters:
+	- bucket - name of the bucket
+	- region - AWS region of the bucket. Defaults to the default region
+	- client - Boto3 S3 client to use. Defaults to a new one with connection pooling, retries and timeouts for the budget's 'upload' step
+	"""
+	def __init__(self, bucket, region=None, client=None):
+		if client is None:
+			boto3 = price.helper.timed_import('boto3')
+			botocore_config = price.helper.timed_import('botocore.config')
+			timeout = price.helper.timed_import('price.budget').STEP_TIMEOUTS['upload']
+			config = botocore_config.Config(max_pool_connections=MAX_POOL_CONNECTIONS, connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'standard'})
+			client = boto3.client('s3', region_name=region, config=config)
+		self.client = client
+		self.bucket = bucket
+
+	"""Returns the StoredObject (without data) of the key or None if it doesn't exist"""
+	def head(self, key):
+		try:
+			response = self.client.head_object(Bucket=self.bucket, Key=key)
+		except self._client_error() as e:
+			if _error_code(e) in ['404', 'NoSuchKey', 'NotFound']:
+				return None
+			raise
+		return self._to_object(key, response)
+
+	"""
+	Returns the StoredObject of the key including its data or None if it doesn't exist. Parameters:
+	- if_none_match - an ETag. If the object still has it, NotModified is raised rather than downloading it again
+	- byte_range - (first, last) byte offsets (inclusive) to only read part of the object. last can be None for the rest of it
+	"""
+	def get(self, key, if_none_match=None, byte_range=None):
+		response = self._get_object(key, if_none_match, byte_range)
+		if response is None:
+			return None
+		obj = self._to_object(key, response)
+		obj.data = response['Body'].read()
+		return obj
+
+	"""Yields the object's content in chunks without holding it all in memory. Raises NotFound if it doesn't exist."""
+	def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+		response = self._get_object(key)
+		if response is None:
+			raise NotFound(key)
+		for chunk in response['Body'].iter_chunks(chunk_size):
+			yield chunk
+
+	"""
+	Writes the data (bytes or str) to the key. Returns the new ETag. Parameters:
+	- content_type, content_encoding, cache_control - HTTP headers served with the object
+	- metadata - dictionary of user metadata {name: value}
+	- if_match - only replace the object if it still has this ETag
+	- if_none_match - '*' to only create the object if it doesn't exist
+	"""
+	def put(self, key, data, content_type=None, content_encoding=None, cache_control=None, metadata=None, if_match=None, if_none_match=None):
+		args = {'Body': data, 'Bucket': self.bucket, 'Key': key}
+		for name, value in [('ContentType', content_type), ('ContentEncoding', content_encoding), ('CacheControl', cache_control), ('Metadata', metadata), ('IfMatch', if_match), ('IfNoneMatch', if_none_match)]:
+			if value is not None:
+				args[name] = value
+		try:
+			return self.client.put_object(**args).get('ETag')
+		except self._client_error() as e:
+			if _error_code(e) in ['412', 'PreconditionFailed', '409', 'ConditionalRequestConflict']:
+				raise PreconditionFailed(key)
+			raise
+
+	"""Returns the StoredObjects (without data) with keys starting with the prefix, sorted by key"""
+	def list(self, prefix=''):
+		objects = []
+		for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+			for content in page.get('Contents', []):
+				objects.append(StoredObject(content['Key'], content.get('ETag'), content['Size'], content['LastModified']))
+		return sorted(objects, key = lambda x: x.key)
+
+	def delete(self, key):
+		self.client.delete_object(Bucket=self.bucket, Key=key)
+
+	def _get_object(self, key, if_none_match=None, byte_range=None):
+		args = {'Bucket': self.bucket, 'Key': key}
+		if if_none_match is not None:
+			args['IfNoneMatch'] = if_none_match
+		if byte_range is not None:
+			args['Range'] = 'bytes={}-{}'.format(byte_range[0], '' if byte_range[1] is None else byte_range[1])
+		try:
+			return self.client.get_object(**args)
+		except self._client_error() as e:
+			code = _error_code(e)
+			if code in ['404', 'NoSuchKey', 'NotFound']:
+				return None
+			if code in ['304', 'NotModified']:
+				raise NotModified(key)
+			raise
+
+	def _to_object(self, key, response):
+		size = response.get('ContentLength')
+		if 'ContentRange' in response: # 'bytes 0-9/1234'
+			size = int(response['ContentRange'].split('/')[-1])
+		return StoredObject(key, response.get('ETag'), size, response.get('LastModified'), response.get('ContentType'), response.get('ContentEncoding'), response.get('Metadata', {}))
+
+	def _client_error(self):
+		return price.helper.timed_import('botocore.exceptions').ClientError
+
+def _error_code(e):
+	return e.response['Error']['Code']
+
+"""
+Storage in a local directory, a stand-in for S3 when working offline. Objects are files under the directory at their key. ETags are MD5s of
+the content like S3's (for single part uploads). Headers and metadata are kept in a JSON sidecar under '<directory>/.meta/'. Writes are
+atomic (written to a temporary file then renamed) and conditional writes are atomic between threads, not processes.
+"""
+class LocalStorage:
+
+	META_DIR = '.meta'
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.lock = threading.Lock()
+
+	def head(self, key):
+		path = self._path(key)
+		if not os.path.isfile(path):
+			return None
+		with open(path, 'rb') as f:
+			etag = _etag(f.read())
+		return self._to_object(key, path, etag)
+
+	def get(self, key, if_none_match=None, byte_range=None):
+		path = self._path(key)
+		if not os.path.isfile(path):
+			return None
+		with open(path, 'rb') as f:
+			data = f.read()
+		etag = _etag(data)
+		if if_none_match is not None and if_none_match == etag:
+			raise NotModified(key)
+		obj = self._to_object(key, path, etag)
+		obj.data = data if byte_range is None else data[byte_range[0]:None if byte_range[1] is None else byte_range[1] + 1]
+		return obj
+
+	def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+		path = self._path(key)
+		if not os.path.isfile(path):
+			raise NotFound(key)
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(chunk_size), b''):
+				yield chunk
+
+	def put(self, key, data, content_type=None, content_encoding=None, cache_control=None, metadata=None, if_match=None, if_none_match=None):
+		if isinstance(data, str):
+			data = data.encode('utf-8')
+		path = self._path(key)
+		with self.lock:
+			if if_match is not None or if_none_match is not None:
+				current = self.head(key)
+				if (if_none_match == '*' and current is not None) or (if_match is not None and (current is None or current.etag != if_match)):
+					raise PreconditionFailed(key)
+			self._write(path, data)
+			meta = {'content_type': content_type, 'content_encoding': content_encoding, 'cache_control': cache_control, 'metadata': metadata or {}}
+			self._write(self._meta_path(key), json.dumps(meta).encode('utf-8'))
+		return _etag(data)
+
+	def list(self, prefix=''):
+		objects = []
+		for dir_path, dir_names, file_names in os.walk(self.directory):
+			if dir_path == self.directory and LocalStorage.META_DIR in dir_names:
+				dir_names.remove(LocalStorage.META_DIR)
+			for file_name in file_names:
+				path = os.path.join(dir_path, file_name)
+				key = os.path.relpath(path, self.directory).replace(os.sep, '/')
+				if key.startswith(prefix) and not file_name.startswith('.tmp'):
+					objects.append(StoredObject(key, None, os.path.getsize(path), _last_modified(path)))
+		return sorted(objects, key = lambda x: x.key)
+
+	def delete(self, key):
+		for path in [self._path(key), self._meta_path(key)]:
+			if os.path.isfile(path):
+				os.remove(path)
+
+	"""The lock isn't kept when pickling so this can be passed to other processes"""
+	def __getstate__(self):
+		return {'directory': self.directory}
+
+	def __setstate__(self, state):
+		self.__init__(state['directory'])
+
+	def _to_object(self, key, path, etag):
+		meta = {}
+		if os.path.isfile(self._meta_path(key)):
+			with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+				meta = json.load(f)
+		return StoredObject(key, etag, os.path.getsize(path), _last_modified(path), meta.get('content_type'), meta.get('content_encoding'), meta.get('metadata'))
+
+	def _write(self, path, data):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(path))
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+		os.chmod(tmp_path, 0o644) # mkstemp() makes it private but the directory may be served, e.g. 'web'
+		os.replace(tmp_path, path)
+
+	def _path(self, key):
+		return os.path.join(self.directory, *key.split('/'))
+
+	def _meta_path(self, key):
+		return os.path.join(self.directory, LocalStorage.META_DIR, *key.split('/')) + '.json'
+
+def _etag(data):
+	return '"' + hashlib.md5(data).hexdigest() + '"'
+
+def _last_modified(path):
+	return datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc)
+
+"""Writes the storage object's content to the local path, streaming it in chunks. Raises NotFound if it doesn't exist."""
+def download(storage, key, path):
+	with open(path, 'wb') as f:
+		for chunk in storage.stream(key):
+			f.write(chunk)
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+"""
+Lazily creates the storage from the environment variables: a LocalStorage of the STORAGE_DIR directory if it's set, otherwise an S3Storage of
+the S3_BUCKET bucket in S3_REGION
+"""
+def get_storage():
+	global _STORAGE
+	with _STORAGE_LOCK:
+		if _STORAGE is None:
+			if os.environ.get('STORAGE_DIR'):
+				_STORAGE = LocalStorage(os.environ['STORAGE_DIR'])
+			else:
+				_STORAGE = S3Storage(os.environ['S3_BUCKET'], os.environ['S3_REGION'])
+		return _STORAGE
+
+"""Makes get_storage() return the given storage (e.g. a LocalStorage for a replay). Pass None to go back to the environment variables."""
+def set_storage(storage):
+	global _STORAGE
+	with _STORAGE_LOCK:
+		_STORAGE = storage
@@ -0,0 +1,224 @@
+import argparse
+import os
+import price.helper
+import price.pricespy
+import price.userbenchmark
+import price.webdatasource
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+"""
+Synthetic pages for parser throughput testing. The recorded fixtures are single pages of 24 PriceSpy cards or 50 UserBenchmark rows, these
+generators write any number of rows over any number of pages with the same structure the parsers rely on (PriceSpy 'ProductCard' divs,
+UserBenchmark 'hovertarget' table rows including the arrow, plain and percentile cell variants UserBenchmark._parse() handles) surrounded
+by non-product markup similar in size to the real pages. Generation is seeded so pages are repeatable, and the generators return the rows
+the parsers should produce. Run the throughput benchmark of each installed parser backend (see price.webdatasource.PARSERS) with, e.g.:
+
+	python -m price.synthetic --rows 2400 --repeat 3
+"""
+
+logger = price.helper.get_logger(__name__)
+
+PRICESPY_PAGE_SIZE = 24
+USERBENCHMARK_PAGE_SIZE = 50 # UserBenchmark.parse_soup() reads at most 50 rows a page, like the site
+PRICESPY_CHROME_BYTES = 130000 # Roughly the non-product markup of a recorded PriceSpy page
+USERBENCHMARK_CHROME_BYTES = 120000
+# UserBenchmark columns after the rank and name columns: (data-mhth, title, parsed key or None)
+USERBENCHMARK_COLUMNS = [
+	('MC_POPULARITY', 'User rating %', 'user-rating'),
+	('MC_VALUE', 'Value %', None),
+	('MC_BENCH', 'Avg. bench %', 'avg'),
+	('MCCPU_1CA', '1-Core Pts', '1-core'),
+	('MCCPU_2CA', '2-Core Pts', '2-core'),
+	('MCCPU_8CA', '8-Core Pts', '8-core'),
+	('MC_MKTSHARE', 'Mkt. share %', None),
+	('MC_PRICE', 'Price', None)
+]
+CELL_VARIANTS = ['arrows', 'plain', 'percentile']
+
+"""Returns non-product markup (navigation menus, scripts) of about the given size"""
+def _chrome(size, rand):
+	parts = []
+	length = 0
+	i = 0
+	while length < size:
+		if i % 4 == 3:
+			part = '<script>window.__state_{0} = {{"id": {1}, "items": [{2}]}};</script>\n'.format(i, rand.randint(1, 99999), ','.join(str(rand.randint(1, 999)) for x in range(20)))
+		else:
+			part = '<div class="Menu-sc-{0} nav"><ul>{1}</ul></div>\n'.format(i, ''.join('<li class="item"><a href="/c/{0}" title="Category {0}"><span>Category {0}</span></a></li>'.format(rand.randint(1, 9999)) for x in range(8)))
+		parts.append(part)
+		length += len(part)
+		i += 1
+	return ''.join(parts)
+
+def _price(rand):
+	return '${:,.2f}'.format(rand.randint(5000, 250000) / 100)
+
+def _pricespy_card(name, price, product_id):
+	return ('<li class="pj-ui-product-listing--item pj-ui-product-listing--item-grid"><div class="Card-sc-882dpj-0 bjcTTV" data-test="ProductCard">'
+		'<a aria-label="{0}" class="ProductLink-sc-882dpj-1 gdBkio" href="/product.php?p={2}"><div class="ProductImage-sc-882dpj-3 hPoFSl">'
+		'<img alt="{0}" class="pj-ui-product-image" src="https://cdn.pricespy.co.nz/product/standard/280/{2}.jpg"/></div>'
+		'<div class="ProductDetails-sc-882dpj-5 chpiOw"><div class="ProductName-sc-882dpj-7 iqvApd" data-test="ProductName">{0}</div>'
+		'<div aria-label="4.5 of 5 stars" class="Rating-sc-11mts1f-1 dIiViY" data-test="Rating"><div class="StarsWrapper-sc-11mts1f-2 WlYbR">'
+		'<div class="StarIcons-sc-11mts1f-3 cugtHw" style="width:65px;line-height:0">{3}</div></div>'
+		'<span class="Counter-sc-11mts1f-0 eAVAnR"><span>(12)</span></span></div></div><div class="PriceInfo-sc-882dpj-15 ebvgVN"><div>'
+		'<span class="PriceLabel-sc-1uc1vg9-0 kjZhxy" data-test="PriceLabel">{1}</span></div></div></a></div></li>\n').format(
+		name, price, product_id, '<img alt="" src="https://pricespy-75b8.kxcdn.com/g/rfe/icons/stars/primary-full.svg" style="width:12px;margin-right:1px"/>' * 5)
+
+"""
+Writes PriceSpy category pages '<prefix>_<page>.htm' with 'rows' product cards, 'page_size' a page. Parameters:
+- prefix - file name prefix, pages are numbered from 1
+- rows - total number of products
+- page_size - products per page. Defaults to PRICESPY_PAGE_SIZE, parse with a PriceSpy of the same page size
+- chrome_bytes - approximate size of the non-product markup of each page. Defaults to PRICESPY_CHROME_BYTES
+- seed - random seed. Defaults to 0
+Returns (list of files, list of the {'name', 'price'} rows PriceSpy.parse() should return)
+"""
+def generate_pricespy(prefix, rows, page_size=PRICESPY_PAGE_SIZE, chrome_bytes=PRICESPY_CHROME_BYTES, seed=0):
+	rand = random.Random(seed)
+	files = []
+	expected = []
+	page = 1
+	for start in range(0, rows, page_size):
+		cards = []
+		for i in range(start, min(start + page_size, rows)):
+			brand = rand.choice(['AMD Ryzen {0} {1}600 3.{2}GHz Socket AM4 Box', 'Intel Core i{0}-{1}700K 3.{2}GHz Socket 1151-2 Box'])
+			row = {'name': brand.format(rand.choice([3, 5, 7, 9]), rand.randint(1, 9), rand.randint(0, 9)) + ' #' + str(i), 'price': _price(rand)}
+			cards.append(_pricespy_card(row['name'], row['price'], 5000000 + i))
+			expected.append(row)
+		chrome = _chrome(chrome_bytes, rand)
+		html = ('<body> <div id="root"><header data-test="Header">{0}</header><main><ul class="pj-ui-product-listing">\n{1}</ul></main>'
+			'<footer>{2}</footer></div></body>').format(chrome[:len(chrome) // 2], ''.join(cards), chrome[len(chrome) // 2:])
+		files.append(_write(prefix, page, html))
+		page += 1
+	return files, expected
+
+def _userbenchmark_cell(value, variant):
+	if variant == 'arrows':
+		div = '<div class="mh-tc pgbg spgbr"><div class="mh-tc-rat" style="margin-bottom:0">▲</div>{0}<div class="mh-tc-rat" style="margin-top:0">▼</div></div>'
+	elif variant == 'percentile':
+		div = '<div class="mh-tc pgbg spgbr"><div style="margin-top:-7px;margin-bottom:-5px">{0}<div class="mh-tc-cap" title="Range (5th-95h percentile)">1 - 2</div></div></div>'
+	else:
+		div = '<div class="mh-tc pgbg spgbr">{0}</div>'
+	return '<td>' + div.format(value) + '<div class="mh-tc-u mh-tc-muted" title="Percentile.">50<sup>th</sup></div>\n</td>\n'
+
+def _userbenchmark_row(rank, brand, model, values, product_id, variant_offset):
+	cells = ''.join(_userbenchmark_cell(value, CELL_VARIANTS[(variant_offset + i) % len(CELL_VARIANTS)]) for i, value in enumerate(values))
+	return ('<tr class="hovertarget" data-id="{4}">\n<td style="padding:0;">\n<i class="mh-td-star mh-tc-muted fa fa-thumb-tack fa-rotate-45"></i>\n'
+		'<div>{0}</div>\n</td>\n<td>\n<div style="text-align:left;">\n<div style="float:left;width:30%;margin-top:-13px"><a class="nodec" '
+		'href="https://cpu.userbenchmark.com/SpeedTest/{4}/" style="height:55px;display:block;"><img class="center-block" '
+		'src="https://www.userbenchmark.com/resources/img/generic/cpu/i9.jpg"/></a></div>\n<div class="smallp" style="float:left;width:70%;">\n'
+		'<span class="semi-strongs lighterblacktexts">\n<i class="mh-td-comp fa fa-square-o" data-id="{4}" title="Compare details">\n'
+		'<span class="fancyfont mh-tc-muted">Compare</span>\n</i>\n\t\t\t\t\t\t\t\t\t\t\t{1} <a class="nodec" '
+		'href="https://cpu.userbenchmark.com/SpeedTest/{4}/">{2}</a>\n</span>\n<div class="mh-tc-muted">Samples 3.5k</div>\n</div>\n</div>\n'
+		'</td>\n{3}</tr>\n').format(rank, brand, model, cells, product_id)
+
+"""
+Writes UserBenchmark table pages '<prefix>_<page>.htm' with 'rows' rows, 'page_size' a page. Cells cycle through the arrow, plain and
+percentile variants. Parameters:
+- prefix - file name prefix, pages are numbered from 1
+- rows - total number of rows
+- page_size - rows per page. Defaults to USERBENCHMARK_PAGE_SIZE which is the most UserBenchmark.parse() reads a page
+- chrome_bytes - approximate size of the non-table markup of each page. Defaults to USERBENCHMARK_CHROME_BYTES
+- seed - random seed. Defaults to 0
+Returns (list of files, list of the rows UserBenchmark.parse() should return)
+"""
+def generate_userbenchmark(prefix, rows, page_size=USERBENCHMARK_PAGE_SIZE, chrome_bytes=USERBENCHMARK_CHROME_BYTES, seed=0):
+	rand = random.Random(seed)
+	header = ('<tr>\n<th class="strong mh-td-th-arrow"></th>\n<th style="padding:0;width:30%;min-width:150px;position:relative"></th>\n' +
+		''.join('<th class="mh-td-col" data-mhth="{0}">\n<span>{1}</span>\n<i class="fa mh-td-btn-sort fa-caret-down" title="Sort"></i>\n</th>\n'.format(concept, title) for concept, title, key in USERBENCHMARK_COLUMNS) +
+		'</tr>\n')
+	files = []
+	expected = []
+	page = 1
+	for start in range(0, rows, page_size):
+		table_rows = []
+		for i in range(start, min(start + page_size, rows)):
+			brand = rand.choice(['AMD', 'Intel'])
+			model = ('Ryzen {0} {1}600X' if brand == 'AMD' else 'Core i{0}-{1}700K').format(rand.choice([3, 5, 7, 9]), rand.randint(1, 9)) + ' #' + str(i)
+			values = []
+			row = {'name': brand + ' ' + model, '1-core': None, '2-core': None, '8-core': None, 'avg': None, 'user-rating': None}
+			for concept, title, key in USERBENCHMARK_COLUMNS:
+				value = _price(rand) if concept == 'MC_PRICE' else str(rand.randint(1, 2000))
+				values.append(value)
+				if key is not None:
+					row[key] = value
+			table_rows.append(_userbenchmark_row(i + 1, brand, model, values, 900000 + i, i))
+			expected.append(row)
+		chrome = _chrome(chrome_bytes, rand)
+		html = ('<body><div id="pagetophash" class="anchorable"></div>\n{0}<table class="table mh-td table-v-center table-h-center">\n<thead>\n{1}'
+			'</thead>\n<tbody>\n{2}</tbody>\n</table>\n<ul class="pagination pagination-lg"><li></li><li><a href="#">Next</a></li></ul>\n{3}</body>').format(
+			chrome[:len(chrome) // 2], header, ''.join(table_rows), chrome[len(chrome) // 2:])
+		files.append(_write(prefix, page, html))
+		page += 1
+	return files, expected
+
+def _write(prefix, page, html):
+	file_name = prefix + '_' + str(page) + '.htm'
+	with open(file_name, 'w', encoding='utf-8') as f:
+		f.write(html)
+	return file_name
+
+"""
+Measures how fast each parser backend parses the files with sources made by create_source(parser). Each backend parses every file
+'repeat' times with a fresh source (so nothing is cached) and the fastest repeat is kept. Returns a list of {'parser', 'rows', 'bytes',
+'seconds', 'rows_per_second', 'mb_per_second'}.
+"""
+def benchmark(files, create_source, parsers=None, repeat=3):
+	parsers = price.webdatasource.available_parsers() if parsers is None else parsers
+	size = sum(os.path.getsize(file) for file in files)
+	result = []
+	for parser in parsers:
+		best = None
+		for i in range(repeat):
+			source = create_source(parser)
+			start = time.perf_counter()
+			rows = len(source.parse(*files))
+			seconds = time.perf_counter() - start
+			best = seconds if best is None else min(best, seconds)
+		result.append({'parser': parser, 'rows': rows, 'bytes': size, 'seconds': best, 'rows_per_second': rows / best, 'mb_per_second': size / 1048576 / best})
+	return result
+
+"""Formats benchmark() results for printing"""
+def format(name, results):
+	result = '{} parser throughput:\n {:12} {:>8} {:>10} {:>10} {:>12} {:>8}\n'.format(name, 'parser', 'rows', 'MB', 'seconds', 'rows/s', 'MB/s')
+	for row in results:
+		result += ' {parser:12} {rows:8d} {0:10.2f} {seconds:10.3f} {rows_per_second:12.0f} {mb_per_second:8.2f}\n'.format(row['bytes'] / 1048576, **row)
+	return result
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Generates synthetic PriceSpy and UserBenchmark pages and benchmarks the parser backends on them')
+	parser.add_argument('--rows', type=int, default=2400, help='rows to generate for each source, defaults to 2400')
+	parser.add_argument('--pricespy-page-size', type=int, default=PRICESPY_PAGE_SIZE, help='PriceSpy cards a page, defaults to 24')
+	parser.add_argument('--repeat', type=int, default=3, help='times each backend parses the pages (fastest is kept), defaults to 3')
+	parser.add_argument('--parser', action='append', help='parser backend to benchmark (repeatable), defaults to every installed one')
+	parser.add_argument('--output', help='directory to write the pages to and keep, defaults to a temporary directory')
+	args = parser.parse_args(argv)
+	output_dir = args.output if args.output else tempfile.mkdtemp(prefix='synthetic_')
+	os.makedirs(output_dir, exist_ok=True)
+	print('Benchmarking parsers: ' + ', '.join(args.parser if args.parser else price.webdatasource.available_parsers()))
+
+	files, expected = generate_pricespy(os.path.join(output_dir, 'pricespy'), args.rows, args.pricespy_page_size)
+	def create_pricespy(parser):
+		source = price.pricespy.PriceSpy(None, page_size=args.pricespy_page_size)
+		source.parser = parser
+		return source
+	print(format('PriceSpy ({} pages)'.format(len(files)), benchmark(files, create_pricespy, args.parser, args.repeat)))
+
+	files, expected = generate_userbenchmark(os.path.join(output_dir, 'userbenchmark'), args.rows)
+	def create_userbenchmark(parser):
+		source = price.userbenchmark.UserBenchmark(None)
+		source.parser = parser
+		return source
+	print(format('UserBenchmark ({} pages)'.format(len(files)), benchmark(files, create_userbenchmark, args.parser, args.repeat)))
+	if args.output:
+		print('Pages written to ' + output_dir)
+	else:
+		shutil.rmtree(output_dir, ignore_errors=True)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,245 @@
+import concurrent.futures
+import json
+import price.helper
+import price.storage
+import time
+
+"""
+Splits a scrape run into independent tasks, e.g. 'cpu/pricespy/2' (fetch PriceSpy CPU page 2), 'cpu/pricespy_uk/2' (the same in the 'uk'
+market, see price.categories.Market), 'cpu/userbenchmark' (fetch the UserBenchmark CPU pages) and 'cpu/munge' (parse, munge and upload CPU,
+after all CPU fetches). Tasks are run by a handler function handler(task, store)
+which saves its output to the run's store and returns a JSON serialisable result (e.g. the names of the files it saved).
+
+Tasks are idempotent: when a task succeeds a 'done/<task id>' marker with its result is saved to the store and tasks with a marker are
+skipped, so tasks can be retried or delivered more than once. Optional tasks (e.g. PriceSpy pages after the first) which fail for the last
+time get a marker with their error instead, so the tasks waiting on them still run with what was fetched. Two executors run the tasks:
+- LocalExecutor - in this process with threads (or processes), e.g. for tests and local runs
+- SqsQueue - fans out across Lambda invocations. Each task is an SQS message, finishing a task sends the messages for the tasks which were
+	waiting on it. Delivery is at least once (SQS retries failed tasks, see the queue's redrive policy in template.yaml)
+"""
+
+logger = price.helper.get_logger(__name__)
+
+DONE_PREFIX = 'done/' # Store name prefix of the markers of finished tasks
+PLAN_NAME = 'plan.json' # Store name of the run's tasks, for SqsQueue
+MAX_RECEIVES = 3 # Deliveries of a message before SQS moves it to the dead-letter queue, see maxReceiveCount in template.yaml
+END_PREFIX = 'end/' # Store name prefix of markers holding the last page number of a category's price source in a market, see plan()
+
+"""A unit of work in a run"""
+class Task:
+
+	"""
+	Parameters:
+	- id - unique id in the run, e.g. 'cpu/pricespy/2'
+	- kind - what to do: 'fetch_price', 'fetch_perf' or 'munge'
+	- type_value - the category, e.g. 'cpu'
+	- page - 1-based page number for 'fetch_price' tasks. Defaults to None
+	- deps - ids of tasks which must finish first. Defaults to none
+	- optional - whether the tasks waiting on this one still run if it fails, see run_task(). Defaults to False
+	- market - name of the market for 'fetch_price' tasks, e.g. 'nz'. Defaults to None
+	"""
+	def __init__(self, id, kind, type_value, page=None, deps=None, optional=False, market=None):
+		self.id = id
+		self.kind = kind
+		self.type_value = type_value
+		self.page = page
+		self.deps = [] if deps is None else deps
+		self.optional = optional
+		self.market = market
+
+	def to_dict(self):
+		return {'id': self.id, 'kind': self.kind, 'type': self.type_value, 'page': self.page, 'deps': self.deps, 'optional': self.optional,
+			'market': self.market}
+
+	@staticmethod
+	def from_dict(d):
+		return Task(d['id'], d['kind'], d['type'], d['page'], d['deps'], d.get('optional', False), d.get('market'))
+
+"""
+Returns the tasks to scrape the given price.categories.Category objects: one per PriceSpy page of each market (up to the maximum, fetch
+tasks past the last page are expected to skip themselves, see END_PREFIX), one for UserBenchmark and a munge depending on them in that order.
+PriceSpy pages after the first, and every page of the markets after the first, are optional so the munge publishes what was fetched if one
+fails.
+"""
+def plan(categories):
+	tasks = []
+	for category in categories:
+		fetches = []
+		for market in category.markets:
+			source = 'pricespy' if market == category.markets[0] else 'pricespy_' + market
+			fetches.extend(Task(category.value + '/' + source + '/' + str(page), 'fetch_price', category.value, page,
+				optional=page > 1 or market != category.markets[0], market=market) for page in range(1, category.price_max_pages + 1))
+		fetches.append(Task(category.value + '/userbenchmark', 'fetch_perf', category.value))
+		tasks.extend(fetches)
+		tasks.append(Task(category.value + '/munge', 'munge', category.value, deps=[fetch.id for fetch in fetches]))
+	return tasks
+
+"""A run's files in a price.storage storage under '<key_prefix>/'"""
+class StorageStore:
+
+	def __init__(self, storage, key_prefix):
+		self.storage = storage
+		self.key_prefix = key_prefix
+
+	def put(self, name, data):
+		self.storage.put(self._key(name), data)
+
+	"""Returns the content (bytes) of the named file or None if it doesn't exist"""
+	def get(self, name):
+		obj = self.storage.get(self._key(name))
+		return None if obj is None else obj.data
+
+	"""Streams the named file to the local path"""
+	def fetch(self, name, path):
+		price.storage.download(self.storage, self._key(name), path)
+
+	def exists(self, name):
+		return self.storage.head(self._key(name)) is not None
+
+	def _key(self, name):
+		return name if self.key_prefix == '' else self.key_prefix + '/' + name
+
+"""A run's files in a local directory"""
+class LocalStore(StorageStore):
+
+	def __init__(self, directory):
+		super().__init__(price.storage.LocalStorage(directory), '')
+
+"""Returns the run's tasks saved by SqsQueue.submit() as a dictionary {task id: Task}"""
+def load_plan(store):
+	return {task['id']: Task.from_dict(task) for task in json.loads(store.get(PLAN_NAME))}
+
+"""Returns the result the handler returned for the finished task, or None if it hasn't finished (or it's an optional task which failed)"""
+def get_result(store, task_id):
+	marker = store.get(DONE_PREFIX + task_id)
+	return None if marker is None else json.loads(marker)['result']
+
+"""Returns the error message of the optional task if it failed (see run_task()), otherwise None"""
+def get_error(store, task_id):
+	marker = store.get(DONE_PREFIX + task_id)
+	return None if marker is None else json.loads(marker).get('error')
+
+"""
+Runs the task with the handler unless it has already finished (i.e. has a done marker in the store). Failures are retried up to
+max_attempts times in total with exponential backoff starting at retry_delay seconds. If the last attempt fails the error is raised, unless
+the task is optional and this is its last chance (i.e. 'final', SqsQueue passes False while SQS will deliver the message again) in which
+case the failure is saved as its marker (see get_error()) so the tasks waiting on it can run. Returns True if the task ran, False if it was
+skipped.
+"""
+def run_task(task, store, handler, max_attempts=3, retry_delay=1.0, final=True):
+	if store.exists(DONE_PREFIX + task.id):
+		logger.info('Task {} has already finished, skipping'.format(task.id))
+		return False
+	for attempt in range(1, max_attempts + 1):
+		try:
+			with price.helper.span(task.kind):
+				result = handler(task, store)
+			break
+		except Exception as e:
+			if attempt == max_attempts:
+				if not (task.optional and final):
+					raise
+				logger.warning('Optional task {} failed, carrying on without it: {}'.format(task.id, e))
+				price.helper.count('failed_tasks')
+				store.put(DONE_PREFIX + task.id, json.dumps({'result': None, 'error': str(e), 'attempts': attempt}).encode('utf-8'))
+				return True
+			logger.warning('Task {} failed (attempt {}/{}), retrying: {}'.format(task.id, attempt, max_attempts, e))
+			time.sleep(retry_delay * 2 ** (attempt - 1))
+	store.put(DONE_PREFIX + task.id, json.dumps({'result': result, 'attempts': attempt}).encode('utf-8'))
+	return True
+
+"""Runs a run's tasks in this process, as many at once as their dependencies allow"""
+class LocalExecutor:
+
+	"""
+	Parameters:
+	- store - LocalStore (or StorageStore) for the run
+	- handler - function handler(task, store) doing the work. Must be picklable (e.g. a module level function) if processes is True
+	- workers - maximum tasks run at once. Defaults to the executor's default
+	- processes - whether to run tasks in processes rather than threads. Defaults to False
+	- max_attempts, retry_delay - see run_task()
+	"""
+	def __init__(self, store, handler, workers=None, processes=False, max_attempts=3, retry_delay=1.0):
+		self.store = store
+		self.handler = handler
+		self.workers = workers
+		self.processes = processes
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay
+
+	"""
+	Runs the tasks. Tasks depending on a failed task aren't run. Returns a dictionary {'ran': [task ids], 'skipped': [task ids already
+	finished], 'failed': {task id: error}, 'blocked': [task ids not run because a dependency failed]}
+	"""
+	def run(self, tasks):
+		result = {'ran': [], 'skipped': [], 'failed': {}, 'blocked': []}
+		pending = {task.id: task for task in tasks}
+		finished = set()
+		running = {}
+		executor_class = concurrent.futures.ProcessPoolExecutor if self.processes else concurrent.futures.ThreadPoolExecutor
+		with executor_class(max_workers=self.workers) as executor:
+			while len(pending) > 0 or len(running) > 0:
+				for task in list(pending.values()):
+					if any(dep in result['failed'] or dep in result['blocked'] for dep in task.deps):
+						result['blocked'].append(task.id)
+						del pending[task.id]
+					elif all(dep in finished for dep in task.deps):
+						running[executor.submit(run_task, task, self.store, self.handler, self.max_attempts, self.retry_delay)] = task
+						del pending[task.id]
+				if len(running) == 0:
+					break # Everything left is blocked
+				done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					task = running.pop(future)
+					try:
+						result['ran' if future.result() else 'skipped'].append(task.id)
+						finished.add(task.id)
+					except Exception as e:
+						logger.error('Task {} failed: {}'.format(task.id, e))
+						result['failed'][task.id] = str(e)
+		return result
+
+"""
+Fans a run's tasks out across Lambda invocations with an SQS queue. Messages are {'run': <run name>, 'task': <task id>}; the Lambda
+handler passes each one to handle() with the run's store.
+"""
+class SqsQueue:
+
+	"""
+	Parameters:
+	- sqs_client - the Boto3 SQS client to use
+	- queue_url - URL of the queue
+	- max_receives - deliveries of a message before SQS gives up on it. Defaults to MAX_RECEIVES
+	"""
+	def __init__(self, sqs_client, queue_url, max_receives=MAX_RECEIVES):
+		self.sqs_client = sqs_client
+		self.queue_url = queue_url
+		self.max_receives = max_receives
+
+	"""Saves the run's tasks to its store and sends the tasks without dependencies"""
+	def submit(self, run_name, store, tasks):
+		store.put(PLAN_NAME, json.dumps([task.to_dict() for task in tasks]).encode('utf-8'))
+		for task in tasks:
+			if len(task.deps) == 0:
+				self._send(run_name, task)
+
+	"""
+	Runs the message's task then sends the tasks waiting on it whose dependencies have all finished. Raises an exception (so SQS retries
+	the message) if the task fails or its dependencies haven't finished. An optional task failing on its last delivery (receive_count, the
+	record's ApproximateReceiveCount, reaching max_receives) is recorded as failed instead, see run_task(). Without a receive_count every
+	delivery is treated as the last.
+	"""
+	def handle(self, message, store, handler, max_attempts=1, receive_count=None):
+		tasks = load_plan(store)
+		task = tasks[message['task']]
+		if not all(store.exists(DONE_PREFIX + dep) for dep in task.deps):
+			raise Exception('Task {} of run {} received before its dependencies finished'.format(task.id, message['run']))
+		final = receive_count is None or int(receive_count) >= self.max_receives
+		run_task(task, store, handler, max_attempts, final=final)
+		for waiting in tasks.values():
+			if task.id in waiting.deps and all(store.exists(DONE_PREFIX + dep) for dep in waiting.deps):
+				self._send(message['run'], waiting) # May be sent twice if its last dependencies finish together, run_task() skips repeats
+
+	def _send(self, run_name, task):
+		self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'run': run_name, 'task': task.id}))
+		logger.debug('Sent task {} of run {}'.format(task.id, run_name))
@@ -0,0 +1,195 @@
+import contextlib
+import price.helper
+import threading
+import time
+import urllib.parse
+
+"""
+Per-host adaptive concurrency and rate control. Every request to a host (a page load, a click reloading a single page app's table, an HTTP
+download) goes through the host's HostController, which limits the requests in flight and spaces out their starts. The limit adapts AIMD
+style: each request completing in about the host's usual time adds 1/limit (so about one more request in flight per round of requests),
+while an error, a throttled response (HTTP 429) or a request much slower than usual halves it and doubles the spacing. So the scraper
+gets as much out of each host as it will take without hand-tuned sleeps, and backs off as soon as the host struggles. Controllers are
+shared by every source and thread in the process, see for_url() and stats().
+"""
+
+logger = price.helper.get_logger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 4 # Most requests in flight to one host
+DEFAULT_MIN_SPACING = 0.25 # Seconds between starting requests to a host at least
+MAX_SPACING = 10 # Seconds between starting requests to a host at most, after backing off
+MIN_BACKOFF_SPACING = 0.1 # Spacing doubled when backing off from no spacing
+DECREASE_FACTOR = 0.5 # Multiplies the limit on an error, throttling or congestion
+RECOVERY_FACTOR = 0.75 # Multiplies the spacing (back towards the minimum) on each request completing normally
+CONGESTION_FACTOR = 3 # A request taking this many times the host's usual time counts as congestion
+MIN_CONGESTION = 0.05 # Seconds a request must take at least to count as congestion, so jitter in very quick requests is ignored
+LATENCY_WEIGHT = 0.2 # Weight of each request's time in the host's usual time (exponentially weighted moving average)
+DEFAULT_SETTLE = 1.5 # Seconds to allow for a page to react to a click before the host's usual time is known, see settle_time()
+MIN_SETTLE = 0.5
+MAX_SETTLE = 3
+THROTTLED_TITLES = ['429 Too Many Requests', 'Too Many Requests'] # Page titles of throttled page loads
+
+"""Outcome of a request, see HostController.request()"""
+class Request:
+
+	def __init__(self):
+		self.state = None # None (succeeded), 'error' or 'throttled'
+		self.retry_after = None
+
+	"""
+	Records that the host throttled the request, e.g. HTTP 429. Parameters:
+	- retry_after - seconds (or the text of a Retry-After header) until the host accepts requests again, waiting is capped at MAX_SPACING.
+		Defaults to None (unknown)
+	"""
+	def throttled(self, retry_after=None):
+		self.state = 'throttled'
+		try:
+			self.retry_after = None if retry_after is None else float(retry_after)
+		except ValueError:
+			self.retry_after = None # A HTTP date, the spacing backs off instead
+
+	"""Records that the request failed"""
+	def failed(self):
+		if self.state is None:
+			self.state = 'error'
+
+"""Raised when a request's deadline passes while it waits its turn with the host"""
+class WaitTimeout(Exception):
+	pass
+
+class HostController:
+
+	"""
+	Parameters:
+	- host - the host name, e.g. 'www.userbenchmark.com'
+	- max_concurrency - most requests in flight. Defaults to DEFAULT_MAX_CONCURRENCY
+	- min_spacing - seconds between starting requests at least. Defaults to DEFAULT_MIN_SPACING
+	"""
+	def __init__(self, host, max_concurrency=DEFAULT_MAX_CONCURRENCY, min_spacing=DEFAULT_MIN_SPACING):
+		self.host = host
+		self.max_concurrency = max_concurrency
+		self.min_spacing = min_spacing
+		self.limit = 1.0 # Requests allowed in flight, starts low and increases while the host copes
+		self.spacing = min_spacing
+		self.latency = {} # kind -> usual seconds a request of the kind takes
+		self.in_flight = 0
+		self.next_start = 0 # time.monotonic() the next request can start
+		self.counts = {'requests': 0, 'errors': 0, 'throttled': 0, 'congested': 0}
+		self.waited = 0 # Seconds requests spent waiting to start
+		self.condition = threading.Condition()
+
+	"""
+	Context manager for a request to the host, waiting until it can start or the deadline (a time.monotonic(), e.g. the budget's
+	fetch_deadline()) passes, when WaitTimeout is raised. Yields the Request to record the outcome with, exceptions raised inside mark it
+	failed. Requests are timed per kind (e.g. a 'page' load takes longer than a 'click' reloading a table). E.g.
+
+		with controller.request(deadline=budget.fetch_deadline()) as request:
+			resp = requests.get(url)
+			if resp.status_code == 429:
+				request.throttled(resp.headers.get('Retry-After'))
+	"""
+	@contextlib.contextmanager
+	def request(self, kind='page', deadline=None):
+		self._acquire(deadline)
+		request = Request()
+		start = time.monotonic()
+		try:
+			yield request
+		except BaseException:
+			request.failed()
+			raise
+		finally:
+			self._release(request, kind, time.monotonic() - start)
+
+	"""
+	Returns seconds to give a page to react to a click (e.g. a progress bar to show up) before assuming it already has, i.e. the host's
+	usual time for the kind of request between MIN_SETTLE and MAX_SETTLE
+	"""
+	def settle_time(self, kind='click'):
+		with self.condition:
+			latency = self.latency.get(kind)
+		if latency is None:
+			return DEFAULT_SETTLE
+		return max(MIN_SETTLE, min(MAX_SETTLE, latency))
+
+	"""Returns {'host', 'limit', 'in_flight', 'spacing', 'latency', 'waited', 'requests', 'errors', 'throttled', 'congested'}"""
+	def stats(self):
+		with self.condition:
+			result = {'host': self.host, 'limit': round(self.limit, 2), 'in_flight': self.in_flight, 'spacing': round(self.spacing, 3),
+				'latency': {kind: round(latency, 3) for kind, latency in sorted(self.latency.items())}, 'waited': round(self.waited, 3)}
+			result.update(self.counts)
+			return result
+
+	def _acquire(self, deadline):
+		start = time.monotonic()
+		with self.condition:
+			while True:
+				now = time.monotonic()
+				can_start = self.in_flight < int(self.limit)
+				if can_start and now >= self.next_start:
+					break
+				if deadline is not None and now >= deadline:
+					self.waited += now - start
+					raise WaitTimeout('Timed out after {:.1f}s waiting to send a request to {}'.format(now - start, self.host))
+				timeout = self.next_start - now if can_start else None
+				if deadline is not None:
+					timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+				self.condition.wait(timeout)
+			self.in_flight += 1
+			self.next_start = now + self.spacing
+			self.waited += now - start
+
+	def _release(self, request, kind, seconds):
+		with self.condition:
+			self.in_flight -= 1
+			self.counts['requests'] += 1
+			if request.state == 'throttled':
+				self.counts['throttled'] += 1
+				self._decrease()
+				if request.retry_after is not None:
+					self.next_start = max(self.next_start, time.monotonic() + min(MAX_SPACING, request.retry_after))
+				logger.warning('{} throttled a request, limiting to {} in flight {:.2f}s apart'.format(self.host, int(self.limit), self.spacing))
+			elif request.state == 'error':
+				self.counts['errors'] += 1
+				self._decrease()
+			else:
+				latency = self.latency.get(kind)
+				if latency is not None and seconds > max(MIN_CONGESTION, latency * CONGESTION_FACTOR):
+					self.counts['congested'] += 1
+					self._decrease()
+				else:
+					self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+					self.spacing = max(self.min_spacing, self.spacing * RECOVERY_FACTOR)
+				self.latency[kind] = seconds if latency is None else latency + LATENCY_WEIGHT * (seconds - latency)
+			self.condition.notify_all()
+
+	def _decrease(self):
+		self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+		self.spacing = min(MAX_SPACING, max(self.spacing, MIN_BACKOFF_SPACING) * 2)
+
+CONTROLLERS = {} # host -> HostController
+CONTROLLERS_LOCK = threading.Lock()
+
+"""Returns the HostController of the URL's host"""
+def for_url(url):
+	return for_host(urllib.parse.urlsplit(url).hostname or '')
+
+"""Returns the HostController of the host, creating it the first time"""
+def for_host(host):
+	with CONTROLLERS_LOCK:
+		controller = CONTROLLERS.get(host)
+		if controller is None:
+			controller = CONTROLLERS[host] = HostController(host)
+		return controller
+
+"""Returns the HostController.stats() of every host, live while requests are in flight"""
+def stats():
+	with CONTROLLERS_LOCK:
+		controllers = sorted(CONTROLLERS.values(), key = lambda x: x.host)
+	return [controller.stats() for controller in controllers]
+
+"""Logs each host's stats (totals since the process started)"""
+def report():
+	for host_stats in stats():
+		logger.info('{host}: {requests} requests, {errors} errors, {throttled} throttled, {congested} congested, limit {limit} in flight '
+			'{spacing}s apart, usual seconds {latency}, waited {waited}s'.format(**host_stats))
@@ -1,21 +1,50 @@
-import boto3
-import bs4
 import csv
 import datetime
 import gzip
+import os
 import price.helper
+import price.pagination
+import price.storage
+import price.throttle
 import price.webdatasource
 import price.webdriver
 import requests
-import time
+import selenium.common.exceptions
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-"""UserBenchmark's CPUs by fastest average effective speed"""
+logger = price.helper.get_logger(__name__)
+
+PROGRESS_POLL = 0.1 # Seconds between checks for the progress bar showing up
+
+"""A UserBenchmark table, e.g. CPUs by fastest average effective speed. Categories are configured in price/categories.ini"""
 class UserBenchmark(price.webdatasource.WebDataSource):
 
+	DEFAULT_CATEGORY = 'cpu' # Category in price/categories.ini whose page is scraped when no URL is given
+
+	"""
+	Parameters:
+	- webdriver - a webdriver.WebDriver which abstracts away the Selenium web driver
+	- url - the UserBenchmark page. Defaults to DEFAULT_CATEGORY's perf_url, with its perf_title and perf_extra_column unless they're given
+	- page_title - expected page title
+	- sort_option - 1-based index of the sort drop down option to choose. Defaults to 3 (fastest average effective speed)
+	- extra_column - name of a column to add to the table if it's not shown, e.g. '1-Core'. Defaults to None (none)
+	"""
+	def __init__(self, webdriver, url=None, page_title=None, sort_option=3, extra_column=None):
+		super().__init__(webdriver)
+		if url is None:
+			import price.categories # Imports this module so can't be imported at the top
+			category = price.categories.get(self.DEFAULT_CATEGORY)
+			url = category.perf_url
+			page_title = category.perf_title if page_title is None else page_title
+			extra_column = category.perf_extra_column or None if extra_column is None else extra_column
+		self.url = url
+		self.page_title = page_title
+		self.sort_option = sort_option
+		self.extra_column = extra_column
+
 	"""
 	Parse UserBenchmark HTML DOM adding dictionary objects to the 'result' array. Dictionary format is:
 	{'name': <name>, '1-core': <score>, '2-core': <score>, '8-core': <score>, 'avg': <score>, 'user-rating': <score>}
@@ -74,103 +103,183 @@ class UserBenchmark(price.webdatasource.WebDataSource):
 					index_to_concept[i] = '8-core'
 		return index_to_concept
 
-	def download(self, output_file_name_prefix, num_pages=1):
+	"""
+	Downloads pages (by clicking through the table's pages) until they stop adding new products (see price.pagination). Parameters:
+	- output_file_name_prefix - pages are saved to '<output_file_name_prefix>_<page>.htm'
+	- num_pages - maximum number of pages. Default is 1
+	- target_products - stop once this many distinct products have been found. Defaults to None (no target)
+	- deadline - stop once time.monotonic() passes this, after the first page. Defaults to None (no deadline)
+	Returns the list of files kept. The pagination stats are available from self.coverage.stats(). If a page after the first fails, the pages
+	before it are kept. Pages are reached by clicking through from the first so they can only be restored from a checkpoint if a previous
+	attempt fetched all of them, otherwise they're all downloaded again.
+	"""
+	def download(self, output_file_name_prefix, num_pages=1, target_products=None, deadline=None):
 		self.files_downloaded = []
 		self.output_file_name_prefix = output_file_name_prefix
-		self.current_page = 1
-		self.num_pages = num_pages
-		src = self._download('https://cpu.userbenchmark.com/', 'CPU UserBenchmarks - ', 'tr[class="hovertarget "]', 'body')
-		file_name = output_file_name_prefix + '_1.htm'
-		with open(file_name, 'w', encoding='utf-8') as f:
-			f.write(src)
-		self.files_downloaded.append(file_name)
+		self.coverage = price.pagination.Coverage(num_pages, target_products, deadline)
+		if self._restore():
+			self.coverage.report()
+			return self.files_downloaded
+		try:
+			self._download(self.url, self.page_title, 'tr[class="hovertarget "]', 'body') # Pages are saved by _post_download()
+		except Exception as e:
+			if len(self.files_downloaded) == 0:
+				raise
+			logger.warning('Fetching a page failed, keeping the {} pages before it: {}'.format(len(self.files_downloaded), e))
+			self.coverage.fail()
+		self.coverage.report()
 		return self.files_downloaded
 
+	"""Returns the names of the products in a downloaded page"""
+	def product_names(self, file_name):
+		return [product['name'] for product in self.parse_file(file_name)]
+
+	"""Restores the pages from the checkpoint if a previous attempt fetched all of them. Returns True if restored."""
+	def _restore(self):
+		reason = None if self.checkpoint is None else self.checkpoint.finished()
+		if reason is None:
+			return False
+		page = 1
+		while True:
+			file_name = self.output_file_name_prefix + '_' + str(page) + '.htm'
+			if not self.checkpoint.restore(page, file_name):
+				break
+			self.coverage.add_page(self.product_names(file_name))
+			self.files_downloaded.append(file_name)
+			page += 1
+		if len(self.files_downloaded) == 0:
+			return False
+		self.coverage.stopped = reason
+		logger.info('Restored {} pages from the checkpoint'.format(len(self.files_downloaded)))
+		return True
+
 	def _pre_wait_navigation(self, driver):
 		# Hit drop down to change sorting (default is by user rating)
-		chooser_ele = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 's2id_mh-td-chooser')))
+		chooser_ele = WebDriverWait(driver, self.budget.timeout('wait')).until(EC.presence_of_element_located((By.ID, 's2id_mh-td-chooser')))
 		chooser_ele.click()
-		# Click 3rd option (sort by fatest average effective speed)
-		option = WebDriverWait(driver, 2).until(lambda x: x.find_element(By.XPATH, '(//span[@class="select2-match"])[3]'))
+		# Click the sort option (3rd is sort by fatest average effective speed)
+		option = WebDriverWait(driver, self.budget.timeout('control')).until(lambda x: x.find_element(By.XPATH, '(//span[@class="select2-match"])[' + str(self.sort_option) + ']'))
 		clickable_option = option.find_element(By.XPATH, './..')
 		clickable_option.click()
-		time.sleep(1.5) # This is gross but it's possible on Lambda for the progress bar to not have even shown up yet if this is too low
-		# Wait until progress bar gone
-		WebDriverWait(driver, 5).until_not(lambda x: x.find_element(By.CSS_SELECTOR, 'div[class="ajaxProgress"]').is_displayed())
+		self._wait_for_table(driver)
 
-		if len(driver.find_elements(By.CSS_SELECTOR, 'th.mh-td-col[data-mhth="MCCPU_1CA"]')) == 0:
-			# Add 1-core pts if not there
+		if self.extra_column and len(driver.find_elements(By.XPATH, '//th[contains(@class, "mh-td-col") and contains(., "' + self.extra_column + '")]')) == 0:
+			# Add the extra column (e.g. 1-core pts) if not there
 			add_column_links = driver.find_elements(By.CSS_SELECTOR, 'th.mh-td-th-arrow[title="Add columns"] a.nodec')
 			add_column_links[-1].click() # Click the last one, that should be the link to open the options panel (instead of the hidden one)
-			column_dialog = WebDriverWait(driver, 2).until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div.list-group')))
+			column_dialog = WebDriverWait(driver, self.budget.timeout('control')).until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div.list-group')))
 			options = column_dialog.find_elements(By.TAG_NAME, 'a')
 			for option in options:
-				if option.text.find('1-Core') >= 0:
+				if option.text.find(self.extra_column) >= 0:
 					option.click()
-					time.sleep(1.5) # This is gross but it's possible on Lambda for the progress bar to not have even shown up yet if this is too low
-					# Wait until progress bar gone
-					WebDriverWait(driver, 5).until_not(lambda x: x.find_element(By.CSS_SELECTOR, 'div[class="ajaxProgress"]').is_displayed())
+					self._wait_for_table(driver)
 					break
 
-	def _post_download(self, driver):
-		for i in range(1, self.num_pages):
-			next = driver.find_element(By.XPATH, '//ul[@class="pagination pagination-lg"]/li[2]/a') # Next page
-			driver.execute_script('arguments[0].scrollIntoView(false);', next)
-			next.click()
-			time.sleep(1.5) # This is gross but it's possible on Lambda for the progress bar to not have even shown up yet if this is too low
-			# Wait until progress bar gone
-			WebDriverWait(driver, 5).until_not(lambda x: x.find_element(By.CSS_SELECTOR, 'div[class="ajaxProgress"]').is_displayed())
-			body = driver.find_element(By.TAG_NAME, 'body')
-			file_name = self.output_file_name_prefix + '_' + str(i + 1) + '.htm'
+	def _post_download(self, driver, src):
+		page = 1
+		while True:
+			file_name = self.output_file_name_prefix + '_' + str(page) + '.htm'
 			with open(file_name, 'w', encoding='utf-8') as f:
-				f.write(body.get_attribute('outerHTML'))
+				f.write(src)
+			if not self.coverage.add_page(self.product_names(file_name)):
+				os.remove(file_name) # Same products as before, we've gone past the end
+				self._finish()
+				return
 			self.files_downloaded.append(file_name)
+			if self.checkpoint is not None:
+				self.checkpoint.done(page, self.url, file_name)
+			if self.coverage.stop_reason() is not None:
+				self._finish()
+				return
+
+			nexts = driver.find_elements(By.XPATH, '//ul[@class="pagination pagination-lg"]/li[2]/a') # Next page
+			if len(nexts) == 0:
+				self.coverage.end()
+				self._finish()
+				return
+			driver.execute_script('arguments[0].scrollIntoView(false);', nexts[0])
+			with price.throttle.for_url(self.url).request('click', self.budget.fetch_deadline()):
+				nexts[0].click()
+				self._wait_for_table(driver)
+			src = driver.find_element(By.TAG_NAME, 'body').get_attribute('outerHTML')
+			price.helper.count('pages')
+			price.helper.count('bytes', len(src))
+			page += 1
+
+	"""
+	Waits for the table to reload after a click. The progress bar can take a moment to show up (especially on Lambda) so it's given the
+	host's usual time for a click to show up before waiting for it to go (see price.throttle.HostController.settle_time()).
+	"""
+	def _wait_for_table(self, driver):
+		progress_displayed = lambda x: x.find_element(By.CSS_SELECTOR, 'div[class="ajaxProgress"]').is_displayed()
+		try:
+			WebDriverWait(driver, price.throttle.for_url(self.url).settle_time(), PROGRESS_POLL).until(progress_displayed)
+		except selenium.common.exceptions.TimeoutException:
+			pass # Already came and went
+		WebDriverWait(driver, self.budget.timeout('progress')).until_not(progress_displayed)
+
+	"""Records in the checkpoint that every page wanted was fetched, so a retry can restore them"""
+	def _finish(self):
+		if self.checkpoint is not None and self.coverage.complete():
+			self.checkpoint.finish(self.coverage.stop_reason())
 
 """
-UserBenchmark's HDDs by fastest average effective speed. Note this implementation doesn't use Selenium (just downloads UserBenchmark's CSV)
-so should be fast and maintains the API of price.webdatasource.WebDataSource albeit with some parameters ignored.
+A UserBenchmark CSV download, e.g. HDDs. Note this implementation doesn't use Selenium (just downloads UserBenchmark's CSV) so should be
+fast and maintains the API of price.webdatasource.WebDataSource albeit with some parameters ignored.
 """
-class UserBenchmarkHdd(price.webdatasource.WebDataSource):
+class UserBenchmarkCsv(price.webdatasource.WebDataSource):
 
 	EXPECTED_HEADER = 'Type,Part Number,Brand,Model,Rank,Benchmark,Samples,URL'
-	S3_CACHE_KEY = 'tmp/HDD_UserBenchmarks.csv'
 
-	"""Special constructor since this doesn't use Selenium, we don't need to pass a web driver"""
-	def __init__(self):
+	"""
+	Special constructor since this doesn't use Selenium, we don't need to pass a web driver. Parameters:
+	- url - the CSV to download. Defaults to the HDD CSV
+	- cache_days - how many days the CSV is cached in S3 for. Defaults to 7
+	- min_benchmark - rows with a lower average benchmark are skipped. Defaults to 42
+	- min_samples - rows with fewer samples are skipped. Defaults to 12 (i.e. skip the bottom 1% of samples)
+	"""
+	def __init__(self, url='https://www.userbenchmark.com/resources/download/csv/HDD_UserBenchmarks.csv', cache_days=7, min_benchmark=42, min_samples=12):
 		super().__init__(None)
+		self.url = url
+		self.cache_days = cache_days
+		self.min_benchmark = min_benchmark
+		self.min_samples = min_samples
+		self.s3_cache_key = 'tmp/' + url.split('/')[-1]
 
 	"""
 	Download operates differently. It just hits UserBenchmark's CSV download (which doesn't have as much detail) and uses S3 as a cache
-	under the key 'tmp/HDD_UserBenchmarks.csv' (gzipped). Locally, the file is saved to the given output_file_name (no compression)
+	under the key 'tmp/<CSV file name>' (gzipped), e.g. 'tmp/HDD_UserBenchmarks.csv'. Locally, the file is saved to the given
+	output_file_name (no compression)
 
 	Parameters:
 	- output_file_name - name of the file to save to local disk. No suffixes are added to this prefix (i.e. the prefix is the file name).
-		Defaults to '/tmp/HDD_UserBenchmarks.csv'
-	- num_pages - this is ignored
+		Defaults to '/tmp/<CSV file name>'
+	- num_pages, target_products, deadline - these are ignored
 	"""
-	def download(self, output_file_name='/tmp/HDD_UserBenchmarks.csv', num_pages=1):
+	def download(self, output_file_name=None, num_pages=1, target_products=None, deadline=None):
+		if output_file_name is None:
+			output_file_name = '/tmp/' + self.url.split('/')[-1]
 		csv_content = None
-		s3_details = price.helper.get_s3_details()
-		s3_list = s3_details.client.list_objects_v2(Bucket=s3_details.bucket, Prefix=self.S3_CACHE_KEY)
-		if 'Contents' in s3_list and len(s3_list['Contents']) > 0:
-			last_modified = s3_list['Contents'][0]['LastModified']
-			if last_modified > datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=7):
-				# S3 cache is fresh (within 7 days old)
-				s3_resp = s3_details.client.get_object(Bucket=s3_details.bucket, Key=self.S3_CACHE_KEY)
-				csv_content = gzip.decompress(s3_resp['Body'].read())
+		storage = price.storage.get_storage()
+		cached = storage.head(self.s3_cache_key)
+		if cached is not None and cached.last_modified > datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.cache_days):
+			# S3 cache is fresh
+			csv_content = gzip.decompress(storage.get(self.s3_cache_key).data)
 
 		if csv_content == None:
-			# S3 cache is older than 7 days ago. Refersh it.
-			userbenchmark_hdd_csv_url = 'https://www.userbenchmark.com/resources/download/csv/HDD_UserBenchmarks.csv'
-			resp = requests.get(userbenchmark_hdd_csv_url)
-			if resp.status_code != 200:
-				raise Exception('Could not download UserBenchmark HDD CSV using url={}. Response: {}'.format(userbenchmark_hdd_csv_url, resp))
+			# S3 cache is stale. Refersh it.
+			with price.throttle.for_url(self.url).request(deadline=self.budget.fetch_deadline()) as request:
+				resp = requests.get(self.url, timeout=self.budget.timeout('navigate'))
+				if resp.status_code == 429:
+					request.throttled(resp.headers.get('Retry-After'))
+				if resp.status_code != 200:
+					raise Exception('Could not download UserBenchmark CSV using url={}. Response: {}'.format(self.url, resp))
 			csv_content = resp.content
-			compressed_data = gzip.compress(resp.content)
-			s3_details.client.put_object(Body=compressed_data, Bucket=s3_details.bucket, ContentEncoding='gzip', ContentType='text/csv', Key=self.S3_CACHE_KEY)
+			storage.put(self.s3_cache_key, gzip.compress(resp.content), content_type='text/csv', content_encoding='gzip')
 
 		with open(output_file_name, 'wb') as output_file:
 			output_file.write(csv_content)
+		price.helper.count('bytes', len(csv_content))
 		return [output_file_name]
 
 	"""
@@ -198,20 +307,23 @@ class UserBenchmarkHdd(price.webdatasource.WebDataSource):
 					raise Exception('Something is wrong with the CSV file. Expected "{}" but got "{}"'.format(self.EXPECTED_HEADER, header))
 				continue
 			avg_benchmark = float(row[5].strip())
-			if avg_benchmark < 42:
-				continue # Skip over bottom 50% of performers, these are usually 5400 rpm drives which I don't care about
+			if avg_benchmark < self.min_benchmark:
+				continue # E.g. skip over bottom 50% of HDD performers, these are usually 5400 rpm drives which I don't care about
 			samples = int(row[6].strip())
-			if int(row[6]) < 12:
-				continue # Skip over rows that have < 12 samples (i.e. skip the bottom 1% of samples)
+			if samples < self.min_samples:
+				continue
 			result.append({'brand': row[2].strip(), 'mfg_code': row[1].strip(), 'model': row[3].strip(), 'samples': samples, 'avg': row[5].strip()})
 
 	def parse_soup(self, result, soup):
 		raise NotImplementedError # This shouldn't be called as the 'parse' method above won't call this
 
+UserBenchmarkHdd = UserBenchmarkCsv # Defaults are for HDDs
+
 if __name__ == '__main__':
 	price.helper.init_environ()
-	ub = UserBenchmark(price.webdriver.FirefoxWebDriver('Selenium'))
-	#ub = UserBenchmarkHdd()
+	import price.categories # Imports this module so can't be imported at the top
+	ub = price.categories.get('cpu').create_perf_source(price.webdriver.FirefoxWebDriver('Selenium'))
+	#ub = price.categories.get('hdd').create_perf_source(None)
 	ub.download('test/wip_userbenchmark', 2)
 	#data = ub.parse('test/userbenchmark_cpu_fastest_avg_20200123.htm', 'test/userbenchmark_cpu_fastest_avg_20200123_2.htm')
 	data = ub.parse_prefixes('test/wip_userbenchmark')
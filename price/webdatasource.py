@@ -1,12 +1,23 @@
 import abc
 import bs4
+import price.budget
 import price.helper
+import price.throttle
 import os
+import threading
+import selenium.common.exceptions
 import selenium.webdriver.support.wait
 from selenium.webdriver.common.by import By
 
 logger = price.helper.get_logger(__name__)
 
+PARSERS = ['html.parser', 'lxml', 'html5lib'] # Beautiful Soup parser backends, lxml and html5lib are optional packages
+DEFAULT_PARSER = 'html.parser'
+
+"""Returns the PARSERS which are installed"""
+def available_parsers():
+	return [parser for parser in PARSERS if bs4.builder.builder_registry.lookup(parser) is not None]
+
 """
 Abstracts Selenium scraping the HTML DOM from a web site. Requirements:
 """
@@ -15,9 +26,16 @@ class WebDataSource(metaclass=abc.ABCMeta):
 	"""
 	Parameters:
 	- webdriver - a webdriver.WebDriver which abstracts away the Selenium web driver
+	- parser - the Beautiful Soup parser backend used by parse(), one of PARSERS. Defaults to DEFAULT_PARSER
 	"""
-	def __init__(self, webdriver):
+	def __init__(self, webdriver, parser=DEFAULT_PARSER):
 		self.webdriver = webdriver
+		self.parser = parser
+		self.drivers = [] # Selenium web drivers started, pages may be downloaded concurrently each with its own driver
+		self.drivers_lock = threading.Lock()
+		self.parsed = {} # path -> (modified time, parser, result of parsing the file), see parse_file()
+		self.budget = price.budget.Budget() # Step timeouts come from this, the scraper replaces it with the run's price.budget.Budget
+		self.checkpoint = None # A price.checkpoint.SourceCheckpoint to resume an interrupted download from, the scraper sets this
 
 	"""
 	Download HTML DOM from this web data source. Uses Selenium to hit web pages with Firefox.
@@ -36,24 +54,53 @@ class WebDataSource(metaclass=abc.ABCMeta):
 	Downloads HTML source for the given tag. Parameters:
 	- url - web site to download
 	- page_title - expected page title (using 'in' check) to verify we're hitting the right page. Returns assertion error if this check fails
-	- wait_until_css_selector - Wait a maximum 10 seconds for the element defined by the CSS selector to be present before returning HTML source
+	- wait_until_css_selector - Wait for the element defined by the CSS selector to be present before returning HTML source. Page loads and
+		waits time out according to the budget (10 seconds for the wait when unlimited) and a timed out page is retried if there's time
 	- tag - name of tag to return HTML source for
+	- webdriver - the webdriver.WebDriver to use. Defaults to this source's, pass another (see webdriver.WebDriver.for_slot()) to download
+		pages concurrently
+	Page loads wait their turn with the host's price.throttle.HostController, which limits how many are in flight and how often they start.
 	Returns: the HTML as a string
 	"""
-	def _download(self, url, page_title, wait_until_css_selector, tag):
+	def _download(self, url, page_title, wait_until_css_selector, tag, webdriver=None):
 		result = None
-		self.driver = self.webdriver.getWebDriver()
+		with price.helper.span('browser_launch'):
+			driver = (self.webdriver if webdriver is None else webdriver).getWebDriver()
+		with self.drivers_lock:
+			self.drivers.append(driver)
+			self.driver = driver
 		try:
-			self.driver.get(url)
-			assert page_title in self.driver.title
-			self._pre_wait_navigation(self.driver)
-			selenium.webdriver.support.wait.WebDriverWait(self.driver, 10).until(lambda x: x.find_element(By.CSS_SELECTOR, wait_until_css_selector))
-			elem = self.driver.find_element(By.TAG_NAME, tag)
-			result = elem.get_attribute('outerHTML')
-			self._post_download(self.driver)
+			throttle = price.throttle.for_url(url)
+			attempt = 1
+			while True:
+				try:
+					with throttle.request(deadline=self.budget.fetch_deadline()) as request:
+						with price.helper.span('navigate'):
+							driver.set_page_load_timeout(self.budget.timeout('navigate'))
+							driver.get(url)
+							if any(title in driver.title for title in price.throttle.THROTTLED_TITLES):
+								request.throttled()
+							assert page_title in driver.title
+							self._pre_wait_navigation(driver)
+						with price.helper.span('wait'):
+							selenium.webdriver.support.wait.WebDriverWait(driver, self.budget.timeout('wait')).until(lambda x: x.find_element(By.CSS_SELECTOR, wait_until_css_selector))
+					break
+				except selenium.common.exceptions.TimeoutException as e:
+					if not self.budget.can_retry(attempt, 'navigate', 'wait'):
+						raise
+					logger.warning('Timed out loading {} (attempt {}), retrying: {}'.format(url, attempt, e.msg))
+					price.helper.count('retries')
+					attempt += 1
+			with price.helper.span('extract'):
+				elem = driver.find_element(By.TAG_NAME, tag)
+				result = elem.get_attribute('outerHTML')
+			price.helper.count('pages')
+			price.helper.count('bytes', len(result))
+			with price.helper.span('post_download'):
+				self._post_download(driver, result)
 		finally:
 			try:
-				self.driver.close()
+				driver.close()
 			except Exception as e:
 				logger.warn('Closing selenium browser had an error:' + str(e))
 		return result
@@ -62,15 +109,21 @@ class WebDataSource(metaclass=abc.ABCMeta):
 	def _pre_wait_navigation(self, driver):
 		pass
 
-	"""Allow subclasses to do Selenium actions after source has been downloaded. Useful for single-page sites to download page 2."""
-	def _post_download(self, driver):
+	"""
+	Allow subclasses to do Selenium actions after source has been downloaded. Useful for single-page sites to download page 2. 'src' is the
+	downloaded HTML source.
+	"""
+	def _post_download(self, driver, src):
 		pass
 
-	"""Quit the Selenium session. Frees up some processes/resources."""
+	"""Quit the Selenium sessions. Frees up some processes/resources."""
 	def quit_selenium(self):
-		if hasattr(self, 'driver'):
+		with self.drivers_lock:
+			drivers = self.drivers
+			self.drivers = []
+		for driver in drivers:
 			try:
-				self.driver.quit()
+				driver.quit()
 			except Exception as e:
 				logger.warn('Quitting selenium session had an error:' + str(e))
 
@@ -78,10 +131,23 @@ class WebDataSource(metaclass=abc.ABCMeta):
 	def parse(self, *input_file_paths):
 		result = []
 		for input_file_path in input_file_paths:
+			result.extend(self.parse_file(input_file_path))
+		return result
+
+	"""
+	Parses a single file returning a list of dictionary objects. Results are cached until the file changes since pages are parsed while
+	downloading to decide whether to fetch more (see price.pagination) and again by parse().
+	"""
+	def parse_file(self, input_file_path):
+		modified = os.path.getmtime(input_file_path)
+		cached = self.parsed.get(input_file_path)
+		if cached is None or cached[0] != modified or cached[1] != self.parser:
+			result = []
 			with open(input_file_path, 'r') as f:
-				soup = bs4.BeautifulSoup(f.read(), 'html.parser')
+				soup = bs4.BeautifulSoup(f.read(), self.parser)
 				self.parse_soup(result, soup)
-		return result
+			cached = self.parsed[input_file_path] = (modified, self.parser, result)
+		return [dict(row) for row in cached[2]] # Copies so callers can modify them
 
 	"""
 	Parse files with the given prefix and suffix (default is '.htm') in the format '<prefix>_<1-based index><suffix>'
@@ -92,9 +158,7 @@ class WebDataSource(metaclass=abc.ABCMeta):
 		i = 1
 		input_file_path = prefix + '_' + str(i) + suffix
 		while os.path.exists(input_file_path):
-			with open(input_file_path, 'r') as f:
-				soup = bs4.BeautifulSoup(f.read(), 'html.parser')
-				self.parse_soup(result, soup)
+			result.extend(self.parse_file(input_file_path))
 			i = i + 1
 			input_file_path = prefix + '_' + str(i) + suffix
 		return result
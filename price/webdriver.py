@@ -1,4 +1,6 @@
 import abc
+import os
+import price.chromeprofile
 import selenium.webdriver
 import selenium.webdriver.firefox.options
 import selenium.webdriver.chrome.options
@@ -29,6 +31,13 @@ class WebDriver(metaclass=abc.ABCMeta):
 	def getWebDriver(self):
 		raise NotImplementedError
 
+	"""
+	Returns a WebDriver whose browsers can run at the same time as browsers of other slots, e.g. for downloading pages concurrently. Slot 0
+	is this WebDriver. Browsers that don't share state on disk return this WebDriver for every slot.
+	"""
+	def for_slot(self, slot):
+		return self
+
 
 """
 WebDriver based on Firefox. Note The ChromeWebDriver appears to be more stable.
@@ -62,6 +71,83 @@ class FirefoxWebDriver(WebDriver):
 			ff_options.add_argument(self.profile)
 		return selenium.webdriver.Firefox(firefox_binary=self.firefox_binary, executable_path=self.geckodriver_path, options=ff_options, service_log_path=self.geckodriver_log_file)
 
+# Flags the Chrome flag sets are made of
+_AWS_BLOG_FLAGS = [ # From https://aws.amazon.com/blogs/devops/ui-testing-at-scale-with-aws-lambda/
+	'--disable-gpu', # Not in https://github.com/alixaxel/chrome-aws-lambda but in https://github.com/adieuadieu/serverless-chrome/blob/master/packages/lambda/builds/chromium/Dockerfile
+	'--single-process'
+]
+_CHROME_AWS_LAMBDA_FLAGS = [ # From https://github.com/alixaxel/chrome-aws-lambda
+	'--disable-background-timer-throttling',
+	'--disable-breakpad',
+	'--disable-client-side-phishing-detection',
+	'--disable-cloud-import',
+	'--disable-default-apps',
+	'--disable-dev-shm-usage',
+	'--disable-extensions',
+	'--disable-gesture-typing',
+	'--disable-hang-monitor',
+	'--disable-infobars',
+	'--disable-notifications',
+	'--disable-offer-store-unmasked-wallet-cards',
+	'--disable-offer-upload-credit-cards',
+	'--disable-popup-blocking',
+	'--disable-print-preview',
+	'--disable-prompt-on-repost',
+	'--disable-setuid-sandbox',
+	'--disable-speech-api',
+	'--disable-sync',
+	'--disable-tab-for-desktop-share',
+	'--disable-translate',
+	'--disable-voice-input',
+	'--disable-wake-on-wifi',
+	'--enable-async-dns',
+	'--enable-simple-cache-backend',
+	'--enable-tcp-fast-open',
+	'--enable-webgl',
+	'--hide-scrollbars',
+	'--ignore-gpu-blacklist',
+	'--media-cache-size=33554432',
+	'--metrics-recording-only',
+	'--mute-audio',
+	'--no-default-browser-check',
+	'--no-first-run',
+	'--no-pings',
+	'--no-zygote',
+	'--password-store=basic',
+	'--prerender-from-omnibox=disabled',
+	'--use-gl=swiftshader',
+	'--use-mock-keychain',
+	'--memory-pressure-off'
+]
+_PROCESS_MODEL_FLAGS = ['--single-process', '--no-zygote']
+_GL_FLAGS = ['--enable-webgl', '--ignore-gpu-blacklist', '--use-gl=swiftshader']
+
+"""
+Named sets of Chrome flags on top of the ones every launch needs (headless, no sandbox and the temp directories). Pick one with
+ChromeWebDriver's flag_set and compare them on recorded pages with price.chromebench:
+- lambda - everything from the blog posts the scraper was set up from
+- no_gl - lambda without WebGL/SwiftShader, the scraped pages don't draw anything
+- multi_process - lambda without --single-process/--no-zygote, i.e. Chrome's usual process model
+- lean - only the flags which stop background work (extensions, sync, first run, metrics, ...) and keep it to one process
+- minimal - just --disable-gpu and --disable-dev-shm-usage
+"""
+CHROME_FLAG_SETS = {
+	'lambda': _AWS_BLOG_FLAGS + _CHROME_AWS_LAMBDA_FLAGS,
+	'no_gl': [flag for flag in _AWS_BLOG_FLAGS + _CHROME_AWS_LAMBDA_FLAGS if flag not in _GL_FLAGS],
+	'multi_process': [flag for flag in _AWS_BLOG_FLAGS + _CHROME_AWS_LAMBDA_FLAGS if flag not in _PROCESS_MODEL_FLAGS],
+	'lean': ['--disable-gpu', '--disable-dev-shm-usage', '--disable-background-timer-throttling', '--disable-breakpad', '--disable-default-apps',
+		'--disable-extensions', '--disable-sync', '--disable-translate', '--metrics-recording-only', '--mute-audio', '--no-default-browser-check',
+		'--no-first-run', '--no-pings', '--password-store=basic', '--use-mock-keychain'] + _PROCESS_MODEL_FLAGS,
+	'minimal': ['--disable-gpu', '--disable-dev-shm-usage']
+}
+DEFAULT_FLAG_SET = 'lambda'
+
+"""Returns the flags of the named CHROME_FLAG_SETS"""
+def chrome_flags(flag_set):
+	if flag_set not in CHROME_FLAG_SETS:
+		raise ValueError('Unknown Chrome flag set "{}", expected one of {}'.format(flag_set, ', '.join(CHROME_FLAG_SETS)))
+	return list(CHROME_FLAG_SETS[flag_set])
+
 """
 WebDriver based on Chrome/Chromium.
 """
@@ -73,8 +159,11 @@ class ChromeWebDriver(WebDriver):
 	- geckodriver_path - directory with the GeckoDriver, if None will look on the path for it
 	- geckodriver_log_file - path for GeckoDriver to write logs to. If None will use the default
 	- temp_dir - directory which Chrome can use to write to. Defaults to /tmp
+	- profile - price.chromeprofile.ChromeProfile to restore into temp_dir and to cap the disk cache kept there between launches. If None
+		Chrome initialises the profile itself and its disk cache is capped to the default size
+	- flag_set - name of the CHROME_FLAG_SETS to launch Chrome with. Defaults to DEFAULT_FLAG_SET. See price.chromebench to compare them
 	"""
-	def __init__(self, chrome_binary=None, chromedriver_path='chromedriver', chromedriver_log_file='chromedriver.log', temp_dir='/tmp'):
+	def __init__(self, chrome_binary=None, chromedriver_path='chromedriver', chromedriver_log_file='chromedriver.log', temp_dir='/tmp', profile=None, flag_set=DEFAULT_FLAG_SET):
 		self.chrome_binary = chrome_binary
 		if chromedriver_path is None:
 			self.chromedriver_path = 'chromedriver'
@@ -85,63 +174,39 @@ class ChromeWebDriver(WebDriver):
 		else:
 			self.chromedriver_log_file = chromedriver_log_file
 		self.temp_dir = temp_dir
+		self.profile = profile
+		chrome_flags(flag_set) # Fail now rather than on the first launch
+		self.flag_set = flag_set
+
+	"""Browsers can't share a user data directory so each slot after 0 gets its own temp directory '<temp_dir>/slot<slot>'"""
+	def for_slot(self, slot):
+		if slot == 0:
+			return self
+		temp_dir = self.temp_dir + '/slot' + str(slot)
+		os.makedirs(temp_dir, exist_ok=True)
+		log_file = self.chromedriver_log_file[:-len('.log')] + '_slot' + str(slot) + '.log' if self.chromedriver_log_file.endswith('.log') else self.chromedriver_log_file
+		return ChromeWebDriver(self.chrome_binary, self.chromedriver_path, log_file, temp_dir, self.profile, self.flag_set)
 
 	def getWebDriver(self):
+		user_data_dir = self.temp_dir + '/' + price.chromeprofile.USER_DATA_DIR
+		cache_dir = self.temp_dir + '/' + price.chromeprofile.CACHE_DIR
+		cache_size = price.chromeprofile.DEFAULT_CACHE_SIZE
+		if self.profile is not None:
+			user_data_dir, cache_dir = self.profile.prepare(self.temp_dir)
+			cache_size = self.profile.cache_size
+
 		options = selenium.webdriver.ChromeOptions()
 		options.binary_location = self.chrome_binary
-		# Options from https://aws.amazon.com/blogs/devops/ui-testing-at-scale-with-aws-lambda/
+		# Every flag set needs these
 		options.add_argument('--data-path=' + self.temp_dir + '/data-path') # This directory doesn't seem to get created
-		options.add_argument('--disable-gpu') # Not in https://github.com/alixaxel/chrome-aws-lambda but in https://github.com/adieuadieu/serverless-chrome/blob/master/packages/lambda/builds/chromium/Dockerfile
-		options.add_argument('--disk-cache-dir=' + self.temp_dir + '/cache-dir')
+		options.add_argument('--disk-cache-dir=' + cache_dir)
+		options.add_argument('--disk-cache-size=' + str(cache_size))
 		options.add_argument('--headless')
 		options.add_argument('--homedir=' + self.temp_dir)
 		options.add_argument('--no-sandbox')
-		options.add_argument('--single-process')
-		options.add_argument('--user-data-dir=' + self.temp_dir + '/user-data')
+		options.add_argument('--user-data-dir=' + user_data_dir)
 		options.add_argument('--window-size=1366,768')
-		# Options from https://github.com/alixaxel/chrome-aws-lambda
-		options.add_argument('--disable-background-timer-throttling')
-		options.add_argument('--disable-breakpad')
-		options.add_argument('--disable-client-side-phishing-detection')
-		options.add_argument('--disable-cloud-import')
-		options.add_argument('--disable-default-apps')
-		options.add_argument('--disable-dev-shm-usage')
-		options.add_argument('--disable-extensions')
-		options.add_argument('--disable-gesture-typing')
-		options.add_argument('--disable-hang-monitor')
-		options.add_argument('--disable-infobars')
-		options.add_argument('--disable-notifications')
-		options.add_argument('--disable-offer-store-unmasked-wallet-cards')
-		options.add_argument('--disable-offer-upload-credit-cards')
-		options.add_argument('--disable-popup-blocking')
-		options.add_argument('--disable-print-preview')
-		options.add_argument('--disable-prompt-on-repost')
-		options.add_argument('--disable-setuid-sandbox')
-		options.add_argument('--disable-speech-api')
-		options.add_argument('--disable-sync')
-		options.add_argument('--disable-tab-for-desktop-share')
-		options.add_argument('--disable-translate')
-		options.add_argument('--disable-voice-input')
-		options.add_argument('--disable-wake-on-wifi')
-		options.add_argument('--disk-cache-size=33554432')
-		options.add_argument('--enable-async-dns')
-		options.add_argument('--enable-simple-cache-backend')
-		options.add_argument('--enable-tcp-fast-open')
-		options.add_argument('--enable-webgl')
-		options.add_argument('--hide-scrollbars')
-		options.add_argument('--ignore-gpu-blacklist')
-		options.add_argument('--media-cache-size=33554432')
-		options.add_argument('--metrics-recording-only')
-		options.add_argument('--mute-audio')
-		options.add_argument('--no-default-browser-check')
-		options.add_argument('--no-first-run')
-		options.add_argument('--no-pings')
-		#options.add_argument('--no-sandbox') # above
-		options.add_argument('--no-zygote')
-		options.add_argument('--password-store=basic')
-		options.add_argument('--prerender-from-omnibox=disabled')
-		options.add_argument('--use-gl=swiftshader')
-		options.add_argument('--use-mock-keychain')
-		options.add_argument('--memory-pressure-off')
+		for flag in chrome_flags(self.flag_set):
+			options.add_argument(flag)
 
 		return selenium.webdriver.Chrome(self.chromedriver_path, options=options, service_log_path=self.chromedriver_log_file)
@@ -0,0 +1,38 @@
+import price.archive
+import price.storage
+import pytest
+
+def read_fixture(name):
+	with open('test/' + name, 'rb') as f:
+		return f.read()
+
+@pytest.mark.parametrize('codec', ['zlib', 'zstd'])
+def test_put_and_read_run(codec, tmp_path):
+	if codec == 'zstd' and price.archive.zstandard is None:
+		pytest.skip('zstandard not installed')
+	storage = price.storage.LocalStorage(str(tmp_path))
+	archive = price.archive.Archive(storage, codec=codec)
+	day1 = {'pricespy_cpu_aaaaaa_20200314_1.htm': read_fixture('pricespy_cpu_20200314_1.htm'), 'userbenchmark_cpu_aaaaaa_20200314_1.htm': read_fixture('userbenchmark_cpu_20200314_1.htm')}
+	manifest = archive.put_run('cpu_20200314_aaaaaa', day1)
+	assert manifest['stats']['deduplicated'] == 0
+	assert manifest['stats']['stored_bytes'] < manifest['stats']['raw_bytes'] / 4
+
+	# Next day, PriceSpy page didn't change
+	day2 = {'pricespy_cpu_bbbbbb_20200315_1.htm': day1['pricespy_cpu_aaaaaa_20200314_1.htm'], 'userbenchmark_cpu_bbbbbb_20200315_1.htm': read_fixture('userbenchmark_us_20200309_1.htm')}
+	manifest = archive.put_run('cpu_20200315_bbbbbb', day2)
+	assert manifest['stats']['deduplicated'] == 1
+
+	reader = price.archive.Archive(storage, codec=codec)
+	assert reader.list_runs() == ['cpu_20200314_aaaaaa', 'cpu_20200315_bbbbbb']
+	manifest = reader.get_manifest('cpu_20200315_bbbbbb')
+	for name, data in day2.items():
+		assert reader.read_page(manifest, name) == data
+	assert reader.get_manifest('cpu_20200316_cccccc') is None
+
+def test_retrain(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	archive = price.archive.Archive(storage, codec='zlib')
+	manifest = archive.put_run('hdd_20200314_aaaaaa', {'pricespy_hdd_aaaaaa_20200314_1.htm': read_fixture('pricespy_hdd_20200314_1.htm')})
+	old_dictionary = manifest['pages']['pricespy_hdd_aaaaaa_20200314_1.htm']['dictionary']
+	assert archive.retrain() == old_dictionary # Same samples give the same dictionary
+	assert price.archive.Archive(storage, codec='zlib').read_page(manifest, 'pricespy_hdd_aaaaaa_20200314_1.htm') == read_fixture('pricespy_hdd_20200314_1.htm')
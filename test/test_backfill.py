@@ -0,0 +1,47 @@
+import gzip
+import json
+import os
+import price.backfill
+import price.scraper
+import shutil
+
+def test_discover():
+	names = [
+		'tmp/pricespy_cpu_abc123_20200314_1.htm',
+		'tmp/pricespy_cpu_abc123_20200314_2.htm',
+		'tmp/userbenchmark_cpu_abc123_20200314_1.htm',
+		'tmp/pricespy_cpu_zzz999_20200314_1.htm', # incomplete run
+		'tmp/pricespy_cpu_def456_20200315_1.htm',
+		'tmp/userbenchmark_cpu_def456_20200315_1.htm',
+		'tmp/pricespy_hdd_ghi789_20200314_1.htm',
+		'tmp/userbenchmark_hdd_ghi789_20200314.csv',
+		'tmp/chromedriver_cpu_abc123.log'
+	]
+	snapshots = price.backfill.discover(names, price.scraper.Type.CPU, end='20200314')
+	assert list(snapshots.keys()) == ['20200314']
+	assert snapshots['20200314'].run == 'abc123'
+	assert snapshots['20200314'].pricespy_files == {1: names[0], 2: names[1]}
+	hdd_snapshots = price.backfill.discover(names, price.scraper.Type.HDD)
+	assert hdd_snapshots['20200314'].userbenchmark_files == {1: 'tmp/userbenchmark_hdd_ghi789_20200314.csv'}
+
+def test_backfill(tmp_path):
+	mirror = tmp_path / 'mirror'
+	mirror.mkdir()
+	with open('test/pricespy_cpu_20200314_1.htm', 'rb') as f:
+		(mirror / 'pricespy_cpu_abc123_20200314_1.htm').write_bytes(gzip.compress(f.read()))
+	shutil.copy('test/userbenchmark_cpu_20200314_1.htm', mirror / 'userbenchmark_cpu_abc123_20200314_1.htm')
+	output_dir = tmp_path / 'web'
+	work_dir = tmp_path / 'work'
+
+	source = price.backfill.LocalArchiveSource(str(mirror))
+	checkpoint = price.backfill.backfill(source, price.scraper.Type.CPU, output_dir=str(output_dir), work_dir=str(work_dir), workers=1)
+	assert checkpoint['failed'] == {}
+	rows = checkpoint['completed']['20200314']['rows']
+	assert rows > 0
+	with open(output_dir / 'price_performance_cpu_20200314.json', 'r', encoding='utf-8') as f:
+		assert len(json.load(f)['data']) == rows
+
+	# Rerunning resumes from the checkpoint so there's nothing to do
+	os.remove(output_dir / 'price_performance_cpu_20200314.json')
+	price.backfill.backfill(source, price.scraper.Type.CPU, output_dir=str(output_dir), work_dir=str(work_dir), workers=1)
+	assert not os.path.isfile(output_dir / 'price_performance_cpu_20200314.json')
@@ -0,0 +1,45 @@
+import price.budget
+import price.scraper
+import time
+
+class FakeContext:
+
+	def __init__(self, remaining_ms):
+		self.remaining_ms = remaining_ms
+
+	def get_remaining_time_in_millis(self):
+		return self.remaining_ms
+
+def test_unlimited():
+	budget = price.budget.Budget()
+	assert budget.remaining() is None
+	assert budget.fetch_deadline() is None
+	assert budget.expired() == False
+	assert budget.timeout('wait') == 10
+	assert budget.can_retry(1, 'navigate', 'wait') == True
+	assert budget.can_retry(price.budget.MAX_ATTEMPTS, 'navigate') == False
+
+def test_from_context():
+	budget = price.budget.from_context(FakeContext(100000), reserve=20)
+	assert 99 < budget.remaining() <= 100
+	assert 79 < budget.fetch_remaining() <= 80
+	assert abs(budget.fetch_deadline() - (time.monotonic() + 80)) < 1
+	assert budget.timeout('navigate') == 30
+	assert budget.expired() == False
+
+def test_timeouts_clipped():
+	budget = price.budget.Budget(25, reserve=20)
+	assert 4 < budget.timeout('wait') <= 5 # Only 5 seconds left for fetching
+	assert budget.timeout('upload') == 10 # Uploads can use the reserve
+	assert budget.can_retry(1, 'navigate', 'wait') == False
+
+	budget = price.budget.Budget(10, reserve=20)
+	assert budget.expired() == True
+	assert budget.timeout('wait') == price.budget.MIN_TIMEOUT_SECONDS
+
+def test_scraper_budget():
+	budget = price.budget.Budget(60)
+	scraper = price.scraper.Scraper('test/pricespy_cpu_20200314', 'test/userbenchmark_cpu_20200314', None, price.scraper.Type.CPU, budget)
+	assert scraper.ps.budget is budget
+	assert scraper.ub.budget is budget
+	assert scraper.coverage() is None # Nothing downloaded
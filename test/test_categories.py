@@ -0,0 +1,106 @@
+import price.categories
+import price.helper
+import price.munger
+import price.pricespy
+import price.scraper
+import price.userbenchmark
+import pytest
+import threading
+import time
+
+def test_load():
+	categories = price.categories.load()
+	assert list(categories.keys()) == ['cpu', 'hdd']
+	assert [type.value for type in price.scraper.Type] == ['cpu', 'hdd']
+	assert price.scraper.Type.HDD.name == 'HDD'
+
+	cpu = categories['cpu']
+	assert cpu.price_max_pages == 10
+	assert cpu.price_window == 2
+	assert cpu.perf_max_pages == 4
+	assert cpu.perf_suffix() == ''
+	assert isinstance(cpu.create_munger(), price.munger.CpuMunger)
+	ub = cpu.create_perf_source(None)
+	assert isinstance(ub, price.userbenchmark.UserBenchmark)
+	assert ub.extra_column == '1-Core'
+
+	hdd = categories['hdd']
+	assert hdd.perf_suffix() == '.csv'
+	ps = hdd.create_price_source(None)
+	assert isinstance(ps, price.pricespy.PriceSpy)
+	assert ps.url == 'https://pricespy.co.nz/category.php?k=s332338236&catId=358'
+	ub = hdd.create_perf_source(None)
+	assert isinstance(ub, price.userbenchmark.UserBenchmarkCsv)
+	assert (ub.cache_days, ub.min_benchmark, ub.s3_cache_key) == (7, 42, 'tmp/HDD_UserBenchmarks.csv')
+
+def test_load_new_category(tmp_path):
+	file = tmp_path / 'categories.ini'
+	with open(price.categories.CATEGORIES_FILE, 'r', encoding='utf-8') as f:
+		file.write_text(f.read() + '\n[ssd]\nprice_url = https://example.com/ssd\nprice_title = SSD\nperf_source = userbenchmark_csv\n' +
+			'perf_url = https://example.com/SSD_UserBenchmarks.csv\nperf_cache_days = 1\nmunger = hdd\nenabled = false\n')
+	assert list(price.categories.load(str(file)).keys()) == ['cpu', 'hdd', 'ssd']
+	ssd = price.categories.get('ssd', str(file))
+	assert ssd.enabled == False
+	assert ssd.price_max_pages == 10
+	assert ssd.create_perf_source(None).s3_cache_key == 'tmp/SSD_UserBenchmarks.csv'
+
+def test_run_all():
+	class Item:
+		def __init__(self, value):
+			self.value = value
+	running = []
+	max_running = []
+	lock = threading.Lock()
+	def function(item):
+		with lock:
+			running.append(item.value)
+			max_running.append(len(running))
+		time.sleep(0.05)
+		with lock:
+			running.remove(item.value)
+		return item.value.upper()
+
+	price.helper.enable_tracing()
+	try:
+		with price.helper.span('scrape'):
+			results = price.categories.run_all([Item('a'), Item('b'), Item('c')], function, 2)
+		spans = price.helper.TRACER.summary()['spans']
+	finally:
+		price.helper.TRACER.reset()
+		price.helper.TRACER.enabled = False
+	assert results == ['A', 'B', 'C']
+	assert max(max_running) == 2
+	assert 'scrape/a' in spans and 'scrape/c' in spans
+
+def test_run_all_error():
+	class Item:
+		def __init__(self, value):
+			self.value = value
+	done = []
+	def function(item):
+		if item.value == 'a':
+			raise ValueError('boom')
+		done.append(item.value)
+	with pytest.raises(ValueError):
+		price.categories.run_all([Item('a'), Item('b')], function, 1)
+	assert done == ['b'] # Other categories still run
+
+def test_markets(tmp_path):
+	file = tmp_path / 'categories.ini'
+	with open(price.categories.CATEGORIES_FILE, 'r', encoding='utf-8') as f:
+		file.write_text(f.read().replace('munger = cpu\n', 'munger = cpu\nmarkets = nz uk\nprice_url.uk = https://example.com/uk/cpu\nprice_title.uk = CPUs UK\n'))
+	cpu = price.categories.get('cpu', str(file))
+	assert cpu.markets == ['nz', 'uk']
+	assert (cpu.data_key(), cpu.data_key('nz'), cpu.data_key('uk')) == ('cpu', 'cpu', 'cpu_uk')
+	assert cpu.create_price_source(None).url == price.categories.get('cpu').price_url
+	assert (cpu.create_price_source(None, 'uk').url, cpu.market('uk').price_title) == ('https://example.com/uk/cpu', 'CPUs UK')
+	with pytest.raises(Exception):
+		cpu.market('se')
+
+	scraper = price.scraper.Scraper('pricespy', 'userbenchmark', None, price.scraper.Type.CPU)
+	scraper.category = cpu
+	perf_data = [{'name': 'AMD Ryzen 5 3600', '1-core': 1, '2-core': 2, '8-core': 3, 'avg': 2.5, 'user-rating': 4}]
+	market_data = {'nz': [{'name': 'AMD Ryzen 5 3600 3.6GHz Socket AM4 Box', 'price': '$200.00'}], 'uk': [{'name': 'AMD Ryzen 5 3600 3.6GHz Socket AM4 Box', 'price': '£100.00'}]}
+	munged = scraper.munge_markets(market_data, perf_data)
+	assert list(munged.keys()) == ['nz', 'uk']
+	assert (munged['nz']['data'][0]['avg/$'], munged['uk']['data'][0]['avg/$']) == (0.013, 0.025)
@@ -0,0 +1,68 @@
+import os
+import price.checkpoint
+import price.pricespy
+import price.storage
+import price.synthetic
+import price.webdriver
+
+def test_checkpoint(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path / 'storage'))
+	key_prefix = price.checkpoint.key_prefix('20200314', 'cpu')
+	page_file = str(tmp_path / 'first_1.htm')
+	with open(page_file, 'w', encoding='utf-8') as f:
+		f.write('<body>1</body>')
+	checkpoint = price.checkpoint.Checkpoint(storage, key_prefix).source('pricespy')
+	checkpoint.done(1, 'https://example.com', page_file)
+	checkpoint.failed(2, 'https://example.com&offset=24', TimeoutError('Timed out'))
+
+	checkpoint = price.checkpoint.Checkpoint(storage, key_prefix) # A retry
+	assert checkpoint.done_pages() == ['pricespy/1']
+	retry_file = str(tmp_path / 'retry_1.htm')
+	assert checkpoint.restore('pricespy', 1, retry_file) # Different file name
+	assert not checkpoint.restore('pricespy', 2, str(tmp_path / 'retry_2.htm')) # Failed
+	assert not checkpoint.restore('userbenchmark', 1, str(tmp_path / 'ub_1.htm'))
+
+	os.remove(page_file)
+	os.remove(retry_file)
+	assert checkpoint.restore('pricespy', 1, retry_file) # From storage
+	with open(retry_file, 'r', encoding='utf-8') as f:
+		assert f.read() == '<body>1</body>'
+
+	checkpoint.clear()
+	assert storage.list(key_prefix + '/') == []
+	assert price.checkpoint.Checkpoint(storage, key_prefix).done_pages() == []
+
+"""A PriceSpy which 'downloads' synthetic pages and fails the pages in 'failing' once"""
+class FakePriceSpy(price.pricespy.PriceSpy):
+
+	def __init__(self, source_prefix, failing):
+		super().__init__(price.webdriver.FirefoxWebDriver('Selenium'), 'https://pricespy.co.nz/c', 'PriceSpy', page_size=price.synthetic.PRICESPY_PAGE_SIZE)
+		self.source_prefix = source_prefix
+		self.failing = set(failing)
+		self.downloaded = []
+
+	def _download(self, url, page_title, wait_until_css_selector, tag, webdriver=None):
+		page = 1 if url.find('&offset=') < 0 else int(url.split('&offset=')[1]) // self.page_size + 1
+		if page in self.failing:
+			self.failing.remove(page)
+			raise TimeoutError('Timed out loading page ' + str(page))
+		self.downloaded.append(page)
+		with open(self.source_prefix + '_' + str(page) + '.htm', 'r', encoding='utf-8') as f:
+			return f.read()
+
+def test_resume_download(tmp_path):
+	price.synthetic.generate_pricespy(str(tmp_path / 'source'), price.synthetic.PRICESPY_PAGE_SIZE * 4)
+	storage = price.storage.LocalStorage(str(tmp_path / 'storage'))
+	ps = FakePriceSpy(str(tmp_path / 'source'), [3])
+	ps.checkpoint = price.checkpoint.Checkpoint(storage, 'checkpoints/20200314_cpu').source('pricespy')
+	files = ps.download(str(tmp_path / 'first'), 4)
+	assert len(files) == 2
+	assert not ps.coverage.complete()
+
+	retry = FakePriceSpy(str(tmp_path / 'source'), [])
+	retry.checkpoint = price.checkpoint.Checkpoint(storage, 'checkpoints/20200314_cpu').source('pricespy')
+	files = retry.download(str(tmp_path / 'retry'), 4)
+	assert retry.downloaded == [3, 4] # Only the failed and missing pages
+	assert len(files) == 4
+	assert retry.coverage.complete()
+	assert len(retry.parse(*files)) == price.synthetic.PRICESPY_PAGE_SIZE * 4
@@ -0,0 +1,57 @@
+import price.chromebench
+import price.replay
+import price.webdriver
+import pytest
+
+def test_chrome_flags():
+	lambda_flags = price.webdriver.chrome_flags('lambda')
+	assert len(lambda_flags) == len(set(lambda_flags))
+	assert '--single-process' in lambda_flags
+	assert '--single-process' not in price.webdriver.chrome_flags('multi_process')
+	assert not [flag for flag in price.webdriver.chrome_flags('no_gl') if flag.startswith('--use-gl')]
+	with pytest.raises(ValueError):
+		price.webdriver.chrome_flags('turbo')
+	with pytest.raises(ValueError):
+		price.webdriver.ChromeWebDriver(flag_set='turbo')
+
+"""A webdriver.WebDriver whose 'browser' finds every element instantly, or fails to launch for the flag set 'broken'"""
+class FakeWebDriver:
+
+	def __init__(self, flag_set, loaded):
+		self.flag_set = flag_set
+		self.loaded = loaded
+
+	def getWebDriver(self):
+		if self.flag_set == 'broken':
+			raise Exception('Chrome failed to start')
+		return self
+
+	def get(self, url):
+		self.loaded.append((self.flag_set, url))
+
+	def find_element(self, by, value):
+		return value
+
+	def quit(self):
+		pass
+
+def test_run_and_rank():
+	server = price.replay.FixtureServer('test', '20200314').start()
+	try:
+		pages = price.chromebench.fixture_pages(server, 'cpu')
+	finally:
+		server.stop()
+	assert [name for name, url, selector in pages] == ['pricespy', 'userbenchmark']
+
+	loaded = []
+	results = price.chromebench.run(lambda flag_set, temp_dir: FakeWebDriver(flag_set, loaded), ['lambda', 'broken'], pages, runs=2, warmup=1)
+	assert [flag_set for flag_set, url in loaded] == ['lambda'] * 6 # Warmup included
+	assert len(results['lambda']) == 2
+	assert results['broken'] == [{'error': 'Chrome failed to start'}] * 2
+
+	results['lean'] = [{'launch_ms': 1, 'selector_ms': 1, 'total_ms': 2, 'peak_rss_mb': 100, 'cpu_ms': 5}]
+	results['lambda'] = [{'launch_ms': 5, 'selector_ms': 1, 'total_ms': 6, 'peak_rss_mb': 50, 'cpu_ms': 5}] * 2
+	ranking = price.chromebench.rank(results)
+	assert [(row['rank'], row['flag_set'], row['failures']) for row in ranking] == [(1, 'lean', 0), (2, 'lambda', 0), (3, 'broken', 2)]
+	text = price.chromebench.format(ranking)
+	assert text.splitlines()[2].split() == ['1', 'lean', '1', '1', '2', '100', '5', '0/1']
@@ -0,0 +1,32 @@
+import os
+import price.chromeprofile
+
+def test_restore(tmp_path):
+	user_data_dir = tmp_path / 'built'
+	(user_data_dir / 'Default' / 'Cache').mkdir(parents=True)
+	(user_data_dir / 'Default' / 'Cache' / 'data_0').write_bytes(b'cached')
+	(user_data_dir / 'Default' / 'Preferences').write_text('{}')
+	(user_data_dir / 'Local State').write_text('{}')
+	archive = str(tmp_path / 'chrome_profile.tar')
+	price.chromeprofile.archive(str(user_data_dir), archive)
+
+	profile = price.chromeprofile.ChromeProfile(archive)
+	restored_dir, cache_dir = profile.prepare(str(tmp_path / 'chrome'))
+	assert os.path.isfile(os.path.join(restored_dir, 'Default', 'Preferences'))
+	assert not os.path.exists(os.path.join(restored_dir, 'Default', 'Cache')) # Trimmed
+	assert os.path.isdir(cache_dir)
+
+	with open(os.path.join(restored_dir, 'Local State'), 'w') as f:
+		f.write('{"changed": true}') # Chrome updates the profile as it runs
+	assert profile.restore(restored_dir) == False # Not restored again
+	assert price.chromeprofile.ChromeProfile(None).restore(restored_dir) == False
+
+def test_evict(tmp_path):
+	for i in range(4):
+		path = tmp_path / 'index-dir' / ('entry' + str(i)) if i == 3 else tmp_path / ('entry' + str(i))
+		path.parent.mkdir(exist_ok=True)
+		path.write_bytes(b'x' * 100)
+		os.utime(path, (1000 + i, 1000 + i))
+	assert price.chromeprofile.evict(str(tmp_path), 250) == 200
+	assert sorted(os.listdir(tmp_path)) == ['entry2', 'index-dir'] # Least recently used first
+	assert price.chromeprofile.evict(str(tmp_path), 250) == 0
@@ -0,0 +1,24 @@
+import price.delta
+
+def data_file(rows, coverage=None):
+	result = {'data': rows, 'ranks': {'price': list(range(len(rows)))}, 'pareto': {}}
+	if coverage is not None:
+		result['coverage'] = coverage
+	return result
+
+def test_make_and_apply():
+	base = data_file([{'name': 'A', 'price': 1}, {'name': 'B', 'price': 2}, {'name': 'C', 'price': 3}], {'complete': False})
+	target = data_file([{'name': 'C', 'price': 3}, {'name': 'A', 'price': 5}, {'name': 'D', 'price': 4}])
+	delta = price.delta.make(base, target)
+	assert delta['rows'] == [2, [0, {'price': 5}], {'name': 'D', 'price': 4}]
+	assert delta['stats'] == {'unchanged': 1, 'changed': 1, 'added': 1, 'removed': 1}
+	assert delta['deleted_fields'] == ['coverage']
+	assert 'ranks' not in delta['fields'] # Same length so the same ranks
+	assert price.delta.apply(base, delta) == target
+	assert price.delta.apply(target, price.delta.make(target, base)) == base
+
+def test_duplicate_names_and_old_files():
+	base = data_file([{'name': 'A', 'price': 1}, {'name': 'A', 'price': 2}])
+	target = data_file([{'name': 'A', 'price': 2}, {'name': 'A', 'price': 2, 'avg': 9}])
+	assert price.delta.apply(base, price.delta.make(base, target)) == target
+	assert price.delta.make([{'name': 'A'}], target) is None
@@ -0,0 +1,75 @@
+import json
+import logging
+import price.helper
+
+def test_tracing_disabled():
+	price.helper.TRACER.enabled = False
+	price.helper.TRACER.reset()
+	with price.helper.span('parse'):
+		price.helper.count('rows', 10)
+	assert price.helper.TRACER.summary() == {'spans': {}, 'counters': {}}
+
+def test_tracing(tmp_path):
+	@price.helper.traced()
+	def munge():
+		price.helper.count('rows', 3)
+
+	price.helper.enable_tracing()
+	try:
+		with price.helper.span('cpu'):
+			for i in range(2):
+				with price.helper.span('parse'):
+					price.helper.count('rows', 24)
+			munge()
+		try:
+			with price.helper.span('upload'):
+				raise ValueError('S3 is down')
+		except ValueError:
+			pass
+		summary = price.helper.TRACER.emit(json_file=str(tmp_path / 'trace.json'))
+	finally:
+		price.helper.TRACER.enabled = False
+
+	assert sorted(summary['spans'].keys()) == ['cpu', 'cpu/munge', 'cpu/parse', 'upload']
+	assert summary['spans']['cpu/parse']['count'] == 2
+	assert summary['spans']['upload']['errors'] == 1
+	assert summary['counters'] == {'cpu/parse.rows': 48, 'cpu/munge.rows': 3}
+	with open(tmp_path / 'trace.json', 'r', encoding='utf-8') as f:
+		assert json.load(f) == summary
+
+def test_log_metrics(capsys):
+	price.helper.log_metrics('Trace', {'cpu/parse': 12.5, 'cpu/parse.rows': 48}, {'cpu/parse': 'Milliseconds', 'cpu/parse.rows': 'Count'})
+	record = json.loads(capsys.readouterr().out)
+	assert record['cpu/parse.rows'] == 48
+	assert record['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'PricePerformanceChart/Trace'
+	assert {'Name': 'cpu/parse', 'Unit': 'Milliseconds'} in record['_aws']['CloudWatchMetrics'][0]['Metrics']
+
+def test_get_logger():
+	logger = price.helper.get_logger('price.test_helper')
+	assert logger.name == 'price.test_helper'
+	assert price.helper.get_logger('price.test_helper') is logger
+	assert price.helper.LOGGERS.count(logger) == 1
+
+def test_log_report(caplog):
+	logger = price.helper.get_logger('price.test_helper')
+	built = []
+	def build():
+		built.append(True)
+		return 'Combined Data:\n a'
+	assert price.helper.log_report(logger, logging.DEBUG, 'munge', build, combined=1) == False
+	assert built == [] # Not built when DEBUG is off
+
+	price.helper.set_log_level(logging.DEBUG)
+	try:
+		with caplog.at_level(logging.DEBUG, logger='price.test_helper'):
+			price.helper.enable_log_queue()
+			try:
+				assert price.helper.log_report(logger, logging.DEBUG, 'munge', build, combined=1) == True
+				price.helper.flush_logs()
+			finally:
+				price.helper.disable_log_queue()
+	finally:
+		price.helper.set_log_level(logging.INFO)
+	record = caplog.records[-1]
+	assert (record.getMessage(), record.report, record.fields) == ('Combined Data:\n a', 'munge', {'combined': 1})
+	assert built == [True]
@@ -0,0 +1,24 @@
+import os
+import price.lambda_scraper
+import sys
+
+def test_link_layer(tmp_path):
+	layer_dir = tmp_path / 'opt'
+	(layer_dir / 'lib').mkdir(parents=True)
+	(layer_dir / 'fonts.conf').write_text('<fontconfig/>')
+	for file_name in price.lambda_scraper.LIBRARY_LINKS.values():
+		(layer_dir / 'lib' / file_name).write_text(file_name)
+	tmp_dir = tmp_path / 'tmp'
+
+	price.lambda_scraper.link_layer(str(layer_dir), str(tmp_dir))
+	price.lambda_scraper.link_layer(str(layer_dir), str(tmp_dir)) # Warm starts reuse /tmp
+	assert os.path.islink(tmp_dir / 'fonts.conf')
+	assert (tmp_dir / 'fonts.conf').read_text() == '<fontconfig/>'
+	assert os.path.islink(tmp_dir / 'lib' / 'libX11.so.6.3.0')
+	assert (tmp_dir / 'lib' / 'libX11.so.6').read_text() == 'libX11.so.6.3.0'
+	assert os.readlink(tmp_dir / 'lib' / 'libxcb.so.1') == str(layer_dir / 'lib' / 'libxcb.so.1.1.0')
+
+def test_import_is_lazy():
+	# Importing the entry point shouldn't have created the handler or storage
+	assert price.lambda_scraper._LAMBDA_HANDLER is None
+	assert 'price.storage' not in sys.modules or sys.modules['price.storage']._STORAGE is None
@@ -0,0 +1,35 @@
+import price.helper
+import price.memory
+import subprocess
+import sys
+
+def test_read_rss():
+	assert price.memory.read_rss() > 0
+	assert price.memory.read_rss(999999999) == 0
+
+def test_descendant_pids():
+	child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)'])
+	try:
+		assert child.pid in price.memory.descendant_pids()
+	finally:
+		child.kill()
+		child.wait()
+
+def test_stage_high_water_marks():
+	price.helper.enable_tracing()
+	try:
+		sampler = price.memory.MemorySampler(interval=0.01).start()
+		with price.helper.span('cpu'):
+			with price.helper.span('parse'):
+				data = bytearray(64 * 1048576)
+			del data
+			with price.helper.span('munge'):
+				pass
+		report = sampler.stop()
+	finally:
+		price.helper.TRACER.reset()
+		price.helper.TRACER.enabled = False
+	assert set(report.keys()) == {'run', 'cpu/parse', 'cpu/munge'}
+	assert report['cpu/parse']['python_rss'] >= 64
+	assert report['run']['total_rss'] >= report['cpu/parse']['python_rss']
+	assert 'cpu/parse' in price.memory.format(report)
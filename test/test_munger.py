@@ -110,3 +110,121 @@ def test_hdd_munge():
 	assert 0 == len(munge_result['orphan_perf_data'])
 	assert 1 == len(munge_result['orphan_price_data'])
 	assert munge_result['orphan_price_data'][0]['name'] == 'HGST Ultrastar 7K6000 HUS726T4TALE6L4 256MB 4TB'
+
+def test_rank_indexes():
+	data = [
+		{'name': 'a', 'price': '$1,200.00', 'avg/$': 0.5},
+		{'name': 'b', 'price': '$300.00', 'avg/$': None},
+		{'name': 'c', 'price': '$99.50', 'avg/$': 0.9},
+		{'name': 'd', 'price': '$300.00', 'avg/$': 0.5}
+	]
+	assert price.munger.rank_indexes(data, 'price', ascending=True) == [2, 1, 3, 0]
+	assert price.munger.rank_indexes(data, 'avg/$') == [2, 0, 3, 1]
+
+def test_pareto_frontier():
+	data = [
+		{'name': 'cheap slow', 'price': '$100', 'avg': 50},
+		{'name': 'cheap slower', 'price': '$100', 'avg': 40}, # dominated by same price but faster
+		{'name': 'mid', 'price': '$200', 'avg': 70},
+		{'name': 'mid overpriced', 'price': '$250', 'avg': 70}, # dominated by cheaper and just as fast
+		{'name': 'fast', 'price': '$500', 'avg': 90},
+		{'name': 'fast twin', 'price': '$500', 'avg': 90}, # identical so not dominated
+		{'name': 'no perf', 'price': '$10', 'avg': None}
+	]
+	assert price.munger.pareto_frontier(data, 'avg') == [0, 2, 4, 5]
+
+def test_cpu_munge_ranks_and_pareto():
+	price_data = [
+		{'name': 'AMD Ryzen 5 3600 3.6GHz Socket AM4 Box', 'price': '$300'},
+		{'name': 'AMD Ryzen 5 3600X 3.8GHz Socket AM4 Box', 'price': '$400'},
+		{'name': 'AMD Ryzen 5 3500 3.6GHz Socket AM4 Box', 'price': '$350'}
+	]
+	perf_data = [
+		{'name': 'AMD Ryzen 5 3600', '1-core': '100', '2-core': None, '8-core': '600', 'avg': 80, 'user-rating': '90'},
+		{'name': 'AMD Ryzen 5 3600X', '1-core': '110', '2-core': None, '8-core': '650', 'avg': 85, 'user-rating': '80'},
+		{'name': 'AMD Ryzen 5 3500', '1-core': '95', '2-core': None, '8-core': '500', 'avg': 75, 'user-rating': '70'}
+	]
+	munge_result = price.munger.CpuMunger().munge(price_data, perf_data)
+	names = [row['name'][:17] for row in munge_result['data']]
+	assert names == ['AMD Ryzen 5 3500 ', 'AMD Ryzen 5 3600 ', 'AMD Ryzen 5 3600X']
+	assert munge_result['ranks']['price'] == [1, 0, 2]
+	assert munge_result['ranks']['avg/$'] == [1, 0, 2]
+	assert munge_result['ranks']['2-core/$'] == [0, 1, 2]
+	assert munge_result['pareto']['avg'] == [1, 2] # 3500 is more expensive and slower than the 3600
+	assert munge_result['pareto']['2-core'] == []
+
+	data_file = price.munger.to_data_file(munge_result)
+	assert sorted(data_file.keys()) == ['data', 'pareto', 'ranks']
+	data_file = price.munger.to_data_file(munge_result, {'complete': False, 'pricespy': None, 'userbenchmark': None})
+	assert data_file['coverage']['complete'] == False
+
+def test_hdd_munge_reuses_match_table():
+	m = price.munger.HddMunger()
+	price_data = [
+		{'name': 'WD Blue WD10EZEX 64MB 1TB', 'price': '$74.00'},
+		{'name': 'Seagate Barracuda ST1000DM003 64MB 1TB', 'price': '$85.10'},
+		{'name': 'HGST Ultrastar 7K6000 HUS726T4TALE6L4 256MB 4TB', 'price': '$326.63'}
+	]
+	perf_data = [
+		{'brand':'WD', 'mfg_code': 'WD10EZEX', 'model': 'Blue 1TB (2012)', 'samples': 1471343, 'avg': 82.3},
+		{'brand': 'Seagate', 'mfg_code': 'ST1000DM003', 'model': 'Barracuda 7200.14 1TB', 'samples': 912952, 'avg': 88.2}
+	]
+	full_result = m.munge(price_data, perf_data)
+	assert full_result['stats'] == {'reused': 0, 'recomputed': 3}
+
+	# Next run has one new product and one price change
+	price_data[0]['price'] = '$70.00'
+	price_data.append({'name': 'WD Black WD1003FZEX 64MB 1TB', 'price': '$120.00'})
+	perf_data.append({'brand':'WD', 'mfg_code': 'WD1003FZEX', 'model': 'Black 1TB', 'samples': 10000, 'avg': 90.1})
+	match_table = price.munger.MatchTable.from_json(full_result['match_table'].to_json(), m.RULES_VERSION)
+	incremental_result = m.munge(price_data, perf_data, match_table)
+	assert incremental_result['stats'] == {'reused': 3, 'recomputed': 1}
+	rebuilt_result = m.munge(price_data, perf_data)
+	assert rebuilt_result['stats'] == {'reused': 0, 'recomputed': 4}
+	for key in ['data', 'orphan_price_data', 'orphan_perf_data', 'ranks', 'pareto']:
+		assert incremental_result[key] == rebuilt_result[key]
+
+def test_match_table_rules_version():
+	table = price.munger.MatchTable('cpu-1')
+	assert table.resolve('a', lambda x: x.upper()) == 'A'
+	assert price.munger.MatchTable.from_json(table.to_json(), 'cpu-1').matches == {'a': 'A'}
+	assert price.munger.MatchTable.from_json(table.to_json(), 'cpu-2').matches == {}
+	assert price.munger.MatchTable.from_json(None, 'cpu-1').matches == {}
+
+def test_hdd_parse_pricespy_names():
+	m = price.munger.HddMunger()
+	names = ['WD Black WD1003FZEX 64MB 1TB', 'Seagate SkyHawk AI Surveillance ST4000VE001 256MB 4TB', 'WD Black WD1003FZEX 64MB 1TB']
+	assert m.parse_pricespy_names(names) == [m._parse_pricespy_name(name) for name in names]
+
+	derived = []
+	def derive_all(names):
+		derived.append(names)
+		return m.parse_pricespy_names(names)
+	table = price.munger.MatchTable(m.RULES_VERSION, {names[1]: m._parse_pricespy_name(names[1])})
+	values = table.resolve_all(names, derive_all)
+	assert derived == [[names[0]]] # Derived once, only for the name not in the table
+	assert [value['mfg_code'] for value in values] == ['WD1003FZEX', 'ST4000VE001', 'WD1003FZEX']
+	assert table.stats() == {'reused': 1, 'recomputed': 2}
+	values[0]['price'] = '$1'
+	assert 'price' not in table.seen[names[0]] # Copies are returned
+
+def test_cpu_match_shared_perf_index():
+	perf_data = [
+		{'name': 'AMD Ryzen 5 3600', '1-core': 1, '2-core': 2, '8-core': 3, 'avg': 2.5, 'user-rating': 4},
+		{'name': 'AMD Ryzen 5 3600X', '1-core': 1.5, '8-core': 3.5, 'avg': 3, 'user-rating': 4.5}
+	]
+	m = price.munger.CpuMunger()
+	perf_index = m.build_perf_index(perf_data)
+	nz = m.match([{'name': 'AMD Ryzen 5 3600 3.6GHz Socket AM4 Box', 'price': '$200.00'}], perf_index)
+	uk = m.match([{'name': 'AMD Ryzen 5 3600X 3.8GHz Socket AM4 Box', 'price': '£150.00'}], perf_index)
+	assert [row['name'] for row in nz['orphan_perf_data']] == ['AMD Ryzen 5 3600X']
+	assert [row['name'] for row in uk['orphan_perf_data']] == ['AMD Ryzen 5 3600'] # The first market's match didn't use up the index
+	assert uk['data'][0]['avg/$'] == 0.02
+	assert perf_index['rows'] == perf_data # Left as it was
+	se = m.match([{'name': 'AMD Ryzen 5 3600X 3.8GHz Socket AM4 Box', 'price': '1\xa0999,00\xa0kr'}], perf_index)
+	assert se['data'][0]['avg/$'] == 0.002 # Comma decimals, i.e. 1999 kr
+
+def test_to_number():
+	values = ['$1,099.00', '£1,099', '1 999,00 kr', '1.999,00 €', '1,099,000', '12,5', '$164.85', '1.299 €', '12.500 kr', '1.099.000', '0.5']
+	assert [price.munger._to_number(value) for value in values] == [1099, 1099, 1999, 1999, 1099000, 12.5, 164.85, 1299, 12500, 1099000, 0.5]
+	assert price.munger._to_number('') is None
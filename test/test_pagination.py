@@ -0,0 +1,113 @@
+import os
+import price.pagination
+import price.pricespy
+import pytest
+import threading
+import time
+
+"""Returns fetch_page() and products_of() functions for a fake source with the given pages of product names, pages past the end repeat the last"""
+def fake_source(tmp_path, pages):
+	fetched = []
+	lock = threading.Lock()
+	def fetch_page(page, slot):
+		with lock:
+			fetched.append((page, slot))
+		path = str(tmp_path / 'page_{}.txt'.format(page))
+		with open(path, 'w') as f:
+			f.write('\n'.join(pages[min(page, len(pages)) - 1]))
+		return path
+	def products_of(path):
+		with open(path, 'r') as f:
+			return [line for line in f.read().split('\n') if line != '']
+	return fetch_page, products_of, fetched
+
+PAGES = [['a', 'b'], ['c', 'd'], ['e']]
+
+def test_fetch_pages_exhausted(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	coverage = price.pagination.Coverage(10)
+	paths = price.pagination.fetch_pages(fetch_page, products_of, coverage, window=2)
+	assert [os.path.basename(path) for path in paths] == ['page_1.txt', 'page_2.txt', 'page_3.txt']
+	assert sorted(fetched) == [(1, 0), (2, 1), (3, 0), (4, 1)]
+	assert not os.path.exists(str(tmp_path / 'page_4.txt')) # Repeat of page 3 is discarded
+	assert coverage.stats() == {'pages': 4, 'kept_pages': 3, 'products': 5, 'stopped': 'exhausted', 'complete': True}
+
+def test_fetch_pages_short_page(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	def empty_past_end(page, slot): # Like a PriceSpy page past the end, which times out waiting for product cards
+		if page > len(PAGES):
+			fetched.append((page, slot))
+			raise Exception('Timed out')
+		return fetch_page(page, slot)
+	coverage = price.pagination.Coverage(10, page_size=2)
+	paths = price.pagination.fetch_pages(empty_past_end, products_of, coverage, window=2)
+	assert [os.path.basename(path) for path in paths] == ['page_1.txt', 'page_2.txt', 'page_3.txt']
+	assert sorted(fetched) == [(1, 0), (2, 1), (3, 0), (4, 1)] # Page 4 was in page 3's window
+	assert coverage.stats() == {'pages': 3, 'kept_pages': 3, 'products': 5, 'stopped': 'exhausted', 'complete': True}
+
+	fetched.clear()
+	coverage = price.pagination.Coverage(10, page_size=2)
+	paths = price.pagination.fetch_pages(empty_past_end, products_of, coverage)
+	assert len(paths) == 3
+	assert [page for page, slot in fetched] == [1, 2, 3] # Short page 3 is the last
+	assert coverage.complete() == True
+
+def test_fetch_pages_max_pages(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	coverage = price.pagination.Coverage(2)
+	paths = price.pagination.fetch_pages(fetch_page, products_of, coverage, window=3)
+	assert len(paths) == 2
+	assert len(fetched) == 2 # Window is limited to the pages left
+	assert coverage.stop_reason() == 'max_pages'
+
+def test_fetch_pages_target(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	coverage = price.pagination.Coverage(10, target_products=3)
+	paths = price.pagination.fetch_pages(fetch_page, products_of, coverage)
+	assert len(paths) == 2
+	assert coverage.stats()['products'] == 4
+	assert coverage.stop_reason() == 'target'
+
+def test_coverage_deadline():
+	coverage = price.pagination.Coverage(10, deadline=time.monotonic() - 1)
+	assert coverage.stop_reason() is None # Page 1 is always fetched
+	coverage.add_page(['a'])
+	assert coverage.stop_reason() == 'deadline'
+	assert coverage.complete() == False
+	coverage = price.pagination.Coverage(10, deadline=time.monotonic() + 60)
+	coverage.add_page(['a'])
+	assert coverage.stop_reason() is None
+	coverage.end()
+	assert coverage.stop_reason() == 'exhausted'
+	assert coverage.complete() == True
+
+def test_fetch_pages_error(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	def failing_fetch_page(page, slot):
+		if page == 2:
+			raise Exception('Timed out')
+		return fetch_page(page, slot)
+	coverage = price.pagination.Coverage(10)
+	paths = price.pagination.fetch_pages(failing_fetch_page, products_of, coverage, window=3)
+	assert [os.path.basename(path) for path in paths] == ['page_1.txt'] # Page 3 is discarded to keep the numbering contiguous
+	assert not os.path.exists(str(tmp_path / 'page_3.txt'))
+	assert coverage.stats()['stopped'] == 'error'
+	assert coverage.complete() == False
+
+	with pytest.raises(Exception): # Nothing to keep if page 1 fails
+		price.pagination.fetch_pages(lambda page, slot: failing_fetch_page(page + 1, slot), products_of, price.pagination.Coverage(10))
+
+def test_drop_duplicate_pages(tmp_path):
+	fetch_page, products_of, fetched = fake_source(tmp_path, PAGES)
+	paths = [fetch_page(page, 0) for page in range(1, 6)]
+	assert price.pagination.drop_duplicate_pages(paths, products_of) == paths[:3]
+
+def test_parse_file_cached():
+	ps = price.pricespy.PriceSpy(None)
+	first = ps.parse_file('test/pricespy_cpu_20200314_1.htm')
+	first[0]['name'] = 'Changed'
+	second = ps.parse_file('test/pricespy_cpu_20200314_1.htm')
+	assert len(second) == 24
+	assert second[0]['name'] != 'Changed' # Callers get copies
+	assert len(ps.parsed) == 1
+	assert ps.product_names('test/pricespy_cpu_20200314_1.htm') == [product['name'] for product in second]
@@ -1,5 +1,6 @@
 import bs4
 import os
+import price.categories
 import price.pricespy
 import pytest
 
@@ -16,6 +17,15 @@ def test_parse():
 	assertPrice('Intel Core i9 9900KF 3.6GHz Socket 1151-2 Box without Cooler', '$810.00', data[22])
 	assertPrice('Intel Core i9-9900KS Special Edition 4.0GHz Socket 1151-2 Box without Cooler', '$1,099.00', data[23])
 
+def test_defaults():
+	cpu = price.categories.get('cpu')
+	ps = price.pricespy.PriceSpy(None)
+	assert (ps.url, ps.page_title) == (cpu.price_url, cpu.price_title)
+	hdd = price.categories.get('hdd')
+	ps_hdd = price.pricespy.PriceSpyHdd(None)
+	assert (ps_hdd.url, ps_hdd.page_title) == (hdd.price_url, hdd.price_title)
+	assert price.pricespy.PriceSpy(None, 'https://pricespy.co.uk/c', 'UK').url == 'https://pricespy.co.uk/c'
+
 def assertPrice(expected_name, expected_price, actual):
 	assert expected_name == actual['name']
 	assert expected_price == actual['price']
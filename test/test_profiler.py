@@ -0,0 +1,21 @@
+import os
+import price.helper
+import price.profiler
+
+def test_profile_stages(tmp_path):
+	profiler = price.profiler.Profiler(str(tmp_path)).start()
+	try:
+		with price.helper.span('cpu'):
+			with price.helper.span('parse'):
+				with price.helper.span('munge'): # Nested stages are part of the outer stage's profile
+					sorted(str(i) for i in range(1000))
+			with price.helper.span('serialise'): # Not a stage
+				pass
+	finally:
+		files = profiler.stop()
+		price.helper.TRACER.enabled = False
+
+	assert sorted(os.path.basename(file) for file in files) == ['cpu_parse.alloc.txt', 'cpu_parse.pstats', 'hotspots.txt']
+	with open(tmp_path / 'hotspots.txt', 'r', encoding='utf-8') as f:
+		assert f.read().startswith('Stage cpu/parse took')
+	assert price.helper.TRACER.listeners == []
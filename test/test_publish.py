@@ -0,0 +1,82 @@
+import concurrent.futures
+import gzip
+import json
+import price.delta
+import price.publish
+import price.storage
+import pytest
+
+def test_publish(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	manifest = price.publish.publish(storage, 'static', 'cpu', '20200314', '[1]')
+	assert manifest['generation'] == 1
+	cpu_file = manifest['categories']['cpu']['file']
+	assert cpu_file == price.publish.data_file_name('cpu', '20200314', b'[1]')
+	assert storage.head('static/' + cpu_file).content_encoding == 'gzip'
+
+	manifest = price.publish.publish(storage, 'static', 'hdd', '20200314', '[2]')
+	assert manifest['generation'] == 2
+	assert sorted(manifest['categories'].keys()) == ['cpu', 'hdd'] # Other categories are kept
+	assert price.publish.get_manifest(storage, 'static')[0] == manifest
+	assert storage.get('static/latest_hdd.js').text() == 'var LATEST_HDD_DATA_FILE="' + manifest['categories']['hdd']['file'] + '";'
+
+	entry, json_data = price.publish.read_latest(storage, 'static', 'cpu')
+	assert (entry['file'], json_data) == (cpu_file, '[1]')
+	assert price.publish.read_latest(storage, 'static', 'gpu') == (None, None)
+
+def test_rollback(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	first = price.publish.publish(storage, '', 'cpu', '20200314', '[1]', compress=False)
+	price.publish.publish(storage, '', 'hdd', '20200314', '[2]', compress=False)
+	price.publish.publish(storage, '', 'cpu', '20200315', '[3]', compress=False)
+
+	manifest = price.publish.rollback(storage, '', type_value='cpu') # Just CPU from generation 2, i.e. still the first file
+	assert (manifest['generation'], manifest['rollback_of']) == (4, 2)
+	assert manifest['categories']['cpu'] == first['categories']['cpu']
+	assert 'hdd' in manifest['categories']
+	assert price.publish.rollback(storage, '', 1)['categories'] == first['categories']
+	with pytest.raises(ValueError):
+		price.publish.rollback(storage, '', 99)
+
+def test_concurrent_publishes(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	types = ['cpu', 'hdd', 'ssd', 'gpu']
+	with concurrent.futures.ThreadPoolExecutor(len(types)) as executor:
+		list(executor.map(lambda type_value: price.publish.publish(storage, '', type_value, '20200314', '["' + type_value + '"]'), types))
+	manifest = price.publish.get_manifest(storage, '')[0]
+	assert manifest['generation'] == len(types)
+	assert sorted(manifest['categories'].keys()) == sorted(types) # No publish lost another's entry
+	assert [price.publish.get_generation(storage, '', generation)['generation'] for generation in range(1, len(types) + 1)] == [1, 2, 3, 4]
+
+def test_build_chart(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	price.publish.publish(storage, '', 'hdd', '20200314', '[2]', compress=False)
+	page = storage.get(price.publish.CHART_NAME).text()
+	assert '"generation": 1' in page
+	assert 'var BOOTSTRAP = null;' not in page
+
+	manifest = price.publish.publish(storage, '', 'cpu', '20200314', '{"data": ["</script>"]}')
+	page = storage.get(price.publish.CHART_NAME)
+	assert page.content_encoding == 'gzip'
+	assert b'"data": {"cpu": {"data": ["<\\/script>"]}}' in gzip.decompress(page.data) # Inlined without closing the script
+	assert price.publish.build_chart(storage, '', dict(manifest, generation=1)) == False # Older generation doesn't replace the newer page
+
+def test_delta_chain(tmp_path, monkeypatch):
+	monkeypatch.setattr(price.publish, 'MAX_DELTA_CHAIN', 2)
+	storage = price.storage.LocalStorage(str(tmp_path))
+	rows = [{'name': 'Product ' + str(i), 'price': i} for i in range(20)]
+	days = []
+	for day in range(4):
+		rows[day]['price'] += 100
+		days.append({'data': [dict(row) for row in rows], 'ranks': {}, 'pareto': {}})
+		entry = price.publish.publish(storage, '', 'cpu', '2020031' + str(day), json.dumps(days[-1]))['categories']['cpu']
+	assert len(entry['deltas']) == 2 # Chain is limited
+	data = days[1] # A visitor who last came on day 1 only needs the last 2 deltas
+	assert entry['deltas'][0]['base'] == price.publish.get_generation(storage, '', 2)['categories']['cpu']['sha256']
+	for delta in entry['deltas']:
+		data = price.delta.apply(data, json.loads(gzip.decompress(storage.get(delta['file']).data)))
+	assert data == days[3]
+
+	rows = [{'name': 'New ' + str(i), 'price': i} for i in range(20)] # Everything changed so a delta isn't worth it
+	entry = price.publish.publish(storage, '', 'cpu', '20200320', json.dumps({'data': rows, 'ranks': {}, 'pareto': {}}))['categories']['cpu']
+	assert entry['deltas'] == []
@@ -0,0 +1,40 @@
+import price.replay
+import pytest
+
+@pytest.fixture
+def server():
+	server = price.replay.FixtureServer('test', '20200314').start()
+	yield server
+	server.stop()
+
+def test_fixture_server(server):
+	status, content_type, body = server.respond('/pricespy/cpu?k=replay&offset=48')
+	assert status == 200
+	assert b'<title>Find the best deals on CPUs' in body # Page 3 repeats the last recorded page
+	assert server.respond('/pricespy/gpu?k=replay')[0] == 404
+
+	browser = price.replay.HttpWebDriver().getWebDriver()
+	browser.get(server.category('cpu').perf_url)
+	assert 'CPU UserBenchmarks' in browser.title
+	assert len(browser.find_elements('css selector', 'tr[class="hovertarget "]')) == 50
+	assert browser.find_elements('xpath', '//th') == []
+
+	assert server.missing('cpu') == []
+	assert server.missing('hdd') == ['userbenchmark_hdd_20200314.csv']
+	assert price.replay.main(['hdd', '--runs', '1']) == 2 # Not recorded so fails before running
+
+def test_run_once(server):
+	result = price.replay.run_once(server, 'cpu')
+	assert result['rows'] == 17
+	assert result['coverage']['complete'] == True
+	assert sorted(result['stages'].keys()) == sorted(price.replay.STAGES)
+	assert result['stages']['download']['wall_ms'] > 0
+
+def test_compare():
+	baseline = price.replay.summarise([{'stages': {'parse': {'wall_ms': ms, 'cpu_ms': ms, 'peak_rss_mb': 50}}} for ms in [100, 102, 98, 101]])
+	slower = price.replay.summarise([{'stages': {'parse': {'wall_ms': ms, 'cpu_ms': ms * 0.5, 'peak_rss_mb': 50}}} for ms in [130, 128, 133, 131]])
+	verdicts = {row['metric']: row['verdict'] for row in price.replay.compare(baseline, slower)}
+	assert verdicts == {'wall_ms': 'regressed', 'cpu_ms': 'improved', 'peak_rss_mb': 'same'}
+
+	noisy = price.replay.summarise([{'stages': {'parse': {'wall_ms': ms, 'cpu_ms': ms, 'peak_rss_mb': 50}}} for ms in [60, 200, 90, 150]])
+	assert price.replay.compare(baseline, noisy)[0]['verdict'] == 'same' # Median moved but it's noise
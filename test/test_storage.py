@@ -0,0 +1,58 @@
+import boto3
+import botocore.stub
+import io
+import price.storage
+import pytest
+
+def test_local_storage(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	etag = storage.put('tmp/a.txt', 'hello world', content_type='text/plain', metadata={'codec': 'zlib'})
+	obj = storage.get('tmp/a.txt')
+	assert (obj.data, obj.etag, obj.size, obj.content_type, obj.metadata) == (b'hello world', etag, 11, 'text/plain', {'codec': 'zlib'})
+	assert storage.head('tmp/a.txt').etag == etag
+	assert storage.get('tmp/a.txt', byte_range=(6, None)).data == b'world'
+	assert storage.get('tmp/a.txt', byte_range=(0, 4)).data == b'hello'
+	assert b''.join(storage.stream('tmp/a.txt', chunk_size=4)) == b'hello world'
+	assert storage.get('missing') is None
+	assert storage.head('missing') is None
+	with pytest.raises(price.storage.NotFound):
+		list(storage.stream('missing'))
+
+	storage.put('tmp/b/c.txt', b'c')
+	assert [obj.key for obj in storage.list('tmp/')] == ['tmp/a.txt', 'tmp/b/c.txt'] # Sidecars aren't listed
+	assert storage.list('other/') == []
+	storage.delete('tmp/b/c.txt')
+	assert [obj.key for obj in storage.list()] == ['tmp/a.txt']
+
+def test_local_storage_conditional(tmp_path):
+	storage = price.storage.LocalStorage(str(tmp_path))
+	etag = storage.put('key', b'v1', if_none_match='*')
+	with pytest.raises(price.storage.PreconditionFailed):
+		storage.put('key', b'v2', if_none_match='*') # Already exists
+	with pytest.raises(price.storage.NotModified):
+		storage.get('key', if_none_match=etag)
+
+	new_etag = storage.put('key', b'v2', if_match=etag)
+	assert storage.get('key', if_none_match=etag).data == b'v2'
+	with pytest.raises(price.storage.PreconditionFailed):
+		storage.put('key', b'v3', if_match=etag) # Changed since it was read
+	assert storage.get('key').etag == new_etag
+
+def test_s3_storage():
+	client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+	storage = price.storage.S3Storage('bucket', client=client)
+	with botocore.stub.Stubber(client) as stubber:
+		stubber.add_response('get_object', {'Body': io.BytesIO(b'ell'), 'ETag': '"abc"', 'ContentLength': 3, 'ContentRange': 'bytes 1-3/5'}, {'Bucket': 'bucket', 'Key': 'a', 'Range': 'bytes=1-3'})
+		stubber.add_client_error('get_object', 'NoSuchKey', http_status_code=404)
+		stubber.add_client_error('get_object', '304', http_status_code=304, expected_params={'Bucket': 'bucket', 'Key': 'a', 'IfNoneMatch': '"abc"'})
+		stubber.add_client_error('put_object', 'PreconditionFailed', http_status_code=412, expected_params={'Body': b'x', 'Bucket': 'bucket', 'Key': 'a', 'IfNoneMatch': '*'})
+		stubber.add_client_error('head_object', '404', http_status_code=404)
+
+		obj = storage.get('a', byte_range=(1, 3))
+		assert (obj.data, obj.etag, obj.size) == (b'ell', '"abc"', 5)
+		assert storage.get('missing') is None
+		with pytest.raises(price.storage.NotModified):
+			storage.get('a', if_none_match='"abc"')
+		with pytest.raises(price.storage.PreconditionFailed):
+			storage.put('a', b'x', if_none_match='*')
+		assert storage.head('missing') is None
@@ -0,0 +1,30 @@
+import price.pricespy
+import price.synthetic
+import price.userbenchmark
+import price.webdatasource
+
+def test_generate_pricespy(tmp_path):
+	files, expected = price.synthetic.generate_pricespy(str(tmp_path / 'pricespy'), 60, page_size=24, chrome_bytes=2000)
+	assert len(files) == 3
+	assert len(expected) == 60
+	assert price.pricespy.PriceSpy(None).parse(*files) == expected
+	assert price.synthetic.generate_pricespy(str(tmp_path / 'again'), 60, chrome_bytes=2000)[1] == expected # Seeded
+
+def test_generate_userbenchmark(tmp_path):
+	files, expected = price.synthetic.generate_userbenchmark(str(tmp_path / 'userbenchmark'), 120, chrome_bytes=2000)
+	assert len(files) == 3
+	assert price.userbenchmark.UserBenchmark(None).parse(*files) == expected
+	assert expected[0]['2-core'] is not None
+
+def test_benchmark(tmp_path):
+	assert 'html.parser' in price.webdatasource.available_parsers()
+	files, expected = price.synthetic.generate_pricespy(str(tmp_path / 'pricespy'), 48, chrome_bytes=2000)
+	def create_source(parser):
+		source = price.pricespy.PriceSpy(None)
+		source.parser = parser
+		return source
+	results = price.synthetic.benchmark(files, create_source, repeat=1)
+	assert [result['parser'] for result in results] == price.webdatasource.available_parsers()
+	assert results[0]['rows'] == 48
+	assert results[0]['rows_per_second'] > 0
+	assert 'html.parser' in price.synthetic.format('PriceSpy', results)
@@ -0,0 +1,120 @@
+import copy
+import json
+import price.categories
+import price.tasks
+import pytest
+
+ATTEMPTS = {}
+
+def handler(task, store):
+	ATTEMPTS[task.id] = ATTEMPTS.get(task.id, 0) + 1
+	if task.id == 'cpu/pricespy/2' and ATTEMPTS[task.id] == 1:
+		raise Exception('Flaky page')
+	if task.kind == 'munge':
+		names = [name for dep in task.deps for name in price.tasks.get_result(store, dep) or []]
+		store.put('munged_' + task.type_value, ','.join(names).encode('utf-8'))
+		return None
+	name = task.id.replace('/', '_')
+	store.put(name, b'page')
+	return [name]
+
+"""Returns the categories (defaults to all) limited to 3 PriceSpy pages"""
+def categories(*values):
+	result = []
+	for value, category in price.categories.load().items():
+		if len(values) == 0 or value in values:
+			category = copy.copy(category)
+			category.price_max_pages = 3
+			result.append(category)
+	return result
+
+def failing_handler(task, store):
+	if task.id == 'hdd/userbenchmark':
+		raise Exception('Down')
+	return handler(task, store)
+
+def test_plan():
+	tasks = price.tasks.plan(categories())
+	ids = [task.id for task in tasks]
+	assert ids == ['cpu/pricespy/1', 'cpu/pricespy/2', 'cpu/pricespy/3', 'cpu/userbenchmark', 'cpu/munge',
+		'hdd/pricespy/1', 'hdd/pricespy/2', 'hdd/pricespy/3', 'hdd/userbenchmark', 'hdd/munge']
+	assert tasks[4].deps == ids[:4]
+	assert [task.optional for task in tasks[:5]] == [False, True, True, False, False]
+	assert price.tasks.Task.from_dict(tasks[1].to_dict()).to_dict() == tasks[1].to_dict()
+
+	category = categories('cpu')[0]
+	category.markets = ['nz', 'uk']
+	category.market_pages = {'uk': ('https://pricespy.co.uk/cpu', 'CPU')}
+	tasks = price.tasks.plan([category])
+	assert [task.id for task in tasks] == ['cpu/pricespy/1', 'cpu/pricespy/2', 'cpu/pricespy/3', 'cpu/pricespy_uk/1', 'cpu/pricespy_uk/2',
+		'cpu/pricespy_uk/3', 'cpu/userbenchmark', 'cpu/munge']
+	assert [task.market for task in tasks] == ['nz'] * 3 + ['uk'] * 3 + [None] * 2
+	assert [task.optional for task in tasks] == [False, True, True, True, True, True, False, False]
+
+def test_local_executor(tmp_path):
+	ATTEMPTS.clear()
+	store = price.tasks.LocalStore(str(tmp_path))
+	tasks = price.tasks.plan(categories())
+	result = price.tasks.LocalExecutor(store, handler, workers=4, retry_delay=0).run(tasks)
+	assert sorted(result['ran']) == sorted(task.id for task in tasks)
+	assert ATTEMPTS['cpu/pricespy/2'] == 2 # Retried
+	assert store.get('munged_cpu') == b'cpu_pricespy_1,cpu_pricespy_2,cpu_pricespy_3,cpu_userbenchmark'
+
+	result = price.tasks.LocalExecutor(store, handler, retry_delay=0).run(tasks) # Rerunning is a no-op
+	assert len(result['ran']) == 0
+	assert len(result['skipped']) == len(tasks)
+
+def test_local_executor_failure(tmp_path):
+	store = price.tasks.LocalStore(str(tmp_path))
+	tasks = price.tasks.plan(categories())
+	result = price.tasks.LocalExecutor(store, failing_handler, max_attempts=2, retry_delay=0).run(tasks)
+	assert list(result['failed'].keys()) == ['hdd/userbenchmark']
+	assert result['blocked'] == ['hdd/munge']
+	assert 'cpu/munge' in result['ran']
+
+def test_optional_failure(tmp_path):
+	store = price.tasks.LocalStore(str(tmp_path))
+	tasks = price.tasks.plan(categories('cpu'))
+	broken_page = lambda task, store: handler(task, store) if task.id != 'cpu/pricespy/3' else 1 / 0
+	result = price.tasks.LocalExecutor(store, broken_page, max_attempts=2, retry_delay=0).run(tasks)
+	assert result['failed'] == {}
+	assert 'cpu/munge' in result['ran'] # Not blocked by the optional page
+	assert price.tasks.get_error(store, 'cpu/pricespy/3') == 'division by zero'
+	assert price.tasks.get_error(store, 'cpu/pricespy/2') is None
+	assert store.get('munged_cpu') == b'cpu_pricespy_1,cpu_pricespy_2,cpu_userbenchmark'
+
+def test_local_executor_processes(tmp_path):
+	store = price.tasks.LocalStore(str(tmp_path))
+	tasks = price.tasks.plan(categories('cpu'))
+	result = price.tasks.LocalExecutor(store, handler, workers=2, processes=True, retry_delay=0).run(tasks)
+	assert len(result['ran']) == len(tasks)
+	assert store.exists('munged_cpu')
+
+class FakeSqsClient:
+
+	def __init__(self):
+		self.messages = []
+
+	def send_message(self, QueueUrl, MessageBody):
+		self.messages.append(json.loads(MessageBody))
+
+def test_sqs_queue(tmp_path):
+	ATTEMPTS.clear()
+	sqs_client = FakeSqsClient()
+	queue = price.tasks.SqsQueue(sqs_client, 'https://sqs/queue')
+	store = price.tasks.LocalStore(str(tmp_path))
+	queue.submit('20200314_abc123', store, price.tasks.plan(categories('cpu')))
+	assert [message['task'] for message in sqs_client.messages] == ['cpu/pricespy/1', 'cpu/pricespy/2', 'cpu/pricespy/3', 'cpu/userbenchmark']
+
+	with pytest.raises(Exception):
+		queue.handle({'run': '20200314_abc123', 'task': 'cpu/munge'}, store, handler) # Dependencies haven't finished
+	with pytest.raises(Exception):
+		queue.handle(sqs_client.messages[1], store, handler, receive_count='1') # Flaky page, SQS would redeliver it
+	assert price.tasks.get_error(store, 'cpu/pricespy/2') is None
+	for message in list(sqs_client.messages):
+		queue.handle(message, store, handler)
+	assert sqs_client.messages[-1] == {'run': '20200314_abc123', 'task': 'cpu/munge'}
+	queue.handle(sqs_client.messages[-1], store, handler)
+	queue.handle(sqs_client.messages[-1], store, handler) # Duplicate delivery is skipped
+	assert ATTEMPTS['cpu/munge'] == 1
+	assert store.exists('munged_cpu')
@@ -0,0 +1,71 @@
+import concurrent.futures
+import price.throttle
+import pytest
+import threading
+import time
+
+def test_aimd():
+	controller = price.throttle.HostController('example.com', max_concurrency=4, min_spacing=0)
+	for i in range(10):
+		with controller.request():
+			pass
+	assert controller.stats()['limit'] == 4 # Increased while the host copes
+
+	with controller.request() as request:
+		request.throttled('0.2')
+	stats = controller.stats()
+	assert (stats['limit'], stats['throttled'], stats['requests']) == (2, 1, 11)
+	assert stats['spacing'] > 0
+	start = time.monotonic()
+	with controller.request():
+		pass
+	assert time.monotonic() - start >= 0.15 # Waited for Retry-After
+
+	with pytest.raises(ValueError):
+		with controller.request():
+			raise ValueError('Failed')
+	assert (controller.stats()['limit'], controller.stats()['errors']) == (1.25, 1) # (2 + 1/2) halved
+
+def test_congestion():
+	controller = price.throttle.HostController('example.com', max_concurrency=4, min_spacing=0)
+	controller.latency['page'] = 0.001
+	with controller.request():
+		time.sleep(0.01) # Many times the usual time but too quick to be congestion
+	assert controller.stats()['congested'] == 0
+	with controller.request():
+		time.sleep(price.throttle.MIN_CONGESTION * 1.5)
+	assert controller.stats()['congested'] == 1
+
+def test_deadline():
+	controller = price.throttle.HostController('example.com', min_spacing=0)
+	with controller.request() as request:
+		request.throttled('3600')
+	assert controller.next_start <= time.monotonic() + price.throttle.MAX_SPACING # Retry-After capped
+	start = time.monotonic()
+	with pytest.raises(price.throttle.WaitTimeout):
+		with controller.request(deadline=start + 0.1):
+			pass
+	assert 0.05 <= time.monotonic() - start < 1
+	assert controller.stats()['in_flight'] == 0
+
+def test_concurrency_limited():
+	controller = price.throttle.HostController('example.com', max_concurrency=3, min_spacing=0)
+	controller.limit = 3
+	lock = threading.Lock()
+	in_flight = [0, 0] # Current, most
+	def fetch(i):
+		with controller.request():
+			with lock:
+				in_flight[0] += 1
+				in_flight[1] = max(in_flight)
+			time.sleep(0.02)
+			with lock:
+				in_flight[0] -= 1
+	with concurrent.futures.ThreadPoolExecutor(8) as executor:
+		list(executor.map(fetch, range(24)))
+	assert in_flight[1] == 3
+	assert controller.stats()['in_flight'] == 0
+
+def test_for_url():
+	assert price.throttle.for_url('https://www.userbenchmark.com/page/1') is price.throttle.for_host('www.userbenchmark.com')
+	assert 'www.userbenchmark.com' in [host_stats['host'] for host_stats in price.throttle.stats()]
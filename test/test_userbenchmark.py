@@ -27,6 +27,10 @@ def test_cpu_parse_us():
 	assertPrice('AMD Ryzen 5 1500X', '66.6', data[1])
 	assertPrice('Intel Pentium G4560', '53.7', data[49])
 
+def test_defaults():
+	ub = price.userbenchmark.UserBenchmark(None)
+	assert (ub.url, ub.extra_column) == ('https://cpu.userbenchmark.com/', '1-Core')
+
 def assertPrice(expected_name, expected_perf, actual):
 	assert expected_name == actual['name']
 	assert expected_perf == actual['avg']